@@ -0,0 +1,98 @@
+'''
+Allocation check of the daily loop of the Ecohydrology model.
+
+The daily loop of EcoHyd.stepper() runs 365 times a year for every scenario, so arrays allocated (and freed again) on
+every day add up. The loop writes into grid fields and scratch arrays that are kept between days wherever it can, and
+daily_allocations() measures what is still allocated with tracemalloc (numpy reports its array buffers to it): for
+every simulated day, the peak of the memory allocated on top of what there was at the start of the day (the
+temporaries of the day) and what is still allocated at the end of it. Both are also given in cell arrays, i.e. in
+units of one grid field, which does not depend on the size of the grid. check_allocations() raises if a day allocates
+more than the budget of the backends in use, to catch changes that make the loop allocate more.
+
+With the 'numba' and 'loop' backends (see backends.py), most days allocate less than a tenth of a cell array, and the
+days the PFT changes or an event-driven dry spell starts (see ecohydr_mod.py) up to about 8. The 'numpy' kernels build
+their results from whole-array temporaries, so they have about 30 cell arrays allocated at once every day. With
+config['n_workers'], only the EcoHyd process is measured, not the workers.
+'''
+
+import tracemalloc
+
+import numpy as np
+
+from backends import METHODS
+
+# most cell arrays the soil moisture and vegetation updates of each backend may allocate at once on any day,
+# see check_allocations()
+BUDGETS = {'loop': 12, 'numpy': 40, 'numba': 12}
+
+
+def daily_allocations(model, WSA_array, avg_temp, maximum_temp, minimum_temp):
+    '''
+    Run one model year (as EcoHyd.stepper()) under tracemalloc and measure the memory allocated on each day. The model
+    is put back in the state it was in before, see EcoHyd.get_state().
+
+    Returns
+    -------
+    dict
+        'peak' and 'retained': (days,) arrays of the peak memory allocated during each day above that at its start,
+        and the memory still allocated at its end, in bytes. 'peak_cell_arrays' and 'retained_cell_arrays': the same
+        in cell arrays. 'cell_array': the size of a cell array in bytes.
+    '''
+    state = model.get_state()
+    day_hook = model.day_hook
+    peaks = np.zeros(366, dtype=np.int64)
+    retained = np.zeros(366, dtype=np.int64)
+    day = [0, 0]
+
+    def measure():
+        # (the first day also counts everything stepper() does before the daily loop)
+        current, peak = tracemalloc.get_traced_memory()
+        if day[0] < len(peaks):
+            peaks[day[0]] = peak - day[1]
+            retained[day[0]] = current - day[1]
+        day[0] += 1
+        tracemalloc.reset_peak()
+        day[1] = tracemalloc.get_traced_memory()[0]
+
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        day[1] = tracemalloc.get_traced_memory()[0]
+        model.day_hook = measure
+        model.stepper(WSA_array, avg_temp, maximum_temp, minimum_temp)
+    finally:
+        model.day_hook = day_hook
+        if started:
+            tracemalloc.stop()
+        model.set_state(state)
+
+    n_days = min(day[0], len(peaks))
+    cell_array = model.mg.number_of_cells * model.dtype.itemsize
+    return {'peak': peaks[:n_days], 'retained': retained[:n_days], 'cell_array': cell_array,
+            'peak_cell_arrays': peaks[:n_days] / cell_array, 'retained_cell_arrays': retained[:n_days] / cell_array}
+
+
+def check_allocations(model, WSA_array, avg_temp, maximum_temp, minimum_temp, budget=None):
+    '''
+    Check that no simulated day of a model year allocates more than `budget` cell arrays at once, see
+    daily_allocations(). The budget is that of the backend of the soil moisture and vegetation components with the
+    largest BUDGETS entry by default, plus what the recorder needs at the level it records at.
+
+    Returns the result of daily_allocations(), or raises a RuntimeError.
+    '''
+    allocations = daily_allocations(model, WSA_array, avg_temp, maximum_temp, minimum_temp)
+    if budget is None:
+        methods = {method: backend for backend, method in METHODS.items()}
+        budget = max(BUDGETS[methods[model.methods[component]]] for component in ('soil_moisture', 'vegetation'))
+        # the recorder copies the fields of its series (and groups) into its own buffers in place, but the
+        # grouped means go through np.bincount
+        budget += 2 * sum(len(grouped.fields) for grouped in model.recorder._grouped.values())
+    # the first day also holds what stepper() does before the daily loop (the rainfall and PET of the year)
+    days = allocations['peak_cell_arrays'][1:]
+    if len(days) > 0 and days.max() > budget:
+        raise RuntimeError('day ' + str(int(np.argmax(days)) + 1) + ' of the daily loop allocated ' +
+                           str(round(float(days.max()), 1)) + ' cell arrays at once, more than the budget of ' +
+                           str(budget))
+    return allocations
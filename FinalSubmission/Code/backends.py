@@ -0,0 +1,179 @@
+'''
+Compute backends of the ecohydrology kernels.
+
+The soil moisture and vegetation components and the rainfall aggregation each have three implementations of their
+per-cell (or per-storm) kernel:
+
+ - 'loop': the original loop over cells in Python (method "Grid" of the components). Slow, but closest to the landlab
+   code, so it is the reference.
+ - 'numpy': whole-array NumPy code (method "Vectorized"). The default.
+ - 'numba': the loop kernel compiled with Numba (method "Numba"). Only available if numba is installed.
+
+The backend of each component ('soil_moisture', 'vegetation' or 'rainfall') is picked by select_backend(), from the
+config ('backends': {component: backend} or 'backend' for all components) or else from the environment variables
+ECOHYD_BACKEND_<COMPONENT> (e.g. ECOHYD_BACKEND_SOIL_MOISTURE) and ECOHYD_BACKEND, so each machine can use whatever
+is fastest there without changing the config. A backend that is not available falls back to 'numpy' with a warning.
+benchmark() times the backends (soil moisture, vegetation and rainfall) and checks them against each other.
+'''
+
+import copy
+import os
+import time
+import warnings
+
+import numpy as np
+
+BACKENDS = ('loop', 'numpy', 'numba')
+DEFAULT_BACKEND = 'numpy'
+COMPONENTS = ('soil_moisture', 'vegetation', 'rainfall')
+
+# the method argument of the components (and storms_to_daily_depth) that runs each backend
+METHODS = {'loop': 'Grid', 'numpy': 'Vectorized', 'numba': 'Numba'}
+
+# compiled kernels, by the python function they were compiled from
+_COMPILED = {}
+
+
+def numba_available():
+    '''
+    Whether numba can be imported.
+    '''
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_backends():
+    '''
+    The backends that can run on this machine.
+    '''
+    return tuple(backend for backend in BACKENDS if backend != 'numba' or numba_available())
+
+
+def select_backend(component, config=None):
+    '''
+    Backend to use for `component` (one of COMPONENTS), see the module docstring for where it is set.
+    '''
+    if component not in COMPONENTS:
+        raise ValueError('component must be one of ' + str(COMPONENTS) + ', not ' + repr(component))
+    config = {} if config is None else config
+    backend = (config.get('backends', {}).get(component) or config.get('backend')
+               or os.environ.get('ECOHYD_BACKEND_' + component.upper()) or os.environ.get('ECOHYD_BACKEND')
+               or DEFAULT_BACKEND)
+    if backend not in BACKENDS:
+        raise ValueError('backend must be one of ' + str(BACKENDS) + ', not ' + repr(backend))
+    if backend not in available_backends():
+        warnings.warn(backend + ' backend is not available for ' + component + ', using ' + DEFAULT_BACKEND)
+        backend = DEFAULT_BACKEND
+    return backend
+
+
+def select_method(component, config=None):
+    '''
+    The method argument of `component` for the backend select_backend() picks.
+    '''
+    return METHODS[select_backend(component, config)]
+
+
+def jit(function):
+    '''
+    `function` compiled with numba (once per process, and cached on disk next to this module if possible).
+    '''
+    if function not in _COMPILED:
+        import numba
+        _COMPILED[function] = numba.njit(cache=True)(function)
+    return _COMPILED[function]
+
+
+def benchmark(model, backends=None, n_days=10, n_years=10):
+    '''
+    Time the soil moisture and vegetation updates and the rainfall aggregation of each backend, from the current state
+    of an EcoHyd model (which is not changed), and check them against the 'numpy' backend.
+
+    Parameters
+    ----------
+    model: EcoHyd
+        Model to take the grid fields, the state of the components and the rainfall generators from.
+    backends: list, optional
+        Backends to run, all available ones by default.
+    n_days: int, optional
+        Number of daily updates to run (with the rainfall and PET currently in the fields).
+    n_years: int, optional
+        Number of years of storms to aggregate into daily rainfall (drawn from copies of the model's generators).
+
+    Returns
+    -------
+    dict
+        For each backend a dict with the seconds per daily update of soil moisture and vegetation ('seconds_per_day'),
+        the largest absolute difference of any cell field to the 'numpy' backend after n_days updates
+        ('max_difference'), and the seconds per year of daily rainfall ('rainfall_seconds_per_year') and its largest
+        absolute difference to the 'numpy' backend ('rainfall_max_difference'). The first call of the 'numba' backend
+        includes compiling it.
+    '''
+    # imported here, the components import this module
+    from ecohydr_mod import make_soil_moisture, make_vegetation
+    from generate_uniform_precip import storms_to_daily_depth
+
+    backends = available_backends() if backends is None else backends
+    # the same storms for every backend
+    dry_storms = _storm_tables(model.PD_D, n_years)
+    wet_storms = _storm_tables(model.PD_W, n_years)
+    length = model.canicula_length
+
+    fields = {}
+    rainfall = {}
+    results = {}
+    for backend in [DEFAULT_BACKEND] + [backend for backend in backends if backend != DEFAULT_BACKEND]:
+        grid = _copy_cells(model.mg)
+        SM = make_soil_moisture(grid, METHODS[backend], model.dtype)
+        VEG = make_vegetation(grid, METHODS[backend], model.dtype)
+        SM._current_time = model.SM._current_time
+        VEG._Blive_ini = np.array(model.VEG._Blive_ini, dtype=model.dtype)
+        VEG._Bdead_ini = np.array(model.VEG._Bdead_ini, dtype=model.dtype)
+        start = time.perf_counter()
+        for day in range(n_days):
+            SM.update()
+            VEG.update()
+        seconds_per_day = (time.perf_counter() - start) / max(n_days, 1)
+        fields[backend] = {name: np.array(grid.at_cell[name]) for name in grid.at_cell.keys()}
+
+        # as ecohydr_mod.daily_rainfall() does every year
+        start = time.perf_counter()
+        rainfall[backend] = np.array([
+            storms_to_daily_depth(dry, 365, season_days=length, method=METHODS[backend])
+            + storms_to_daily_depth(wet, 365, offset=length, season_days=365-length, method=METHODS[backend])
+            for dry, wet in zip(dry_storms, wet_storms)])
+        results[backend] = {'seconds_per_day': seconds_per_day,
+                            'rainfall_seconds_per_year': (time.perf_counter() - start) / max(n_years, 1)}
+
+    for backend in backends:
+        results[backend]['max_difference'] = max(
+            np.max(np.abs(fields[backend][name] - fields[DEFAULT_BACKEND][name]), initial=0.)
+            for name in fields[backend])
+        results[backend]['rainfall_max_difference'] = np.max(np.abs(rainfall[backend] - rainfall[DEFAULT_BACKEND]),
+                                                             initial=0.)
+    return {backend: results[backend] for backend in backends}
+
+
+def _storm_tables(precip, n_years):
+    # n_years storm tables from a copy of the generator of a PrecipitationDistribution, which is left as it was
+    precip = copy.copy(precip)
+    precip._rng = copy.deepcopy(precip._rng)
+    return precip.get_storm_event_tables(n_years)
+
+
+def _copy_cells(grid):
+    # a grid with one row of cells holding a copy of the cell fields of `grid`, keeping fields that are the same
+    # array (e.g. the 30-day mean of PET and PET itself) the same array
+    from landlab import RasterModelGrid
+
+    copy = RasterModelGrid((3, grid.number_of_cells + 2))
+    copies = {}
+    for name in grid.at_cell.keys():
+        array = grid.at_cell[name]
+        if id(array) not in copies:
+            copies[id(array)] = array.copy()
+        copy.at_cell[name] = copies[id(array)]
+    return copy
@@ -0,0 +1,105 @@
+'''
+Checkpoints of the coupled model at year boundaries, so a long run can be resumed after a crash.
+
+A checkpoint holds the state of the Ecohydrology model (see EcoHyd.get_state()), the output records accumulated so
+far and the NetLogo world (written with NetLogo's export-world, which includes the random number generator). It is
+written as a compressed .npz file plus the exported world, into one directory per run. Only the latest checkpoint of
+a run is kept.
+'''
+
+import glob
+import os
+import re
+import tempfile
+
+import numpy as np
+
+
+def save_checkpoint(checkpoint_dir, year, Ecohyd_model, netlogo, records, WSA_records, done=False):
+    '''
+    Save the state of a run after `year` model years.
+
+    Parameters
+    ----------
+    checkpoint_dir: str
+        Directory of this run's checkpoints.
+    year: int
+        Number of completed model years.
+    Ecohyd_model: EcoHyd
+        The Ecohydrology model.
+    netlogo: NetLogoLink
+        The NetLogo link running the social model.
+    records: YearRecords
+        Farmer records of the years so far (see record_store.py).
+    WSA_records: list
+        WSA masks recorded so far.
+    done: bool, optional
+        Mark the run as complete (its output has been written), so it is skipped when resuming.
+    '''
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    world_path = os.path.join(checkpoint_dir, "world_" + str(year) + ".csv")
+    netlogo.command('export-world "' + os.path.abspath(world_path).replace("\\", "/") + '"')
+
+    state = {"ecohyd:" + name: value for name, value in Ecohyd_model.get_state().items()}
+    for name, value in records.get_state().items():
+        state["records:" + name] = value
+    state["WSA_records"] = np.array([mask[0] for mask in WSA_records])
+    state["year"] = np.array(year)
+    state["done"] = np.array(done)
+
+    # the .npz file is written last and atomically, so a checkpoint is only picked up once it is complete
+    path = os.path.join(checkpoint_dir, "checkpoint_" + str(year) + ".npz")
+    fd, tmp_path = tempfile.mkstemp(dir=checkpoint_dir, suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez_compressed(f, **state)
+    os.replace(tmp_path, path)
+
+    # only keep the latest checkpoint
+    for old_year in _checkpoint_years(checkpoint_dir):
+        if old_year != year:
+            os.remove(os.path.join(checkpoint_dir, "checkpoint_" + str(old_year) + ".npz"))
+    for old_world in glob.glob(os.path.join(checkpoint_dir, "world_*.csv")):
+        if old_world != world_path:
+            os.remove(old_world)
+
+
+def load_checkpoint(checkpoint_dir, Ecohyd_model, netlogo):
+    '''
+    Restore the latest checkpoint of a run into a freshly set up model.
+
+    Returns
+    -------
+    dict or None
+        None if there is no checkpoint, otherwise a dict with the number of completed model years ('year'),
+        whether the run is complete ('done'), the recorded farmer data ('records', to pass to YearRecords.set_state())
+        and WSA masks ('WSA_records').
+    '''
+    years = _checkpoint_years(checkpoint_dir)
+    if len(years) == 0:
+        return None
+    year = max(years)
+
+    with np.load(os.path.join(checkpoint_dir, "checkpoint_" + str(year) + ".npz")) as f:
+        state = {name: f[name] for name in f.files}
+
+    Ecohyd_model.set_state({name[len("ecohyd:"):]: value for name, value in state.items()
+                            if name.startswith("ecohyd:")})
+    world_path = os.path.join(checkpoint_dir, "world_" + str(year) + ".csv")
+    netlogo.command('import-world "' + os.path.abspath(world_path).replace("\\", "/") + '"')
+
+    records = {name[len("records:"):]: value for name, value in state.items() if name.startswith("records:")}
+    return {
+        "year": int(state["year"]),
+        "done": bool(state["done"]),
+        "records": records,
+        "WSA_records": [[mask] for mask in state["WSA_records"]],
+    }
+
+
+def _checkpoint_years(checkpoint_dir):
+    years = []
+    for path in glob.glob(os.path.join(checkpoint_dir, "checkpoint_*.npz")):
+        match = re.fullmatch(r"checkpoint_(\d+)\.npz", os.path.basename(path))
+        if match:
+            years.append(int(match.group(1)))
+    return years
@@ -2,19 +2,347 @@
 This is a module for the Ecohydrology model that can be imported from the main driver/coupler notebook.
 '''
 
+import json
+
 import numpy as np
 from landlab import RasterModelGrid 
 from landlab.components import (Radiation, PotentialEvapotranspiration)
-from generate_uniform_precip import PrecipitationDistribution
+from generate_uniform_precip import PrecipitationDistribution, storms_to_daily_depth
 from vegetation_dynamics import Vegetation
 from soil_moisture_dynamics import SoilMoisture
+from radiation_cache import RadiationCache
+from pet_forcing import PETForcing
+from recorder import TimeSeriesRecorder
+from grouping import CellGroups
+from parallel_ecohyd import TileWorkers
+from backends import COMPONENTS, select_method
+
+# cell fields recorded for each group by default when a grouping is added
+GROUPED_FIELDS = ('soil_moisture__saturation_fraction', 'vegetation__live_biomass', 'surface__evapotranspiration',
+                  'vegetation__water_stress')
+
+# default size of the domain: number of cells (= fields) in each direction (rows, columns), side length of the 
+# cells in m and number of farmers. Set 'grid_shape', 'cell_size' and 'n_farmers' in the config to change them.
+DEFAULT_GRID_SHAPE = (51, 51)
+DEFAULT_CELL_SIZE = 70.
+DEFAULT_N_FARMERS = 800
+
+# floating point types the grid fields, component arrays and recorded output can be kept in. Set 'dtype' in the 
+# config to 'float32' to halve their memory use, at a small loss of precision (see readme.txt for how small).
+DTYPES = ('float64', 'float32')
+
+
+def domain_config(config):
+    '''
+    Return the grid shape (rows, columns of cells), cell size (m) and number of farmers set in a config.
+    '''
+    grid_shape = tuple(int(n) for n in config.get('grid_shape', DEFAULT_GRID_SHAPE))
+    return grid_shape, float(config.get('cell_size', DEFAULT_CELL_SIZE)), int(config.get('n_farmers', DEFAULT_N_FARMERS))
+
+
+def state_dtype(config):
+    '''
+    Floating point type of the grid fields, component arrays and recorded output set in a config (one of DTYPES).
+    '''
+    dtype = str(config.get('dtype', 'float64'))
+    if dtype not in DTYPES:
+        raise ValueError('dtype must be one of ' + str(DTYPES) + ', not ' + repr(dtype))
+    return np.dtype(dtype)
+
+
+def cast_cell_fields(grid, dtype):
+    '''
+    Convert the floating point cell fields of `grid` to `dtype`, keeping fields that are the same array (e.g. the 
+    30-day mean of PET and PET itself) the same array. Integer fields (the PFT) are left as they are.
+    '''
+    cast = {}
+    for name in list(grid.at_cell.keys()):
+        array = grid.at_cell[name]
+        if array.dtype.kind != 'f' or array.dtype == dtype:
+            continue
+        if id(array) not in cast:
+            cast[id(array)] = array.astype(dtype)
+        grid.at_cell[name] = cast[id(array)]
+
+
+def estimate_memory(config, n_years=1):
+    '''
+    Rough peak memory (in bytes) of an EcoHyd model with this config run for n_years, to plan runs on big domains. 
+    Per cell, it is dominated by the radiation table (366 days), the yearly PET matrix and its temporaries 
+    (2 x 365 days), the running mean of PET if switched on (another 4 x 365) and the recorded cell values at 
+    record level 'full' (2 x 365 per year), next to ~200 values in grid fields and component parameters. All but 
+    the radiation table and the temporaries of the PET matrices are kept in the dtype of the config.
+    '''
+    grid_shape, _, _ = domain_config(config)
+    itemsize = state_dtype(config).itemsize
+    bytes_per_cell = 8*(366 + 365) + itemsize*(200 + 365)
+    if config.get('pet_30day_running_mean', False):
+        bytes_per_cell += 8*3*365 + itemsize*365
+    if config.get('record_level', 'daily') == 'full':
+        bytes_per_cell += itemsize*2*(365*n_years + 1)
+    return bytes_per_cell * grid_shape[0] * grid_shape[1]
+
+
+def make_precipitation(grid, config, seed):
+    '''
+    Instantiate the rainfall generators of the dry (canicula) and wet season, seeded with `seed`.
+    '''
+    canicula_length = config['canicula_end'] - config['canicula_start']
+    # each season gets its own random number generator, spawned from the seed, so runs with the same seed are 
+    # reproducible and runs with different seeds are independent
+    dry_seed, wet_seed = np.random.SeedSequence(seed).spawn(2)
+    PD_D = PrecipitationDistribution(grid, mean_storm_duration=config['mean_storm_dry'], 
+                                     mean_interstorm_duration=config['mean_interstorm_dry'],
+                                     mean_storm_depth=config['mean_raindpth_dry'], 
+                                     total_t=canicula_length*24,
+                                     rng=np.random.default_rng(dry_seed))
+
+    PD_W = PrecipitationDistribution(grid, mean_storm_duration=config['mean_storm_wet'], 
+                                     mean_interstorm_duration=config['mean_interstorm_wet'],
+                                     mean_storm_depth=config['mean_raindpth_wet'], 
+                                     total_t=(365-canicula_length)*24,
+                                     rng=np.random.default_rng(wet_seed))
+    return PD_D, PD_W
+
+
+def daily_rainfall(PD_D, PD_W, canicula_length, method="Vectorized"):
+    '''
+    Daily rainfall depth (mm) of the next model year from the rainfall generators of the dry and wet season 
+    (method is that of storms_to_daily_depth, see backends.py).
+    '''
+    #generate precipitation time series (a fresh table of storms for this year only)
+    PD_raw = PD_D.get_storm_event_tables()[0]
+    PW_raw = PD_W.get_storm_event_tables()[0]
+
+    #put data into useful format: split the depth of each storm across the days it covers
+    P = storms_to_daily_depth(PD_raw, 365, season_days=canicula_length, method=method)
+    P += storms_to_daily_depth(PW_raw, 365, offset=canicula_length, season_days=365-canicula_length, method=method)
+    return P
+
+
+def make_soil_moisture(grid, method="Vectorized", dtype=float):
+    '''
+    Instantiate the soil moisture component as used by EcoHyd on a grid that has all its input fields (method 
+    picks the implementation, see backends.py, and dtype is that of the fields, see state_dtype()).
+    '''
+    # the component only accepts fields of its own dtype, and adds its outputs as float64
+    cast_cell_fields(grid, dtype)
+    # the vectorized method matches the per-cell loop but solves the whole grid at once
+    SM = SoilMoisture(grid, method=method, dtype=dtype)
+    SM.initialize()
+    cast_cell_fields(grid, dtype)
+    return SM
+
+
+def make_vegetation(grid, method="Vectorized", dtype=float):
+    '''
+    Instantiate the vegetation component as used by EcoHyd on a grid that has all its input fields (method picks 
+    the implementation, see backends.py, and dtype is that of the fields, see state_dtype()).
+    '''
+    # (fields of the dtype of the component, as in make_soil_moisture())
+    cast_cell_fields(grid, dtype)
+    # we meant to decrease the ET threshold from the default value of 3.8 to 3. bc that meant farmers on N-facing 
+    # slopes had huge losses, but the full VEG.initialize() on the first day of the canicula reset it to the 
+    # default, so all our runs used 3.8. The PFT updates in the stepper keep the value passed here, so we pass 
+    # 3.8 explicitly to keep results unchanged.
+    VEG = Vegetation(grid, PETthreshold_switch=1, ETthreshold_up=3.8, method=method, dtype=dtype)
+    cast_cell_fields(grid, dtype)
+    return VEG
+
+
+def run_days(config, grid, SM, VEG, current_time, P, pet, pet30, functype_growing, functype_nongrowing, WS, 
+             after_day=None, members=1):
+    '''
+    The daily loop of EcoHyd.stepper() on `grid` and its components, for every row of the rainfall P and PET 
+    matrices (pet30 can be None to leave the 30-day mean of PET as it is). The fields and the water stress WS are 
+    updated in place, so this runs the same on a whole grid as on a slice of it (see parallel_ecohyd.py).
+
+    The cells of the grid can hold several members of an ensemble, one after the other (see ensemble.py). The rows 
+    of the rainfall and PET are then broadcast against the (members x cells) fields, so e.g. each member can have 
+    its own rainfall and all share the same PET.
+
+    Returns the current time after the last day, the current time after every day and the soil moisture at the end 
+    of the canicula.
+    '''
+    times = []
+    SM_canic_end = None
+    # with config['event_driven_dry_spells'], rain-free spells without any vegetation dynamics are stepped in one go
+    # (see _dry_spell_length())
+    event_driven = config.get('event_driven_dry_spells', False)
+    i = 0
+    while i < len(P):
+        # Update objects
+
+        # Calculate Day of Year
+        Julian = int(np.floor((current_time - np.floor(current_time)) * 365.0))
+        #print(Julian)
+        #print(current_time)
+
+        # At the start of the canicula, harvest all fields and change the PFT to bare soil on 
+        # non-WSA fields and cover crop on WSA fields
+        if Julian == config['canicula_start_expected']:
+            grid.at_cell['vegetation__plant_functional_type'][:] = functype_nongrowing
+            #need to re-initialize the components for them to recognise the new PFT. Only cells whose PFT 
+            #changed get new parameters and have their biomass reset (harvested).
+            SM.update_plant_functional_type()
+            VEG.update_plant_functional_type(Blive_init=10.0, Bdead_init=450.0)
+
+        # At the end of the canicula, harvest WSA fields and set all PFT back to grass
+        if Julian == config['canicula_end_expected']:
+            grid.at_cell['vegetation__plant_functional_type'][:] = functype_growing
+            #print(grid.at_cell['vegetation__plant_functional_type'])
+            #record soil moisture at end of canicula to see if WSA makes a difference
+            SM_canic_end = grid.at_cell['soil_moisture__saturation_fraction'].copy()
+            SM.update_plant_functional_type()
+            VEG.update_plant_functional_type(Blive_init=10.0, Bdead_init=450.0)
+
+        if event_driven:
+            n_days = _dry_spell_length(config, grid, SM, P, pet, i, members)
+            if n_days > 1:
+                current_time = _step_dry_spell(grid, SM, VEG, pet, pet30, i, n_days, WS, times, after_day, members)
+                i += n_days
+                continue
+
+        # do first harvest at the end of the first maize crop cycle (100 days)
+        #if Julian == config['canicula_end_expected'] + 100:
+        #    biomass = grid.at_cell['vegetation__live_biomass'].copy()
+        #    VEG.initialize(Blive_init=10.0)
+            
+        # PET for each field on this day of the year
+        _members_view(grid, 'surface__potential_evapotranspiration_rate', members)[:] = pet[i]
+        if pet30 is not None:
+            _members_view(grid, 'surface__potential_evapotranspiration_30day_mean', members)[:] = pet30[i]
+
+        # Assign spatial rainfall data
+        _members_view(grid, "rainfall__daily_depth", members)[:] = P[i]
+
+        # Update soil moisture component
+        current_time = SM.update()
+
+        # Update vegetation component
+        VEG.update()
+
+        # Update yearly cumulative water stress data
+        WS += (grid["cell"]["vegetation__water_stress"]) # need multiply this by time step in days if dt!=1day
+
+        # Record time 
+        times.append(current_time)
+
+        #write time series output for soil moisture and biomass
+        if after_day is not None:
+            after_day()
+
+        i += 1
+
+    return current_time, times, SM_canic_end
+
+
+def _members_view(grid, name, members):
+    # (members x cells) view of a cell field, see run_days()
+    return grid.at_cell[name].reshape(members, -1)
+
+
+def _julian(time):
+    # day of the year of a time in years, as in run_days()
+    return int(np.floor((time - np.floor(time)) * 365.0))
+
+
+def _dry_spell_length(config, grid, SM, P, pet, start, members=1):
+    '''
+    Number of days from day `start` on that can be stepped at once by _step_dry_spell(): days without rain, on 
+    which no cell has vegetation dynamics (all cells are bare or cover crop and their biomass has been cleared, which 
+    is the case all through the canicula), that are not PFT switch days and on which the maximum ET rate of every 
+    cell (see SoilMoisture.max_evapotranspiration()) is within config['event_pet_tolerance'] (relative, 0.05 by 
+    default) of that on day `start`. 1 if day `start` has to be a daily step.
+    '''
+    pft = grid.at_cell['vegetation__plant_functional_type']
+    if (np.any(P[start] != 0) or not np.all((pft == 3) | (pft == 6)) 
+            or np.any(grid.at_cell['vegetation__live_biomass']) or np.any(grid.at_cell['vegetation__dead_biomass'])):
+        return 1
+
+    def max_evapotranspiration(day):
+        # for the PET of a day as run_days() writes it to the field
+        return SM.max_evapotranspiration(np.broadcast_to(pet[day], (members, len(pft) // members)).ravel())
+
+    # the tolerance is on the maximum ET the soil loses water at rather than PET itself: on cover crop, this is PET 
+    # less the evaporative inhibition, so small changes in PET are big changes in the drydown
+    ETmax = max_evapotranspiration(start)
+    tolerance = config.get('event_pet_tolerance', 0.05) * ETmax
+    switch_days = (config['canicula_start_expected'], config['canicula_end_expected'])
+
+    # replay the clock of the daily loop, where the day of the year of a day comes from the time returned by the 
+    # soil moisture update of the day before
+    step = (SM._Tb + SM._Tr) / (24.0 * 365.)
+    time = SM._current_time
+    n_days = 1
+    while start + n_days < len(P):
+        day = start + n_days
+        if (_julian(time) in switch_days or np.any(P[day] != 0) 
+                or np.any(np.abs(max_evapotranspiration(day) - ETmax) > tolerance)):
+            break
+        time += step
+        n_days += 1
+    return n_days
+
+
+def _step_dry_spell(grid, SM, VEG, pet, pet30, start, n_days, WS, times, after_day=None, members=1):
+    '''
+    Step the soil moisture of days start to start + n_days - 1 (see _dry_spell_length()) in one go: the analytical 
+    drydown of SoilMoisture over the whole spell, with the mean PET of the spell. The vegetation fields do not change 
+    over such a spell, so the vegetation is updated only once. Appends the time of every day to `times` as the daily 
+    loop does and returns the current time after the last day.
+
+    Compared to daily steps, only the PET varies less within the spell, and the water stress (added to WS for every 
+    day) is that of the whole spell. The evapotranspiration and leakage fields are the daily means over the spell. 
+    after_day() is called once for every day of the spell, with the soil moisture at the end of the spell but the PET 
+    and rainfall of that day, and with spell_interior=True on all days but the last, so the recorder can mark them 
+    (see recorder.py).
+    '''
+    days = slice(start, start + n_days)
+    _members_view(grid, 'surface__potential_evapotranspiration_rate', members)[:] = np.mean(pet[days], axis=0)
+    grid.at_cell["rainfall__daily_depth"][:] = 0.
+
+    # the time of every day as if stepped daily (one step at a time, so the days of the year come out the same)
+    step = (SM._Tb + SM._Tr) / (24.0 * 365.)
+    time = SM._current_time
+    for day in range(n_days):
+        times.append(time)
+        time += step
+
+    Tb = SM._Tb
+    SM._Tb = Tb * n_days
+    try:
+        SM.update()
+    finally:
+        SM._Tb = Tb
+    SM._current_time = time
+    grid.at_cell['surface__evapotranspiration'] /= n_days
+    grid.at_cell['soil_moisture__root_zone_leakage'] /= n_days
+    VEG.update()
+    WS += n_days * grid.at_cell['vegetation__water_stress']
+
+    for day in range(start, start + n_days):
+        _members_view(grid, 'surface__potential_evapotranspiration_rate', members)[:] = pet[day]
+        if pet30 is not None:
+            _members_view(grid, 'surface__potential_evapotranspiration_30day_mean', members)[:] = pet30[day]
+        if after_day is not None:
+            after_day(day < start + n_days - 1)
+    return times[-1]
 
 
 class EcoHyd:
+    # number of members of an ensemble run on the grid at once, see ensemble.py
+    n_members = 1
+
     def __init__(self, config, init_min_T, init_max_T, init_avg_T):
 
         self.config = config
 
+        # each worker process would pick the dry spells of its own tile, so the results would depend on the number 
+        # of workers (see parallel_ecohyd.py)
+        if self.config.get('event_driven_dry_spells', False) and self.config.get('n_workers', 1) > 1:
+            raise ValueError('event_driven_dry_spells is not supported with n_workers > 1')
+
         self.canicula_length = self.config['canicula_end']-self.config['canicula_start']
 
         # Represent current time in years (N.B. this is a float, so 0.5 would be mid-June of the first model year)
@@ -29,22 +357,35 @@ class EcoHyd:
 
         self.Time = [] #empty list to record timestamps at which calculations are made in main loop 
 
-        #set up grid of size 53*53. This will result in 51*51 cells plus a rim of nodes around them (hence 53*53).
+        # implementation (method) of the soil moisture, vegetation and rainfall kernels, picked from the config or 
+        # the environment (see backends.py)
+        self.methods = {component: select_method(component, self.config) for component in COMPONENTS}
+
+        # floating point type of the grid fields, component arrays and recorded output ('float64' unless 
+        # config['dtype'] is 'float32')
+        self.dtype = state_dtype(self.config)
+
+        #set up grid of size 53*53 by default. This will result in 51*51 cells plus a rim of nodes around them (hence 53*53).
         #the inputs and outputs we need to pass all live on cells, not nodes. 
         #We define the side length of grid cells to be 70m - this corresponds to an average farm being about 1.5 
         #hectares and consisting of 3.25 fields. 
-        self.mg = RasterModelGrid((53, 53), 70.)
+        #(the number of cells and their size can be changed with 'grid_shape' and 'cell_size' in the config)
+        grid_shape, cell_size, _ = domain_config(self.config)
+        self.mg = RasterModelGrid((grid_shape[0] + 2, grid_shape[1] + 2), cell_size)
 
         #let's try to add an idealised elevation profile to this grid.
-        valley = np.zeros((53,53))
-
+        #on other grid sizes, the valley is stretched so it keeps the same relief between its centre and the edge 
+        #nodes (27 nodes away on the default grid) instead of getting steeper further out
+        cx = grid_shape[1] // 2
+        cy = grid_shape[0] // 2
+        rx = grid_shape[1] + 1 - cx
+        ry = grid_shape[0] + 1 - cy
         def valleyfunc(x, y):
-            e = 0.08*(x-25)**2 - 0.08*(y-25)**2 + 60
+            e = 0.08*(27/rx)**2*(x-cx)**2 - 0.08*(27/ry)**2*(y-cy)**2 + 60
             return e
 
-        for x in np.arange(0, 53, 1):
-            for y in np.arange(0, 53, 1):
-                valley[y][x] = valleyfunc(x,y)
+        x, y = np.meshgrid(np.arange(0, grid_shape[1] + 2), np.arange(0, grid_shape[0] + 2))
+        valley = valleyfunc(x, y)
 
         #valley = np.zeros((53,53))
 
@@ -55,20 +396,16 @@ class EcoHyd:
 
         #---------------------------#
         #generate precipitation data#
-        self.PD_D = PrecipitationDistribution(self.mg, mean_storm_duration=self.config['mean_storm_dry'], 
-                                              mean_interstorm_duration=self.config['mean_interstorm_dry'],
-                                              mean_storm_depth=self.config['mean_raindpth_dry'], 
-                                              total_t=self.canicula_length*24)
-
-        self.PD_W = PrecipitationDistribution(self.mg, mean_storm_duration=self.config['mean_storm_wet'], 
-                                              mean_interstorm_duration=self.config['mean_interstorm_wet'],
-                                              mean_storm_depth=self.config['mean_raindpth_wet'], 
-                                              total_t=(365-self.canicula_length)*24)
+        # seeded with the (optional) seed in the config
+        self.PD_D, self.PD_W = make_precipitation(self.mg, self.config, self.config.get('random_seed', 0))
 
         #-------------------------------#
         #instantiate radiation component#
         self.rad = Radiation(self.mg, current_time=self.current_time)
         self.rad.update()
+        # radiation only depends on the day of the year, so look it up from a table computed once per grid 
+        # (and stored in config['radiation_cache_dir'] if given) instead of recomputing it every day
+        self.rad_cache = RadiationCache(self.rad, cache_dir=self.config.get('radiation_cache_dir'))
 
         #--------------------------------------------------#
         #instantiate Potential Evapotranspiration Component#
@@ -81,6 +418,12 @@ class EcoHyd:
         self.PET.update() 
         #running this initialises the output fields on the grid (which the soil moisture component needs)
 
+        # during the year, PET comes from matrices computed for the whole year at once from the temperatures and 
+        # the cached radiation table (see pet_forcing.py), instead of from daily PET.update() calls
+        self.PET_forcing = PETForcing(self.PET, self.rad_cache, 
+                                      running_mean=self.config.get('pet_30day_running_mean', False), 
+                                      dtype=self.dtype)
+
         #-----------------------------------#
         #instantiate Soil Moisture Component#
 
@@ -98,8 +441,7 @@ class EcoHyd:
                                                             # "classification of plants (int), grass=0, shrub=1, tree=2, "
                                                             #"bare=3, shrub_seedling=4, tree_seedling=5" - i.e., just let everything be 'grass'.
 
-        self.SM = SoilMoisture(self.mg)
-        self.SM.initialize()
+        self.SM = make_soil_moisture(self.mg, self.methods['soil_moisture'], self.dtype)
 
         #--------------------------------#
         #Instantiate Vegetation Component#
@@ -107,9 +449,13 @@ class EcoHyd:
         #again we need to initialise some fields to get this to run
         self.mg.at_cell['surface__potential_evapotranspiration_30day_mean'] = self.mg.at_cell['surface__potential_evapotranspiration_rate'] 
                         # set the mean equal to the initial value (is this sensible?)
+        # N.B. this makes the '30 day mean' the same array as the daily PET, so it just follows the daily value. Set 
+        # config['pet_30day_running_mean'] to True to use an actual 30-day running mean instead.
+        if self.config.get('pet_30day_running_mean', False):
+            self.mg.at_cell['surface__potential_evapotranspiration_30day_mean'] = \
+                self.mg.at_cell['surface__potential_evapotranspiration_rate'].copy()
         self.mg.at_cell['surface__WSA_soilhealth'] = np.ones(self.mg.number_of_cells) 
-        # decrease ET threshold from the default value of 3.8 bc that meant farmers on N-facing slopes had huge losses
-        self.VEG = Vegetation(self.mg, PETthreshold_switch=1, ETthreshold_up=3.)
+        self.VEG = make_vegetation(self.mg, self.methods['vegetation'], self.dtype)
 
 
         # finally, we define a lower bound for WSA_soilhealth (probs just 1) and an upper bound 
@@ -121,18 +467,162 @@ class EcoHyd:
 
         #-------------------------------#
         # initialise output time series #
-        self.WSA_SM_tseries = [np.mean(self.mg.at_cell['soil_moisture__saturation_fraction'])]
-        self.noWSA_SM_tseries = [np.mean(self.mg.at_cell['soil_moisture__saturation_fraction'])]
-        self.WSA_biomass_tseries = [np.mean(self.mg.at_cell['vegetation__live_biomass'])]
-        self.noWSA_biomass_tseries = [np.mean(self.mg.at_cell['vegetation__live_biomass'])]
-        self.ET30_tseries = [np.mean(self.mg.at_cell['surface__potential_evapotranspiration_30day_mean'])]
-        self.rain_tseries = [np.mean(self.mg.at_cell['rainfall__daily_depth'])]
+        # the recorder preallocates its buffers for config['record_years'] years, and config['record_level'] sets 
+        # what it records: 'off', 'yearly' (means), 'daily' (the time series below) or 'full' (also every cell)
+        self.recorder = TimeSeriesRecorder(self.mg.number_of_cells, level=self.config.get('record_level', 'daily'),
+                                           n_years=self.config.get('record_years', 1), days_per_year=self.n, 
+                                           dtype=self.dtype)
+        self.recorder.record_initial(self.mg)
+
+        # groupings of cells for grouped statistics, by name (see add_grouping())
+        self.groupings = {}
+
+        # worker processes for config['n_workers'] > 1, started by the first call to stepper()
+        self.parallel = None
+
+        # PFT of every cell in the growing and in the dry season, allocated by the first call to stepper() and 
+        # rewritten in place every year
+        self._functype_growing = None
+        self._functype_nongrowing = None
+
+        # function called after every simulated day of stepper() besides the recorder, if any (e.g. by 
+        # alloc_check.py)
+        self.day_hook = None
+
+    # daily output time series (means over WSA or non-WSA fields, or the whole grid), copies of what was recorded so far
+    @property
+    def WSA_SM_tseries(self):
+        return self.recorder.series('WSA_SM_tseries')
+
+    @property
+    def noWSA_SM_tseries(self):
+        return self.recorder.series('noWSA_SM_tseries')
+
+    @property
+    def WSA_biomass_tseries(self):
+        return self.recorder.series('WSA_biomass_tseries')
+
+    @property
+    def noWSA_biomass_tseries(self):
+        return self.recorder.series('noWSA_biomass_tseries')
+
+    @property
+    def ET30_tseries(self):
+        return self.recorder.series('ET30_tseries')
+
+    @property
+    def rain_tseries(self):
+        return self.recorder.series('rain_tseries')
         
 
+    def close(self):
+        '''
+        Stop the worker processes of a parallel model (config['n_workers'] > 1). The model can still be stepped 
+        afterwards, which starts new workers.
+        '''
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    #--------------------#
+    # grouped statistics #
+    #--------------------#
+
+    def add_grouping(self, name, group_index, fields=GROUPED_FIELDS):
+        '''
+        Define groups of cells (e.g. farmers, WSA status or topographic bands, see grouping.py) by the group label of 
+        every cell, in grid cell order. From then on, the recorder also keeps the daily and yearly means of `fields` 
+        for each group (pass fields=() to skip this), and group_stats() gives statistics of any cell field.
+        '''
+        self.groupings[name] = CellGroups(group_index)
+        if len(self.groupings[name].codes) != self.mg.number_of_cells:
+            raise Exception('sorry, group index provided has wrong size for the grid')
+        if len(fields) > 0:
+            self.recorder.add_groups(name, self.groupings[name], fields)
+        return self.groupings[name]
+
+    def group_stats(self, name, field):
+        '''
+        Labels, sums, counts and means over the groups of grouping `name` of the current values of cell `field`.
+        '''
+        groups = self.groupings[name]
+        sums = groups.sum(self.mg.at_cell[field])
+        return groups.labels, sums, groups.counts, sums / groups.counts
+
+    #-------------------#
+    # save/restore state #
+    #-------------------#
+
+    def get_state(self):
+        '''
+        Return everything the next call to stepper() depends on as a flat dict of numpy arrays (so it can be saved 
+        with np.savez), see set_state().
+        '''
+        state = {}
+        # grid fields, including soil moisture, biomass and soil health
+        for name in self.mg.at_cell.keys():
+            state['cell:' + name] = self.mg.at_cell[name].copy()
+        # component internals that are not grid fields
+        state['VEG_Blive_ini'] = np.array(self.VEG._Blive_ini, copy=True)
+        state['VEG_Bdead_ini'] = np.array(self.VEG._Bdead_ini, copy=True)
+        state['SM_current_time'] = np.array(self.SM._current_time)
+        state['PET_tail'] = self.PET_forcing._tail.copy()
+        # the bit generator state holds integers too large for numpy, so keep it as a json string
+        state['PD_D_rng'] = np.array(json.dumps(self.PD_D.rng.bit_generator.state))
+        state['PD_W_rng'] = np.array(json.dumps(self.PD_W.rng.bit_generator.state))
+        # time stepper bookkeeping and output time series
+        state['current_time'] = np.array(self.current_time)
+        state['WS'] = np.array(self.WS, copy=True)
+        state['Time'] = np.array(self.Time)
+        for name, value in self.recorder.get_state().items():
+            state['recorder:' + name] = value
+        return state
+
+    def set_state(self, state):
+        '''
+        Restore a state returned by get_state() from a model with the same grid and config.
+        '''
+        for key, value in state.items():
+            if not key.startswith('cell:'):
+                continue
+            name = key[len('cell:'):]
+            if name in self.mg.at_cell:
+                # write in place, the components (and the 30-day PET alias) hold references to these arrays
+                self.mg.at_cell[name][:] = value
+            else:
+                self.mg.add_field(name, np.array(value), at='cell')
+        # pick up the restored PFT in the parameters of both components (without resetting any biomass)
+        self.SM.update_plant_functional_type()
+        self.VEG.update_plant_functional_type()
+        self.VEG._Blive_ini = np.array(state['VEG_Blive_ini'], dtype=self.dtype, copy=True)
+        self.VEG._Bdead_ini = np.array(state['VEG_Bdead_ini'], dtype=self.dtype, copy=True)
+        # (the current_time setter of landlab components only lets time move forward, so set it directly)
+        self.SM._current_time = float(state['SM_current_time'])
+        self.PET_forcing._tail = np.array(state['PET_tail'], copy=True)
+        self.PD_D.rng.bit_generator.state = json.loads(str(state['PD_D_rng']))
+        self.PD_W.rng.bit_generator.state = json.loads(str(state['PD_W_rng']))
+        self.current_time = float(state['current_time'])
+        self.WS = np.array(state['WS'], copy=True) if np.ndim(state['WS']) else float(state['WS'])
+        self.Time = list(state['Time'])
+        self.recorder.set_state({key[len('recorder:'):]: value for key, value in state.items() 
+                                 if key.startswith('recorder:')})
+
+
     #--------------#
     # time stepper #
     #--------------#
 
+    def _after_day(self, spell_interior=False):
+        # called after every day of the daily loop (see recorder.py for spell_interior)
+        if self.recorder.level != 'off':
+            self.recorder.record(self.mg, spell_interior)
+        if self.day_hook is not None:
+            self.day_hook()
+
+    def _rainfall(self):
+        # daily rainfall of the coming model year
+        return daily_rainfall(self.PD_D, self.PD_W, self.canicula_length, self.methods['rainfall'])
+
     def stepper(self, WSA_array, avg_temp, maximum_temp, minimum_temp):
         '''
         Run a one-year loop of the Ecohydrology model at a daily time step.
@@ -146,113 +636,60 @@ class EcoHyd:
         #plots. In both cases, the biomass would have to be reset to zero at the beginning and end
         #of the dry season/whenever the crop is changed. 
 
+        if self._functype_growing is None or len(self._functype_growing) != self.mg.number_of_cells:
+            self._functype_growing = np.zeros(self.mg.number_of_cells, dtype=int)
+            self._functype_nongrowing = np.zeros(self.mg.number_of_cells, dtype=int)
+
         #set functional type to 0 everywhere in growing season
-        functype_growing = 0*np.ones(self.mg.number_of_cells).astype(int)
+        functype_growing = self._functype_growing
+        functype_growing[:] = 0
 
         #set functional type according to mask in non-growing season
-        functype_nongrowing = 6*np.ones(WSA_array.shape).astype(int)
-        functype_nongrowing[WSA_array == 0] = int(3)
-        functype_nongrowing = functype_nongrowing.flatten()
-        if len(functype_nongrowing) != self.mg.number_of_cells:
-            print('grid size: ', self.mg.number_of_cells, 'wsa size:', len(functype_nongrowing))
+        if np.size(WSA_array) != self.mg.number_of_cells:
+            print('grid size: ', self.mg.number_of_cells, 'wsa size:', np.size(WSA_array))
             raise Exception('sorry, WSA array provided has wrong shape for the grid')
+        functype_nongrowing = self._functype_nongrowing
+        functype_nongrowing[:] = 6
+        functype_nongrowing[np.ravel(WSA_array) == 0] = 3
         
         #generate precipitation time series
-        PD_raw = self.PD_D.get_storm_time_series()
-        PW_raw = self.PD_W.get_storm_time_series()
-
-        #put data into useful format
-        self.P = np.zeros(365)
-        # Iterate over each rainfall event and update the daily precipitation
-        for i in range(len(PD_raw)):
-            # Distribute the intensity over the corresponding days
-            start_day = int(PD_raw[i][0]) // 24
-            end_day = int(PD_raw[i][1]) // 24
-            if end_day <= self.canicula_length:
-                self.P[start_day:end_day+1] = PD_raw[i][2]*24
-
-        for i in range(len(PW_raw)):
-            # Distribute the intensity over the corresponding days
-            start_day = int(PW_raw[i][0]) // 24 + self.canicula_length
-            end_day = int(PW_raw[i][1]) // 24 + self.canicula_length
-            if end_day <= 365:
-                self.P[start_day:end_day+1] = PW_raw[i][2]*24  
+        self.P = self._rainfall()
 
         #print(self.P)      
 
+        # the WSA masks for the output time series only change once a year
+        self.recorder.start_year(WSA_array)
 
-        for i in range(0, 365):
-            # Update objects
-
-            # Calculate Day of Year
-            Julian = int(np.floor((self.current_time - np.floor(self.current_time)) * 365.0))
-            #print(Julian)
-            #print(self.current_time)
-
-            # At the start of the canicula, harvest all fields and change the PFT to bare soil on 
-            # non-WSA fields and cover crop on WSA fields
-            if Julian == self.config['canicula_start_expected']:
-                self.mg.at_cell['vegetation__plant_functional_type'] = functype_nongrowing
-                #need to re-initialize SM component for it to recognise new PFT
-                self.SM.initialize()
-                self.VEG.initialize(Blive_init=10.0)
-
-            # At the end of the canicula, harvest WSA fields and set all PFT back to grass
-            if Julian == self.config['canicula_end_expected']:
-                self.mg.at_cell['vegetation__plant_functional_type'] = functype_growing
-                #print(self.mg.at_cell['vegetation__plant_functional_type'])
-                #record soil moisture at end of canicula to see if WSA makes a difference
-                SM_canic_end = self.mg.at_cell['soil_moisture__saturation_fraction'].copy()
-                self.SM.initialize()
-                self.VEG.initialize(Blive_init=10.0)
-
-            # do first harvest at the end of the first maize crop cycle (100 days)
-            #if Julian == self.config['canicula_end_expected'] + 100:
-            #    biomass = self.mg.at_cell['vegetation__live_biomass'].copy()
-            #    self.VEG.initialize(Blive_init=10.0)
-                
-            # calculate radiation for each field based on day of the year
-            self.rad.update()
-
-            # calculate PET for each field based on day of the year
-            self.PET.Tmin = minimum_temp[i]
-            self.PET.Tmax = maximum_temp[i]
-            self.PET.Tavg = avg_temp[i]
-            self.PET.update()
-
-            # Assign spatial rainfall data
-            self.mg.at_cell["rainfall__daily_depth"] = self.P[i] * np.ones(self.mg.number_of_cells)
-
-            # Update soil moisture component
-            self.current_time = self.SM.update()
-
-            # Update vegetation component
-            self.VEG.update()
-
-            # Update yearly cumulative water stress data
-            self.WS += (self.mg["cell"]["vegetation__water_stress"]) # need multiply this by time step in days if dt!=1day
-
-            # Record time 
-            self.Time.append(self.current_time)
-
-            #horrific hack to get around time stepping bug and still make sure PET and radiation know about current time
-            if self.Time[i-1] < self.Time[i]:
-                self.PET.current_time = self.current_time
-                self.rad.current_time = self.current_time
+        # compute PET (and its 30-day running mean) for every field and every day of the year in one go
+        start_day = int(round((self.SM.current_time - np.floor(self.SM.current_time)) * 365)) % 365
+        self.PET_forcing.compute_year((start_day + np.arange(365)) % 365, minimum_temp, maximum_temp, avg_temp)
+
+
+        # the yearly cumulative water stress is accumulated in place, so start from an array
+        if np.ndim(self.WS) == 0:
+            self.WS = self.WS + np.zeros(self.mg.number_of_cells)
+
+        # record the time series after every day (unless recording is off and there is no day_hook)
+        after_day = None if self.recorder.level == 'off' and self.day_hook is None else self._after_day
+
+        pet30 = self.PET_forcing.pet30 if self.config.get('pet_30day_running_mean', False) else None
+        if self.config.get('n_workers', 1) > 1:
+            # run the daily loop on tiles of the grid in worker processes (see parallel_ecohyd.py)
+            if self.parallel is None:
+                self.parallel = TileWorkers(self, self.config['n_workers'])
+            self.current_time, times, SM_canic_end = self.parallel.run_days(
+                self.current_time, self.P, self.PET_forcing.pet, pet30, functype_growing, functype_nongrowing, 
+                self.WS, after_day=after_day)
+        else:
+            # (one rainfall value per member and day, see ensemble.py)
+            self.current_time, times, SM_canic_end = run_days(
+                self.config, self.mg, self.SM, self.VEG, self.current_time, 
+                self.P.reshape(len(self.P), self.n_members, 1), self.PET_forcing.pet, pet30, functype_growing, 
+                functype_nongrowing, self.WS, after_day=after_day, members=self.n_members)
+        self.Time.extend(times)
+
+        self.recorder.end_year()
 
-            
-            #write time series output for soil moisture and biomass
-            self.WSA_SM_tseries.append(np.mean(
-                self.mg.at_cell['soil_moisture__saturation_fraction'][WSA_array.flatten() == 1]))
-            self.noWSA_SM_tseries.append(np.mean(
-                self.mg.at_cell['soil_moisture__saturation_fraction'][WSA_array.flatten() == 0]))
-            self.WSA_biomass_tseries.append(np.mean(
-                self.mg.at_cell['vegetation__live_biomass'][WSA_array.flatten() == 1]))
-            self.noWSA_biomass_tseries.append(np.mean(
-                self.mg.at_cell['vegetation__live_biomass'][WSA_array.flatten() == 0]))
-            self.ET30_tseries.append(np.mean(self.mg.at_cell['surface__potential_evapotranspiration_30day_mean']))
-            self.rain_tseries.append(np.mean(self.mg.at_cell['rainfall__daily_depth']))
-            
         # update soil health parameter at the end of the year
         WSA_sh_mask = np.ones(WSA_array.shape)
         WSA_sh_mask[WSA_array == 0] = self.WSA_sh_lower
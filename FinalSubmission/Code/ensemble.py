@@ -0,0 +1,138 @@
+'''
+Ensemble of replicates of the Ecohydrology model, stepped together in one vectorized loop.
+
+Rather than running K copies of EcoHyd (each with its own grid, components and daily Python loop), EnsembleEcoHyd puts
+the cells of all K members one after the other on a single grid, so the soil moisture and vegetation components
+update every member in the same array operation each day. With runon=0 the cells do not interact, so each member
+gives exactly the same results as an EcoHyd run on its own with the same seed and WSA masks. config
+['event_driven_dry_spells'] is not supported: a spell is only stepped at once when it is dry on all cells of the grid,
+so each member's spells (and results) would depend on the other members. Each member has its own
+rainfall (and WSA masks), while the landscape, radiation and PET are computed once and shared by all members.
+
+Fields, outputs and WS are (members x cells) once reshaped, see member_view().
+'''
+
+import json
+
+import numpy as np
+from landlab import RasterModelGrid
+
+from ecohydr_mod import EcoHyd, make_precipitation, make_soil_moisture, make_vegetation, daily_rainfall
+from recorder import TimeSeriesRecorder
+
+# cell fields recorded for every member by default
+MEMBER_FIELDS = ('soil_moisture__saturation_fraction', 'vegetation__live_biomass')
+
+
+class EnsembleEcoHyd(EcoHyd):
+    '''
+    K replicates of the Ecohydrology model with independent rainfall, see the module docstring.
+
+    Member k is the same as EcoHyd(dict(config, random_seed=seeds[k]), ...). Its cells are cells
+    k*n_cells to (k+1)*n_cells - 1 of the ensemble grid (self.mg), while the landscape the radiation and PET are
+    computed on is self.landscape. The time series recorded with config['record_level'] are over the WSA (or non-WSA)
+    fields of all members, and the recorder also keeps the daily and yearly means of MEMBER_FIELDS of each member
+    under the grouping 'member'.
+    '''
+
+    def __init__(self, config, init_min_T, init_max_T, init_avg_T, seeds):
+        '''
+        Parameters
+        ----------
+        config: dict
+            Climate config, as for EcoHyd. config['n_workers'] and config['event_driven_dry_spells'] are not
+            supported.
+        init_min_T, init_max_T, init_avg_T: float
+            Initial temperatures (deg C), as for EcoHyd.
+        seeds: list
+            Random seed of the rainfall of each member.
+        '''
+        if config.get('n_workers', 1) > 1:
+            raise ValueError('an ensemble runs all its members in one process, n_workers is not supported')
+        if config.get('event_driven_dry_spells', False):
+            raise ValueError('event_driven_dry_spells is not supported by an ensemble, the dry spells would depend on '
+                             'all members')
+        self.seeds = list(seeds)
+        self.n_members = len(self.seeds)
+
+        # sets up the landscape, radiation and PET, and the fields of one member
+        super().__init__(config, init_min_T, init_max_T, init_avg_T)
+        # the seeds are part of what the model state depends on (e.g. for spinup_cache.py)
+        self.config = dict(self.config, ensemble_seeds=self.seeds)
+
+        self.landscape = self.mg
+        self.n_cells = self.landscape.number_of_cells
+        self.mg = _ensemble_grid(self.landscape, self.n_members)
+        self.SM = make_soil_moisture(self.mg, self.methods['soil_moisture'], self.dtype)
+        self.VEG = make_vegetation(self.mg, self.methods['vegetation'], self.dtype)
+
+        # rainfall generators of each member. The model's own PD_D and PD_W are those of the first member.
+        self.member_precipitation = [make_precipitation(None, config, seed) for seed in self.seeds]
+        self.PD_D, self.PD_W = self.member_precipitation[0]
+
+        self.recorder = TimeSeriesRecorder(self.mg.number_of_cells, level=self.config.get('record_level', 'daily'),
+                                           n_years=self.config.get('record_years', 1), days_per_year=self.n,
+                                           dtype=self.dtype)
+        self.add_grouping('member', np.repeat(np.arange(self.n_members), self.n_cells), fields=MEMBER_FIELDS)
+        self.recorder.record_initial(self.mg)
+
+    def member_view(self, values):
+        '''
+        (members x cells) view of an array over the cells of the ensemble grid (e.g. a field, WS or the outputs of
+        stepper()).
+        '''
+        return np.reshape(values, (self.n_members, self.n_cells))
+
+    def _rainfall(self):
+        # daily rainfall of every member, (days x members)
+        return np.stack([daily_rainfall(PD_D, PD_W, self.canicula_length, self.methods['rainfall'])
+                         for PD_D, PD_W in self.member_precipitation], axis=1)
+
+    def stepper(self, WSA_array, avg_temp, maximum_temp, minimum_temp):
+        '''
+        Run a one-year loop of all members at a daily time step.
+
+        WSA_array is the WSA mask of every member ((members x rows x columns), or (members x cells)) or a single
+        mask used by all members. Returns the live biomass at the end of the year and the soil moisture at the end
+        of the canicula (or None if it did not end this year) as (members x cells) arrays.
+        '''
+        WSA_array = np.asarray(WSA_array)
+        if WSA_array.size == self.n_cells:
+            WSA_array = np.broadcast_to(WSA_array.ravel(), (self.n_members, self.n_cells))
+        biomass, SM_canic_end = super().stepper(WSA_array.reshape(self.n_members, -1), avg_temp, maximum_temp,
+                                                minimum_temp)
+        if SM_canic_end is not None:
+            SM_canic_end = self.member_view(SM_canic_end)
+        return self.member_view(biomass), SM_canic_end
+
+    def get_state(self):
+        '''
+        As EcoHyd.get_state(), including the random number generators of all members.
+        '''
+        state = super().get_state()
+        for k, (PD_D, PD_W) in enumerate(self.member_precipitation):
+            state['PD_D_rng:' + str(k)] = np.array(json.dumps(PD_D.rng.bit_generator.state))
+            state['PD_W_rng:' + str(k)] = np.array(json.dumps(PD_W.rng.bit_generator.state))
+        return state
+
+    def set_state(self, state):
+        '''
+        Restore a state returned by get_state() from an ensemble with the same grid, config and seeds.
+        '''
+        super().set_state(state)
+        for k, (PD_D, PD_W) in enumerate(self.member_precipitation):
+            PD_D.rng.bit_generator.state = json.loads(str(state['PD_D_rng:' + str(k)]))
+            PD_W.rng.bit_generator.state = json.loads(str(state['PD_W_rng:' + str(k)]))
+
+
+def _ensemble_grid(landscape, n_members):
+    # a grid with one row of cells holding the cell fields of the landscape once for every member, keeping fields
+    # that are the same array (e.g. the 30-day mean of PET and PET itself) the same array
+    grid = RasterModelGrid((3, n_members * landscape.number_of_cells + 2))
+    tiled = {}
+    for name in landscape.at_cell.keys():
+        array = landscape.at_cell[name]
+        if id(array) not in tiled:
+            tiled[id(array)] = np.tile(array, n_members)
+        grid.at_cell[name] = tiled[id(array)]
+    return grid
@@ -0,0 +1,98 @@
+'''
+Index between the fields of the NetLogo social model and the cells of the hydrology grid.
+
+In NetLogo there is one field per patch, identified by its who number and placed at its patch coordinates, while the
+hydrology grid keeps its cells in rows from the top (largest ycor) and columns from the left (smallest xcor). A
+FieldIndex works out the cell of every field once from the who/xcor/ycor report, so any per-field attribute (e.g. the
+WSA decisions) can be scattered into grid order, and any cell value (e.g. the yields) gathered back into the order of
+the fields, with a single fancy-indexing operation instead of looking each cell up in the report.
+'''
+
+import numpy as np
+
+
+class FieldIndex:
+    '''
+    Cell of the hydrology grid of each NetLogo field.
+
+    >>> fields = FieldIndex(who=[10, 11, 12, 13], xcor=[0, 1, 0, 1], ycor=[0, 0, 1, 1])
+    >>> fields.grid_shape
+    (2, 2)
+    >>> fields.cells.tolist()
+    [2, 3, 0, 1]
+    >>> fields.to_grid([1., 2., 3., 4.]).tolist()
+    [[3.0, 4.0], [1.0, 2.0]]
+    >>> fields.from_grid([[3., 4.], [1., 2.]]).tolist()
+    [1.0, 2.0, 3.0, 4.0]
+
+    Values of the fields in another order are matched by who:
+
+    >>> fields.to_grid([4., 1.], who=[13, 10], fill=0.).tolist()
+    [[0.0, 4.0], [1.0, 0.0]]
+    '''
+
+    def __init__(self, who, xcor, ycor):
+        '''
+        Parameters
+        ----------
+        who: array
+            Who number of each field.
+        xcor, ycor: arrays
+            Patch coordinates of each field. The fields have to cover a rectangle of patches, one field per patch.
+        '''
+        self.who = np.asarray(who).ravel()
+        xcor = np.rint(np.asarray(xcor, dtype=float)).astype(int).ravel()
+        ycor = np.rint(np.asarray(ycor, dtype=float)).astype(int).ravel()
+        self.grid_shape = (int(ycor.max() - ycor.min()) + 1, int(xcor.max() - xcor.min()) + 1)
+        self.n_cells = self.grid_shape[0] * self.grid_shape[1]
+
+        # rows from the top, columns from the left
+        self.cells = (ycor.max() - ycor) * self.grid_shape[1] + (xcor - xcor.min())
+        if len(self.cells) != self.n_cells or np.bincount(self.cells, minlength=self.n_cells).max() != 1:
+            raise ValueError('the fields must cover a rectangle of patches with exactly one field per patch')
+
+        # to find fields by who (see cells_of())
+        self._sorter = np.argsort(self.who, kind='stable')
+
+    @classmethod
+    def from_data(cls, data):
+        '''
+        Index of the fields of a data frame with 'who', 'xcor' and 'ycor' columns (e.g. from the get-info report).
+        '''
+        return cls(data['who'].to_numpy(), data['xcor'].to_numpy(), data['ycor'].to_numpy())
+
+    def cells_of(self, who=None):
+        '''
+        Cell of each field in `who` (all fields in the order the index was built from by default).
+        '''
+        if who is None:
+            return self.cells
+        who = np.asarray(who).ravel()
+        if len(who) == len(self.who) and np.array_equal(who, self.who):
+            return self.cells
+        positions = np.searchsorted(self.who, who, sorter=self._sorter)
+        positions = self._sorter[np.minimum(positions, len(self.who) - 1)]
+        if not np.array_equal(self.who[positions], who):
+            raise ValueError('some fields are not in the index')
+        return self.cells[positions]
+
+    def to_grid(self, values, who=None, fill=np.nan):
+        '''
+        Scatter the values of the fields `who` (see cells_of()) into a (rows x columns) array in the cell order of the
+        hydrology grid. Cells without a value are set to `fill`.
+        '''
+        values = np.asarray(values).ravel()
+        cells = self.cells_of(who)
+        if len(cells) == self.n_cells:
+            grid = np.empty(self.n_cells, dtype=values.dtype)
+        else:
+            grid = np.full(self.n_cells, fill, dtype=np.result_type(values.dtype, np.asarray(fill).dtype))
+        grid[cells] = values
+        return grid.reshape(self.grid_shape)
+
+    def from_grid(self, array, who=None):
+        '''
+        Gather the values of the cells of the fields `who` (see cells_of()) from an array in the cell order of the
+        hydrology grid (e.g. the yields returned by EcoHyd.stepper()).
+        '''
+        return np.ravel(array)[self.cells_of(who)]
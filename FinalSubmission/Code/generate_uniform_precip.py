@@ -11,6 +11,16 @@ hours (hr) and depth units in millimeters (mm)
 Written by Jordan Adams, 2013, updated May 2016
 
 Fixed a bug by adding 'clobber=True' to L188.
+
+Added get_storm_event_table, which returns a fresh structured array of storms
+for each call instead of the ever-growing list from get_storm_time_series, and
+get_storm_event_tables, which draws many such tables in blocks from a
+per-instance numpy Generator instead of the global random state. Creating
+the component draws its initial storm from that generator too and leaves the
+global random state alone; only the legacy methods seed and use it.
+
+Added storms_to_daily_depth, which turns storm tables into daily depths, with
+NumPy, loop and Numba implementations (see backends.py).
 """
 
 
@@ -20,6 +30,13 @@ import numpy as np
 
 from landlab import Component, ModelGrid
 
+from backends import jit
+
+# one row per storm: start and end time and average intensity over the storm
+_STORM_EVENT_DTYPE = np.dtype(
+    [("start", float), ("end", float), ("intensity", float)]
+)
+
 
 class PrecipitationDistribution(Component):
 
@@ -122,6 +139,7 @@ class PrecipitationDistribution(Component):
         total_t=0.0,
         delta_t=None,
         random_seed=0,
+        rng=None,
     ):
         """Create the storm generator.
 
@@ -143,6 +161,16 @@ class PrecipitationDistribution(Component):
             yield_storm_interstorm_duration_intensity, a delta_t is needed.
         random_seed : int or float, optional
             Seed value for random-number generator.
+        rng : numpy.random.Generator, optional
+            Generator used for the initial storm values and by
+            get_storm_event_tables. Defaults to a new generator seeded with
+            random_seed. Pass generators spawned from one
+            numpy.random.SeedSequence to give parallel runs independent,
+            reproducible storm series. Creating the component does not touch
+            the global random state; the legacy methods that draw from it
+            (get_storm_time_series, the yield_* generators and the get_*
+            methods) seed it with random_seed on first use, or with
+            seed_generator().
         """
         super().__init__(grid)
 
@@ -166,16 +194,23 @@ class PrecipitationDistribution(Component):
         # If a time series is created later, this blank list will be used.
         self._storm_time_series = []
 
-        # Seed the random-number generator
-        self.seed_generator(random_seed)
+        # This instance's own generator. The global random state is only
+        # seeded (with the same seed) once a legacy method needs it.
+        self._random_seed = random_seed
+        self._global_seeded = False
+        self._rng = rng if rng is not None else np.random.default_rng(random_seed)
 
         # Given the mean values assigned above using either the model
-        # parameter dictionary or the init function, we can call the
-        # different methods to assign values from the Poisson distribution.
-
-        self._storm_duration = self.get_precipitation_event_duration()
-        self._interstorm_duration = self.get_interstorm_event_duration()
-        self._storm_depth = self.get_storm_depth()
+        # parameter dictionary or the init function, draw the initial storm
+        # from the same distributions as the get_* methods.
+
+        self._storm_duration = self._rng.exponential(self._mean_storm_duration)
+        self._interstorm_duration = self._rng.exponential(
+            self._mean_interstorm_duration
+        )
+        self._storm_depth = self._rng.gamma(
+            self._storm_duration / self._mean_storm_duration, self._mean_storm_depth
+        )
         self._elapsed_time = 0.0
 
         # Test if we got a grid. If we did, then assign it to _grid, and we
@@ -368,16 +403,145 @@ class PrecipitationDistribution(Component):
         Even if a grid was passed to the component at instantiation, calling
         this method does not update the grid fields.
 
+        Note that the storms are appended to the same list on every call, so
+        the series keeps growing. Use get_storm_event_table to get a fresh
+        table of storms for a single run time.
+
         Returns
         -------
         array
             containing several sub-arrays of events [start, finish, intensity]
         """
+        self._storm_time_series.extend(self._generate_storm_events())
+        return self._storm_time_series
+
+    def get_storm_event_table(self):
+        """Get a table of storms for a single run time.
+
+        This draws the same storms as get_storm_time_series, but every call
+        starts a new series covering ``total_t`` instead of appending to the
+        storms of previous calls, so its length stays bounded.
+
+        Examples
+        --------
+        >>> precip = PrecipitationDistribution(mean_storm_duration=1.5,
+        ...     mean_interstorm_duration=15.0, mean_storm_depth=0.5,
+        ...     total_t=100.0)
+        >>> storms = precip.get_storm_event_table()
+        >>> storms.dtype.names
+        ('start', 'end', 'intensity')
+        >>> float(storms["start"][0])
+        0.0
+
+        The series stops with the first storm that ends after total_t:
+
+        >>> bool(np.all(storms["end"][:-1] <= 100.0))
+        True
+        >>> bool(storms["end"][-1] > 100.0)
+        True
+
+        Returns
+        -------
+        ndarray
+            Structured array with one row per storm and fields ``start``,
+            ``end`` and ``intensity``.
+        """
+        return np.array(
+            [tuple(event) for event in self._generate_storm_events()],
+            dtype=_STORM_EVENT_DTYPE,
+        )
+
+    def get_storm_event_tables(self, n_series=1):
+        """Get tables of storms for several independent run times at once.
+
+        Unlike get_storm_event_table, storms are not drawn one at a time from
+        the global random state. Interstorm durations, storm durations and
+        depths are drawn in blocks for all series from this instance's own
+        generator (see ``rng``), storm start times follow from a cumulative
+        sum, and each series is trimmed after the first storm that ends
+        after ``total_t``. Durations are exponential about their means and
+        depths are Gamma distributed with shape storm_duration /
+        mean_storm_duration and scale mean_storm_depth, as in
+        get_storm_depth.
+
+        Examples
+        --------
+        >>> precip = PrecipitationDistribution(mean_storm_duration=1.5,
+        ...     mean_interstorm_duration=15.0, mean_storm_depth=0.5,
+        ...     total_t=100.0, rng=np.random.default_rng(42))
+        >>> years = precip.get_storm_event_tables(n_series=3)
+        >>> len(years)
+        3
+        >>> years[0].dtype.names
+        ('start', 'end', 'intensity')
+        >>> [bool(np.all(year["end"][:-1] <= 100.0)) for year in years]
+        [True, True, True]
+        >>> [bool(year["end"][-1] > 100.0) for year in years]
+        [True, True, True]
+
+        Parameters
+        ----------
+        n_series : int, optional
+            Number of independent series (e.g. years or ensemble members).
+
+        Returns
+        -------
+        list of ndarray
+            One structured array per series with fields ``start``, ``end``
+            and ``intensity``.
+        """
+        # draw enough storms to cover total_t for most series in one block,
+        # and top up the series that fall short
+        mean_cycle = self._mean_storm_duration + self._mean_interstorm_duration
+        block = int(1.5 * self._run_time / mean_cycle) + 8
+
+        durations = np.empty((n_series, 0))
+        interstorms = np.empty((n_series, 0))
+        ends = np.zeros((n_series, 0))
+        while ends.shape[1] == 0 or np.any(ends[:, -1] <= self._run_time):
+            durations = np.hstack(
+                (
+                    durations,
+                    self._rng.exponential(self._mean_storm_duration, (n_series, block)),
+                )
+            )
+            interstorms = np.hstack(
+                (
+                    interstorms,
+                    self._rng.exponential(
+                        self._mean_interstorm_duration, (n_series, block)
+                    ),
+                )
+            )
+            # the first storm of each series starts at zero
+            interstorms[:, 0] = 0.0
+            ends = np.cumsum(interstorms + durations, axis=1)
+
+        depths = self._rng.gamma(
+            durations / self._mean_storm_duration, self._mean_storm_depth
+        )
+        starts = ends - durations
+        n_storms = np.argmax(ends > self._run_time, axis=1) + 1
+
+        storm_tables = []
+        for series in range(n_series):
+            n = n_storms[series]
+            table = np.empty(n, dtype=_STORM_EVENT_DTYPE)
+            table["start"] = starts[series, :n]
+            table["end"] = ends[series, :n]
+            table["intensity"] = depths[series, :n] / durations[series, :n]
+            storm_tables.append(table)
+        return storm_tables
+
+    def _generate_storm_events(self):
+        """Draw the storms of a single time series as [start, end, intensity]."""
+        self._seed_global_once()
+        storm_events = []
 
         storm = self.get_precipitation_event_duration()
         self.get_storm_depth()
         intensity = self.get_storm_intensity()
-        self._storm_time_series.append([0, storm, intensity])
+        storm_events.append([0, storm, intensity])
 
         storm_helper = storm
         storm_iterator = storm
@@ -390,13 +554,11 @@ class PrecipitationDistribution(Component):
             )
             intensity = round(self.get_storm_intensity(), 2)
             self.get_storm_depth()
-            self._storm_time_series.append(
-                [next_storm_start, next_storm_end, intensity]
-            )
+            storm_events.append([next_storm_start, next_storm_end, intensity])
             storm_iterator = storm_helper
             storm_helper = next_storm_end
             storm_iterator = storm_helper
-        return self._storm_time_series
+        return storm_events
 
     def yield_storm_interstorm_duration_intensity(self, subdivide_interstorms=False):
         """Iterator for a time series of storms interspersed with interstorms.
@@ -437,6 +599,7 @@ class PrecipitationDistribution(Component):
         # Added DEJH, Dec 2014
         # Modified to use an optional output field, DEJH 1/8/17
 
+        self._seed_global_once()
         delta_t = self._delta_t
         if delta_t is None:
             assert subdivide_interstorms is False, (
@@ -536,10 +699,10 @@ class PrecipitationDistribution(Component):
         True
         >>> len(interstorm_dts) == len(storm_dts)
         True
-        >>> rf_intensities_to_test = np.array([0.8138257984406472,
-        ...                                    0.15929112025199238,
-        ...                                    0.17254519305000884,
-        ...                                    0.09817611240558813])
+        >>> rf_intensities_to_test = np.array([0.13911600114241232,
+        ...                                    7.820956497060365e-07,
+        ...                                    0.02915384167281126,
+        ...                                    0.04139548938394845])
         >>> np.allclose(intensities, rf_intensities_to_test)
         True
         >>> np.isclose(sum(storm_dts) + sum(interstorm_dts), 46.)  # total_t
@@ -648,37 +811,52 @@ class PrecipitationDistribution(Component):
         >>> precip = PrecipitationDistribution(mean_storm_duration=1.5,
         ...     mean_interstorm_duration=15.0, mean_storm_depth=0.5,
         ...     total_t=100.0, delta_t=1.)
-        >>> round(precip.storm_duration, 2)
-        2.79
-        >>> round(precip.interstorm_duration, 2)
-        21.28
-        >>> round(precip.storm_depth, 2)
-        2.45
-        >>> round(precip.intensity, 2)
-        0.88
-        >>> precip.seed_generator() # re-seed and get same sequence again
+        >>> precip.seed_generator()
         >>> round(precip.get_precipitation_event_duration(), 2)
         2.79
         >>> round(precip.get_interstorm_event_duration(), 2)
         21.28
         >>> round(precip.get_storm_depth(), 2)
-        2.45
+        0.24
         >>> round(precip.get_storm_intensity(), 2)
-        0.88
-        >>> precip = PrecipitationDistribution(mean_storm_duration=1.5,
-        ...     mean_interstorm_duration=15.0, mean_storm_depth=0.5,
-        ...     total_t=100.0, delta_t=1., random_seed=1)
-        >>> round(precip.storm_duration, 2) # diff't vals with diff't seed
+        0.23
+        >>> precip.seed_generator() # re-seed and get same sequence again
+        >>> round(precip.get_precipitation_event_duration(), 2)
+        2.79
+        >>> precip.seed_generator(seedval=1) # diff't vals with diff't seed
+        >>> round(precip.get_precipitation_event_duration(), 2)
         0.22
-        >>> round(precip.interstorm_duration, 2)
-        28.2
-        >>> round(precip.storm_depth, 4)
-        0.0012
-        >>> round(precip.intensity, 4)
-        0.0054
+
+        The initial storm values are drawn from the instance's own
+        generator, so they only depend on random_seed (or rng):
+
+        >>> same = PrecipitationDistribution(mean_storm_duration=1.5,
+        ...     mean_interstorm_duration=15.0, mean_storm_depth=0.5,
+        ...     total_t=100.0, delta_t=1.)
+        >>> bool(same.storm_duration == PrecipitationDistribution(
+        ...     mean_storm_duration=1.5, mean_interstorm_duration=15.0,
+        ...     mean_storm_depth=0.5, total_t=100.0).storm_duration)
+        True
         """
+        self._seed_global(seedval)
+        self._rng = np.random.default_rng(seedval)
+
+    def _seed_global(self, seedval):
+        # the legacy get_* methods draw from the global random state
         random.seed(seedval)
         np.random.seed(seedval)
+        self._global_seeded = True
+
+    def _seed_global_once(self):
+        # seed the global random state with random_seed the first time a
+        # legacy method needs it, unless seed_generator() has been called
+        if not self._global_seeded:
+            self._seed_global(self._random_seed)
+
+    @property
+    def rng(self):
+        """The numpy.random.Generator used by get_storm_event_tables."""
+        return self._rng
 
     @property
     def elapsed_time(self):
@@ -692,3 +870,115 @@ class PrecipitationDistribution(Component):
     def intensity(self):
         """Get the intensity of the most recent storm simulated."""
         return self.get_storm_intensity()
+
+
+def storms_to_daily_depth(storms, n_days, offset=0, season_days=None, method="Vectorized"):
+    """Aggregate storm event tables into daily rainfall depths.
+
+    Each storm's depth (intensity times duration) is split across the days
+    it covers in proportion to the hours of the storm that fall into each
+    day. Storm times are in hours from the start of the season, which begins
+    ``offset`` days into the output series. Rain that falls after the end of
+    the season (``season_days``) or of the output series is dropped, so the
+    daily series only holds all the rainfall of storms that end within the
+    season.
+
+    Examples
+    --------
+    >>> storms = np.array([(6.0, 30.0, 0.5), (20.0, 22.0, 1.0)],
+    ...                   dtype=_STORM_EVENT_DTYPE)
+    >>> storms_to_daily_depth(storms, 4, offset=1).tolist()
+    [0.0, 11.0, 3.0, 0.0]
+
+    Rain after the end of the season is dropped:
+
+    >>> storms_to_daily_depth(storms, 4, offset=1, season_days=1).tolist()
+    [0.0, 11.0, 0.0, 0.0]
+
+    The loop implementation gives the same:
+
+    >>> storms_to_daily_depth(storms, 4, offset=1, method="Grid").tolist()
+    [0.0, 11.0, 3.0, 0.0]
+
+    A list of tables gives one row per table:
+
+    >>> storms_to_daily_depth([storms, storms[:1]], 2).shape
+    (2, 2)
+
+    Parameters
+    ----------
+    storms : ndarray or list of ndarray
+        Structured array(s) of storms with fields ``start``, ``end`` and
+        ``intensity``, as returned by get_storm_event_table(s).
+    n_days : int
+        Length of the daily series.
+    offset : int, optional
+        Day of the series on which the season starts.
+    season_days : int, optional
+        Length of the season in days. Rain falling after it is dropped. By
+        default storms run on until the end of the series.
+    method : str, optional
+        "Vectorized" splits all storms at once with NumPy, "Grid" loops over
+        the storms in Python and "Numba" runs that loop compiled with Numba
+        (see backends.py). They give the same results.
+
+    Returns
+    -------
+    ndarray
+        Daily rainfall depth, of shape (n_days,) for a single table or
+        (len(storms), n_days) for a list of tables.
+    """
+    tables = [storms] if isinstance(storms, np.ndarray) else storms
+    series = np.repeat(np.arange(len(tables)), [len(table) for table in tables])
+    if len(tables) > 0:
+        events = np.concatenate(tables)
+    else:
+        events = np.empty(0, dtype=_STORM_EVENT_DTYPE)
+
+    season_hours = 24.0 * (n_days - offset if season_days is None else season_days)
+    start = np.clip(events["start"], 0.0, season_hours)
+    end = np.clip(events["end"], 0.0, season_hours)
+
+    if method != "Vectorized":
+        if method not in ("Grid", "Numba"):
+            raise ValueError("%s: Invalid method name" % method)
+        daily = np.zeros((len(tables), n_days))
+        kernel = jit(_split_storms) if method == "Numba" else _split_storms
+        kernel(start, end, np.ascontiguousarray(events["intensity"]), series, offset, daily)
+        return daily[0] if isinstance(storms, np.ndarray) else daily
+
+    # split every storm into one piece per (partly) covered day
+    first_day = np.floor(start / 24.0).astype(int)
+    n_pieces = np.where(end > start, np.ceil(end / 24.0).astype(int) - first_day, 0)
+    piece = np.arange(n_pieces.sum()) - np.repeat(np.cumsum(n_pieces) - n_pieces, n_pieces)
+    day = np.repeat(first_day, n_pieces) + piece
+    hours = np.minimum(np.repeat(end, n_pieces), 24.0 * (day + 1)) - np.maximum(
+        np.repeat(start, n_pieces), 24.0 * day
+    )
+    depth = np.repeat(events["intensity"], n_pieces) * hours
+
+    day += offset
+    in_series = day < n_days
+    daily = np.bincount(
+        np.repeat(series, n_pieces)[in_series] * n_days + day[in_series],
+        weights=depth[in_series],
+        minlength=len(tables) * n_days,
+    ).reshape(len(tables), n_days)
+    return daily[0] if isinstance(storms, np.ndarray) else daily
+
+
+def _split_storms(start, end, intensity, series, offset, daily):
+    """Add the depth of each storm to the days it covers, one storm and day
+    at a time, in the same order as the "Vectorized" method of
+    storms_to_daily_depth. The kernel of its "Grid" and "Numba" methods.
+    """
+    n_days = daily.shape[1]
+    for storm in range(len(start)):
+        if end[storm] <= start[storm]:
+            continue
+        first_day = int(np.floor(start[storm] / 24.0))
+        last_day = int(np.ceil(end[storm] / 24.0))
+        for day in range(first_day, last_day):
+            hours = min(end[storm], 24.0 * (day + 1)) - max(start[storm], 24.0 * day)
+            if day + offset < n_days:
+                daily[series[storm], day + offset] += intensity[storm] * hours
@@ -0,0 +1,75 @@
+'''
+Grouped statistics of cell fields, e.g. per farmer, per WSA status or per topographic band.
+
+A CellGroups object takes the group of every cell once and then computes the per-group sums, counts and means of any
+cell field with np.bincount, so the cost is the same however many groups there are (rather than one boolean mask per
+group).
+'''
+
+import numpy as np
+
+
+class CellGroups:
+    '''
+    Cell -> group index with per-group statistics of cell values.
+
+    >>> groups = CellGroups([7, 3, 7, 7, 3])
+    >>> groups.labels.tolist()
+    [3, 7]
+    >>> groups.counts.tolist()
+    [2, 3]
+    >>> groups.mean([1., 2., 3., 5., 4.]).tolist()
+    [3.0, 3.0]
+
+    Values with more than one dimension are grouped along their last axis, e.g. a (days x cells) array gives
+    (days x groups) statistics:
+
+    >>> groups.sum([[1., 2., 3., 5., 4.], [0., 1., 0., 1., 1.]]).tolist()
+    [[6.0, 9.0], [2.0, 1.0]]
+    '''
+
+    def __init__(self, group_index):
+        '''
+        Parameters
+        ----------
+        group_index: array
+            Group label of each cell (any values np.unique can sort, e.g. farmer ids).
+        '''
+        self.labels, self.codes = np.unique(np.asarray(group_index).ravel(), return_inverse=True)
+        self.codes = self.codes.ravel()
+        self.n_groups = len(self.labels)
+        self.counts = np.bincount(self.codes, minlength=self.n_groups)
+        # codes offset for each row of values with more than one row, by number of rows (see sum())
+        self._row_codes = {}
+
+    def sum(self, values):
+        '''
+        Sum of `values` (cells along the last axis) over each group.
+        '''
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            return np.bincount(self.codes, weights=values, minlength=self.n_groups)
+        # offset the codes of each row so all rows are grouped in a single bincount
+        rows = values.reshape(-1, values.shape[-1])
+        if len(rows) not in self._row_codes:
+            self._row_codes[len(rows)] = (self.codes + self.n_groups * np.arange(len(rows))[:, np.newaxis]).ravel()
+        sums = np.bincount(self._row_codes[len(rows)], weights=rows.ravel(), minlength=self.n_groups * len(rows))
+        return sums.reshape(values.shape[:-1] + (self.n_groups,))
+
+    def mean(self, values):
+        '''
+        Mean of `values` (cells along the last axis) over each group.
+        '''
+        return self.sum(values) / self.counts
+
+
+def elevation_bands(elevation, n_bands):
+    '''
+    Topographic band (0 for the lowest) of each cell, with bands holding about the same number of cells.
+
+    >>> elevation_bands([10., 40., 20., 30.], 2).tolist()
+    [0, 1, 0, 1]
+    '''
+    elevation = np.asarray(elevation, dtype=float)
+    edges = np.quantile(elevation, np.linspace(0, 1, n_bands + 1)[1:-1])
+    return np.searchsorted(edges, elevation, side='right')
@@ -1,13 +1,25 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
-import pynetlogo
 import numpy as np
 import sys
+import os
 import datetime
 sys.path.append('../')
 
-from ecohydr_mod import EcoHyd
+from ecohydr_mod import EcoHyd, domain_config
+from spinup_cache import spin_up
+from checkpoint import save_checkpoint, load_checkpoint
+from field_index import FieldIndex
+from record_store import YearRecords
+from sweep_output import write_run
+from netlogo_pool import netlogo_pool, DEFAULT_MAX_RUNS
+
+# yearly attributes of the farmer records and the columns of the output, see farmerRecords()
+FARMER_RECORDS = ["implements-WSA", "owner-knows-WSA", "yield", "TotalYearRainfall"]
+FARMER_COLUMNS = ["owner-id", "Year", "xcor", "ycor"] + FARMER_RECORDS + ["who"]
+# output columns that are the same for the whole run, see writeBinaryOutput()
+RUN_COLUMNS = ["LeadFarmers", "SocialScenario", "ClimateScenario", "UniqueID"]
 
 def get_yearly_temp(csv_path, num_years):
     df = pd.read_csv(csv_path)
@@ -29,22 +41,26 @@ def get_yearly_temp(csv_path, num_years):
     
     return avg_temp_per_year, max_temp_per_year, min_temp_per_year
 
-def setUpNetLogoModel(leadFarmers, desperation, jealousy, grace):
+def setUpNetLogoModel(leadFarmers, desperation, jealousy, grace, climate=None, workspace=None):
     # think this is for the GUI idk?
     sns.set_style("white")
     sns.set_context("talk")
 
-    # starts a NetLogo link, point the netlogo home path to where you have it installed on your machine
-    netlogo = pynetlogo.NetLogoLink(
-        gui=False,
-        netlogo_home="/Volumes/NetLogo 6.3.0/NetLogo 6.3.0"
-    )
+    config = climate if climate is not None else {}
 
-    # loads a .nlogo model from provided path
-    netlogo.load_model("./modelv3.nlogo")
+    # gets the NetLogo link of this process with the model loaded. It is only started (and the model loaded) for the 
+    # first run, and replaced after config['netlogo_max_runs'] runs; set the netlogo home path to where you have it 
+    # installed on your machine in netlogo_pool.py. If a workspace of a social model host is given (see 
+    # social_host.py), the social model runs there instead
+    if workspace is not None:
+        netlogo = workspace.link()
+    else:
+        netlogo = netlogo_pool(max_runs=config.get('netlogo_max_runs', DEFAULT_MAX_RUNS)).link()
 
-    # runs the model setup command
-    netlogo.command("setup")
+    # runs the model setup command, for the number of fields and farmers set in the config (51*51 and 800 by default).
+    # This starts with clear-all, so it also resets the world left by the previous run of the link
+    grid_shape, _, n_farmers = domain_config(config)
+    netlogo.command("setup-landscape " + str(grid_shape[1]) + " " + str(grid_shape[0]) + " " + str(n_farmers))
 
      # sets globals
     globals = "update-globals " + str(leadFarmers) + " " + str(desperation) + " " + str(jealousy) + " " + str(grace)
@@ -60,38 +76,73 @@ def reportsToDataFrame(netlogo):
     fieldData = pd.DataFrame(columns=["who", "xcor","ycor","owner-id","implements-WSA", "owner-knows-WSA", "yield"], data=sorted_list)
     return fieldData
 
-def convertWSAToNPArray(data):
-    # sets bool into correct format to pass to hydrology model
-    emptynp = np.empty((51,51))
-    for i in range(0,51):
-        for j in range(0,51):
-            ycorFromIndex = i * -1 + 25
-            xcorFromIndex = j - 25
-            emptynp[i][j]= data.loc[(data['ycor'] == ycorFromIndex) & (data['xcor'] == xcorFromIndex)]["implements-WSA"].iloc[0]
-    return emptynp
-
-def convertHydrologyToDF(hydrologyArray, data):
-    # method converts the hydrology model output into a pandas dataframe
+def convertWSAToNPArray(data, fields):
+    # sets bool into correct format to pass to hydrology model: the field index (built once from the who/xcor/ycor 
+    # report, see field_index.py) puts the value of each field into its cell in one go
+    return fields.to_grid(data["implements-WSA"].to_numpy(dtype=float), who=data["who"].to_numpy())
+
+def convertHydrologyToDF(hydrologyArray, data, fields):
+    # method converts the hydrology model output into a pandas dataframe, taking the value of the cell of each field 
+    # (in whatever order the fields are in the data frame)
     hydrologyData = data.copy()
-    hydrologyData["yield"] = hydrologyArray.reshape((2601,1))
+    hydrologyData["yield"] = fields.from_grid(hydrologyArray, who=data["who"].to_numpy())
     return hydrologyData
 
-def fullModelRun(paramArray, input_csv_path, no_of_years):
+def farmerReportsToArrays(netlogo, farmers):
+    # gets farmer attributes (whether they use and know WSA) as arrays in the order of farmers.labels (farmer who)
+    farmerAttributes = np.array(netlogo.report("get-farmer-info"), dtype=float).reshape((-1, 3))
+    farmerAttributes = farmerAttributes[np.argsort(farmerAttributes[:, 0])]
+    rows = np.searchsorted(farmerAttributes[:, 0], farmers.labels)
+    return farmerAttributes[rows, 1], farmerAttributes[rows, 2]
+
+def writeFarmerYields(netlogo, farmers, totalYield, allFarmers):
+    # writes total and average yield of every farmer in allFarmers (farmer who, sorted) to netlogo, so the social 
+    # model doesn't have to sum the yields of the fields again. Farmers without fields get 0
+    total = np.zeros(len(allFarmers))
+    average = np.zeros(len(allFarmers))
+    rows = np.searchsorted(allFarmers, farmers.labels)
+    total[rows] = totalYield
+    average[rows] = totalYield / farmers.counts
+    farmerData = pd.DataFrame({"who": allFarmers, "total-yield": total, "average-yield": average})
+    netlogo.write_NetLogo_attriblist(farmerData, "farmer")
+
+def writeFieldYields(netlogo, fieldData, fields, biomass_harvest):
+    # writes the yield of every field to netlogo too, so the fields (and the worlds exported in checkpoints) hold 
+    # the yields of the year that was just simulated
+    who = fieldData["who"].to_numpy()
+    netlogo.write_NetLogo_attriblist(pd.DataFrame({"who": who, "yield": fields.from_grid(biomass_harvest, who)}), "field")
+
+def farmerRecords(farmers, no_of_years, meanXCor, meanYCor):
+    # the yearly records of all farmers, with the same columns as grouping the field data by owner-id and year. The 
+    # records of each year are written into arrays preallocated for the whole run (see record_store.py) instead of 
+    # growing a data frame every year
+    return YearRecords("owner-id", farmers.labels, FARMER_RECORDS, n_years=no_of_years + 1, 
+                       static={"xcor": meanXCor, "ycor": meanYCor, "who": farmers.counts})
+
+def recordFarmers(records, year, usingWSA, knowsWSA, totalYield, rainfall):
+    records.record(year, **{"implements-WSA": usingWSA, "owner-knows-WSA": knowsWSA, "yield": totalYield, 
+                            "TotalYearRainfall": rainfall})
+
+def writeBinaryOutput(output_dir, summarisedData, **metadata):
+    # writes the output of a run as a chunk of typed arrays into output_dir (see sweep_output.py). The scenario 
+    # columns are the same for the whole run, so they are only stored once in the manifest of the chunk
+    metadata.update({column: summarisedData[column].iloc[0] for column in RUN_COLUMNS})
+    write_run(output_dir, summarisedData.drop(columns=RUN_COLUMNS), metadata)
+
+def fullModelRun(paramArray, input_csv_path, no_of_years, checkpoint_dir=None, checkpoint_every=1, output_dir=None, 
+                 workspace=None):
+    # if checkpoint_dir is given, the state of each parameter combination is saved there every checkpoint_every 
+    # years, and a rerun with the same checkpoint_dir resumes from the latest checkpoints. If output_dir is given, the 
+    # output is written there in binary (read it with sweep_output.read_results()) instead of to a csv per combination.
+    # If workspace is given (a workspace of a social_host.SocialModelHost), the social model runs in it
     for paramIndex in range(0,18):
         # sets up model
         climate = paramArray[paramIndex][0]
         leadFarmers = paramArray[paramIndex][1]
         social = paramArray[paramIndex][2]
 
-        netlogo = setUpNetLogoModel(leadFarmers, social[0], social[1], social[2])
-
-        # this will record all field attributes throughout the simulation - need to add year index to differentiate
-        baseFieldData = reportsToDataFrame(netlogo)
-
-        returnedData = baseFieldData.copy()
-        
-        baseFieldData["Year"] = 0
-        baseFieldData["TotalYearRainfall"] = 0
+        netlogo = setUpNetLogoModel(leadFarmers, social[0], social[1], social[2], climate, workspace)
+        grid_shape, _, _ = domain_config(climate)
 
         WSA_records = []
 
@@ -104,50 +155,89 @@ def fullModelRun(paramArray, input_csv_path, no_of_years):
 
         Ecohyd_model = EcoHyd(climate, 20, 26, 23)
 
-        #--------------------------------------------#
-        # let hydrology model spin up for five years #
-        for i in range(0,5):
-            #just use same initial WSA array for each year
-            WSA_array = convertWSAToNPArray(returnedData)
-            _,_ = Ecohyd_model.stepper(WSA_array, avg[0]+climate['tempshift'], maxi[0]+climate['tempshift'], mini[0]+climate['tempshift'])
+        #------------------------------------------------------------------#
+        # resume from the latest checkpoint of this parameter combination #
+        first_year = 0
+        restored = None
+        if checkpoint_dir is not None:
+            run_checkpoint_dir = os.path.join(checkpoint_dir, "paramCombo" + str(paramIndex))
+            restored = load_checkpoint(run_checkpoint_dir, Ecohyd_model, netlogo)
+        if restored is not None:
+            if restored['done']:
+                # output of this combination has already been written
+                continue
+            first_year = restored['year']
+            WSA_records = restored['WSA_records']
+
+        # the fields of each farmer don't change during a run, so get them once and pass the yields summed per farmer 
+        # to the social model along with those of the fields. The grouping takes the owner of every cell, in 
+        # the cell order of the hydrology grid (see field_index.py).
+        fieldData = reportsToDataFrame(netlogo)
+        fields = FieldIndex.from_data(fieldData)
+        farmers = Ecohyd_model.add_grouping('farmer', fields.to_grid(fieldData['owner-id'].to_numpy()).ravel(), 
+                                            fields=())
+        meanXCor = farmers.mean(fields.to_grid(fieldData['xcor'].to_numpy(dtype=float)).ravel())
+        meanYCor = farmers.mean(fields.to_grid(fieldData['ycor'].to_numpy(dtype=float)).ravel())
+        usingWSA, knowsWSA = farmerReportsToArrays(netlogo, farmers)
+        # who of every farmer, including any without fields
+        allFarmers = np.sort(np.array(netlogo.report("get-farmer-info"), dtype=float).reshape((-1, 3))[:, 0])
+
+        # this will record all farmer attributes throughout the simulation
+        farmerData = farmerRecords(farmers, no_of_years, meanXCor, meanYCor)
+        if restored is not None:
+            farmerData.set_state(restored['records'])
+        else:
+            # year 0 is the field report after setup, averaged over the fields of each farmer as the old groupby did 
+            # (the fields' owner-knows-WSA is still 0 then, even for lead farmers, until the first farming-decisions)
+            fieldMean = lambda column: farmers.mean(fields.to_grid(fieldData[column].to_numpy(dtype=float)).ravel())
+            recordFarmers(farmerData, 0, fieldMean('implements-WSA'), fieldMean('owner-knows-WSA'), 
+                          farmers.sum(fields.to_grid(fieldData['yield'].to_numpy()).ravel()), 0)
+
+            #--------------------------------------------#
+            # let hydrology model spin up for five years #
+            #just use same initial WSA array for each year. The spun-up state is restored from the cache (in 
+            #config['spinup_cache_dir'] if given) if a run with this climate and initial WSA array has computed it before
+            WSA_array = usingWSA[farmers.codes].reshape(grid_shape)
+            spin_up(Ecohyd_model, WSA_array, avg[0]+climate['tempshift'], maxi[0]+climate['tempshift'], mini[0]+climate['tempshift'], 
+                    n_years=5, cache_dir=climate.get('spinup_cache_dir'))
 
         #---------------------------------#
         # actual coupled model loop whooo #
-        for year in range(0, no_of_years):
+        for year in range(first_year, no_of_years):
 
-            # converts the usingWSA bool for each field into an NP array
-            WSA_array = convertWSAToNPArray(returnedData)
+            # converts the usingWSA bool of each farmer into an NP array of the fields
+            WSA_array = usingWSA[farmers.codes].reshape(grid_shape)
             WSA_records.append([WSA_array])
 
             biomass_harvest, SM_canic_end = Ecohyd_model.stepper(WSA_array, avg[year]+climate['tempshift'], maxi[year]+climate['tempshift'], mini[year]+climate['tempshift'])
 
-            #record outputs for yearly rainfall
-            cum_rainfall = np.cumsum(Ecohyd_model.rain_tseries[(year)*365:(year+1)*365])[-1]
-
-            returnedData.sort_values(by=['ycor', 'xcor'], ascending=[False, True], inplace=True)
+            #record outputs for yearly rainfall (the daily rainfall of the year that was just simulated; this doesn't depend 
+            #on the recording level, and the daily rain time series also holds the spin-up years)
+            cum_rainfall = np.sum(Ecohyd_model.P)
 
-            # converts the updated yields to the dataframe
-            hydrologyData = convertHydrologyToDF(biomass_harvest,returnedData)
-            
-            # writes this new yield information to the netlogo implementation
-            netlogo.write_NetLogo_attriblist(hydrologyData, "field")
+            # sums the yields of the fields of each farmer
+            totalYield = farmers.sum(biomass_harvest)
 
-            # runs one step of social model
-            netlogo.command("farming-year")
+            # writes this new yield information to the netlogo implementation, per field and per farmer
+            writeFieldYields(netlogo, fieldData, fields, biomass_harvest)
+            writeFarmerYields(netlogo, farmers, totalYield, allFarmers)
 
-            # converts field data to a df
-            returnedData = reportsToDataFrame(netlogo)
+            # runs one step of social model (without summing the yields of the fields again)
+            netlogo.command("farming-decisions")
 
-            dataToRecord = returnedData.copy()
-            
-            dataToRecord["Year"] = year + 1
+            # gets the new farmer decisions
+            usingWSA, knowsWSA = farmerReportsToArrays(netlogo, farmers)
 
-            dataToRecord["TotalYearRainfall"] = cum_rainfall
+            # adds this years results to the records
+            recordFarmers(farmerData, year + 1, usingWSA, knowsWSA, totalYield, cum_rainfall)
 
-            # adds this years results to the dataframe
-            baseFieldData = pd.concat([baseFieldData, dataToRecord], ignore_index=True)
+            # save a checkpoint every checkpoint_every years so the run can be resumed if it crashes
+            if checkpoint_dir is not None and (year + 1) % checkpoint_every == 0:
+                save_checkpoint(run_checkpoint_dir, year + 1, Ecohyd_model, netlogo, farmerData, WSA_records)
 
-        summarisedData = baseFieldData.groupby(["owner-id","Year"]).agg({'xcor':'mean','ycor':'mean','implements-WSA':'mean','owner-knows-WSA':'mean', 'yield':'sum', 'TotalYearRainfall':'mean', 'who':'count'}).reset_index()
+        # the records are per farmer already, so this just makes a data frame of them (once, at the end of the run) and 
+        # sorts it like grouping the field data by owner-id and year did
+        summarisedData = farmerData.to_frame(FARMER_COLUMNS).sort_values(by=["owner-id","Year"], kind="stable").reset_index(drop=True)
         summarisedData.rename(columns={'owner-id':'FarmerID', 'xcor':'MeanXCor', 'ycor':'MeanYCor', 'implements-WSA':'ImplementingWSA','owner-knows-WSA':'KnowsWSA','yield':'TotalYield','who':'NumberofFields'})
 
         summarisedData["LeadFarmers"] = leadFarmers
@@ -158,20 +248,42 @@ def fullModelRun(paramArray, input_csv_path, no_of_years):
             summarisedData["ClimateScenario"] = "Warm Climate"
         summarisedData["UniqueID"] = str(datetime.datetime.now())
         
-        fileName = "modelOutputParamCombo" + str(paramIndex)
-        # this writes to a csv
-        summarisedData.to_csv(path_or_buf=fileName, mode = "a", index=False, header = True)
-
-def singleModelRun(climate, leadFarmers, social, input_csv_path, no_of_years):
+        if output_dir is not None:
+            writeBinaryOutput(output_dir, summarisedData, ParamCombo=paramIndex)
+        else:
+            fileName = "modelOutputParamCombo" + str(paramIndex)
+            # this writes to a csv
+            summarisedData.to_csv(path_or_buf=fileName, mode = "a", index=False, header = True)
+
+        # mark this combination as finished so a resumed run does not write its output again
+        if checkpoint_dir is not None:
+            save_checkpoint(run_checkpoint_dir, no_of_years, Ecohyd_model, netlogo, farmerData, WSA_records, done=True)
+
+def recordFields(records, year, data, rainfall=np.nan):
+    # records the attributes of the fields in data (in whatever order they are in the data frame)
+    records.record(year, ids=data["who"].to_numpy(), **{"implements-WSA": data["implements-WSA"].to_numpy(), 
+                   "owner-knows-WSA": data["owner-knows-WSA"].to_numpy(), "yield": data["yield"].to_numpy(), 
+                   "TotalYearRainfall": rainfall})
+
+def singleModelRun(climate, leadFarmers, social, input_csv_path, no_of_years, output_dir=None, workspace=None):
+    # if output_dir is given, the output is written there in binary (see fullModelRun) instead of to modelOutput, and 
+    # if workspace is given, the social model runs in that workspace of a social model host
     # sets up model
-    netlogo = setUpNetLogoModel(leadFarmers, social[0], social[1], social[2])
+    netlogo = setUpNetLogoModel(leadFarmers, social[0], social[1], social[2], climate, workspace)
+    grid_shape, _, _ = domain_config(climate)
 
-    # this will record all field attributes throughout the simulation - need to add year index to differentiate
-    baseFieldData = reportsToDataFrame(netlogo)
+    returnedData = reportsToDataFrame(netlogo)
 
-    returnedData = baseFieldData.copy()
-    
-    baseFieldData["Year"] = 0
+    # the cell of each field, to pass field values to the hydrology model and back (see field_index.py)
+    fields = FieldIndex.from_data(returnedData)
+
+    # this will record all field attributes throughout the simulation, in arrays preallocated for the whole run (see 
+    # record_store.py). The fields don't move or change owner, so their coordinates and owner are only kept once
+    fieldRecords = YearRecords("who", returnedData["who"].to_numpy(), 
+                               ["implements-WSA", "owner-knows-WSA", "yield", "TotalYearRainfall"], 
+                               n_years=no_of_years + 1, 
+                               static={name: returnedData[name].to_numpy() for name in ["xcor", "ycor", "owner-id"]})
+    recordFields(fieldRecords, 0, returnedData)
 
     WSA_records = []
 
@@ -186,36 +298,36 @@ def singleModelRun(climate, leadFarmers, social, input_csv_path, no_of_years):
 
     #--------------------------------------------#
     # let hydrology model spin up for five years #
-    for i in range(0,5):
-        #just use same initial WSA array for each year
-        WSA_array = convertWSAToNPArray(returnedData)
-        _,_ = Ecohyd_model.stepper(WSA_array, avg[0]+climate['tempshift'], maxi[0]+climate['tempshift'], mini[0]+climate['tempshift'])
+    #just use same initial WSA array for each year. The spun-up state is restored from the cache (in 
+    #config['spinup_cache_dir'] if given) if a run with this climate and initial WSA array has computed it before
+    WSA_array = convertWSAToNPArray(returnedData, fields)
+    spin_up(Ecohyd_model, WSA_array, avg[0]+climate['tempshift'], maxi[0]+climate['tempshift'], mini[0]+climate['tempshift'], 
+            n_years=5, cache_dir=climate.get('spinup_cache_dir'))
 
     #---------------------------------#
     # actual coupled model loop #
     for year in range(0, no_of_years):
 
         # converts the usingWSA bool for each field into an NP array
-        WSA_array = convertWSAToNPArray(returnedData)
+        WSA_array = convertWSAToNPArray(returnedData, fields)
         WSA_records.append([WSA_array])
 
         biomass_harvest, SM_canic_end = Ecohyd_model.stepper(WSA_array, avg[year]+climate['tempshift'], maxi[year]+climate['tempshift'], mini[year]+climate['tempshift'])
 
-        #record outputs for yearly rainfall
-        cum_rainfall = np.cumsum(Ecohyd_model.rain_tseries[(year)*365:(year+1)*365])[-1]
+        #record outputs for yearly rainfall (the daily rainfall of the year that was just simulated; this doesn't depend 
+        #on the recording level, and the daily rain time series also holds the spin-up years)
+        cum_rainfall = np.sum(Ecohyd_model.P)
 
         fig, ax = plt.subplots(1, 2)
         title_string = "Year" + str(year)
         fig.suptitle(title_string)
-        ax[0].imshow(np.reshape(biomass_harvest,(51,51)))
+        ax[0].imshow(np.reshape(biomass_harvest,grid_shape))
         ax[0].set_title("Yield")
         ax[1].imshow(WSA_array)
         ax[1].set_title("WSA decisions")
 
-        returnedData.sort_values(by=['ycor', 'xcor'], ascending=[False, True], inplace=True)
-
         # converts the updated yields to the dataframe
-        hydrologyData = convertHydrologyToDF(biomass_harvest,returnedData)
+        hydrologyData = convertHydrologyToDF(biomass_harvest,returnedData, fields)
         
         # writes this new yield information to the netlogo implementation
         netlogo.write_NetLogo_attriblist(hydrologyData, "field")
@@ -226,16 +338,11 @@ def singleModelRun(climate, leadFarmers, social, input_csv_path, no_of_years):
         # converts field data to a df
         returnedData = reportsToDataFrame(netlogo)
 
-        dataToRecord = returnedData.copy()
-        
-        dataToRecord["Year"] = year + 1
+        # adds this years results to the records
+        recordFields(fieldRecords, year + 1, returnedData, cum_rainfall)
 
-        dataToRecord["TotalYearRainfall"] = cum_rainfall
-
-        # adds this years results to the dataframe
-        baseFieldData = pd.concat([baseFieldData, dataToRecord], ignore_index=True)
-
-    summarisedData = baseFieldData.groupby(["owner-id","Year"]).agg({'xcor':'mean','ycor':'mean','implements-WSA':'mean','owner-knows-WSA':'mean', 'yield':'sum', 'who':'count'}).reset_index()
+    # the records only become a data frame (and are grouped by farmer) once, at the end of the run
+    summarisedData = fieldRecords.to_frame().groupby(["owner-id","Year"]).agg({'xcor':'mean','ycor':'mean','implements-WSA':'mean','owner-knows-WSA':'mean', 'yield':'sum', 'who':'count'}).reset_index()
     summarisedData.rename(columns={'owner-id':'FarmerID', 'xcor':'MeanXCor', 'ycor':'MeanYCor', 'implements-WSA':'ImplementingWSA','owner-knows-WSA':'KnowsWSA','yield':'TotalYield','who':'NumberofFields'})
 
     summarisedData["LeadFarmers"] = leadFarmers
@@ -246,6 +353,9 @@ def singleModelRun(climate, leadFarmers, social, input_csv_path, no_of_years):
         summarisedData["ClimateScenario"] = "Warm Climate"
     summarisedData["UniqueID"] = str(datetime.datetime.now())
     
-    # this writes to a csv
-    summarisedData.to_csv(path_or_buf="modelOutput", mode = "a", index=False, header = True)
+    if output_dir is not None:
+        writeBinaryOutput(output_dir, summarisedData)
+    else:
+        # this writes to a csv
+        summarisedData.to_csv(path_or_buf="modelOutput", mode = "a", index=False, header = True)
     return summarisedData, WSA_records, biomass_harvest
\ No newline at end of file
@@ -0,0 +1,95 @@
+'''
+NetLogo links kept between the runs of a process.
+
+Starting a pynetlogo.NetLogoLink starts a JVM and loading modelv3.nlogo compiles the model, which takes seconds and
+hundreds of MB every time. The social model does not need a fresh link for every run though: setup-landscape starts
+with clear-all, so running it (and update-globals) again resets the world for the next scenario. NetLogoPool starts
+the link of a process once, with the model loaded, and hands it out again to every later run of that process.
+
+The workspace of a link keeps growing over many runs, so after max_runs runs the pool kills it and loads the model
+into a new one. The JVM itself can't be restarted within a process (JPype only starts it once), so the new workspace
+lives in the same JVM, but the memory of the old one is freed. Every process (e.g. each multiprocessing.Process of
+the driver notebook) has its own pool, see netlogo_pool().
+'''
+
+import os
+
+# point the netlogo home path to where you have it installed on your machine
+NETLOGO_HOME = "/Volumes/NetLogo 6.3.0/NetLogo 6.3.0"
+MODEL_PATH = "./modelv3.nlogo"
+
+# runs a link is used for before it is replaced, see NetLogoPool
+DEFAULT_MAX_RUNS = 20
+
+# pools of this process, by netlogo home and model path
+_POOLS = {}
+
+
+class NetLogoPool:
+    '''
+    NetLogo link of one process, reused for up to max_runs runs.
+    '''
+
+    def __init__(self, netlogo_home=NETLOGO_HOME, model_path=MODEL_PATH, max_runs=DEFAULT_MAX_RUNS, gui=False):
+        '''
+        Parameters
+        ----------
+        netlogo_home: str, optional
+            Where NetLogo is installed.
+        model_path: str, optional
+            The .nlogo model to load.
+        max_runs: int or None, optional
+            Number of runs a link is used for before it is replaced by a new one. None to never replace it.
+        gui: bool, optional
+            Start NetLogo with its GUI.
+        '''
+        self.netlogo_home = netlogo_home
+        self.model_path = model_path
+        self.max_runs = max_runs
+        self.gui = gui
+        self.runs = 0
+        self.links_started = 0
+        self._link = None
+        self._pid = os.getpid()
+
+    def link(self):
+        '''
+        The NetLogo link for a new run, with the model loaded. It is started if there is none yet, or if the current
+        one has done max_runs runs. The world is left as the last run left it, so it has to be set up again (as
+        setUpNetLogoModel() in modelScript.py does).
+        '''
+        if self._pid != os.getpid():
+            # a forked copy of the pool: the link belongs to the parent process, so leave it alone
+            self._link = None
+            self._pid = os.getpid()
+        if self._link is not None and self.max_runs is not None and self.runs >= self.max_runs:
+            self.close()
+        if self._link is None:
+            # imported here so the rest of the code does not need pynetlogo (or a JVM) to import this module
+            import pynetlogo
+            self._link = pynetlogo.NetLogoLink(gui=self.gui, netlogo_home=self.netlogo_home)
+            self._link.load_model(self.model_path)
+            self.links_started += 1
+            self.runs = 0
+        self.runs += 1
+        return self._link
+
+    def close(self):
+        '''
+        Kill the workspace of the current link, if any. The next call of link() starts a new one.
+        '''
+        link, self._link = self._link, None
+        if link is not None and self._pid == os.getpid():
+            link.kill_workspace()
+
+
+def netlogo_pool(netlogo_home=NETLOGO_HOME, model_path=MODEL_PATH, max_runs=DEFAULT_MAX_RUNS):
+    '''
+    The NetLogoPool of this process for `netlogo_home` and `model_path`, created on first use. `max_runs` updates
+    that of the pool.
+    '''
+    key = (netlogo_home, os.path.abspath(model_path))
+    if key not in _POOLS:
+        _POOLS[key] = NetLogoPool(netlogo_home, model_path)
+    _POOLS[key].max_runs = max_runs
+    return _POOLS[key]
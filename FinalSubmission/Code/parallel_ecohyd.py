@@ -0,0 +1,243 @@
+'''
+Shared-memory domain decomposition of the Ecohydrology model.
+
+With runon=0, the soil moisture and vegetation updates only ever look at one cell at a time. TileWorkers puts all cell
+fields of an EcoHyd grid in multiprocessing.shared_memory and starts worker processes that each own the soil moisture
+and vegetation components of a contiguous slice (tile) of the cells. Every model year, the EcoHyd process computes the
+rainfall and PET as usual and the workers run the daily loop (ecohydr_mod.run_days) on their tiles. The workers only
+wait for each other at the end of each day if EcoHyd records time series (so it can read the fields of the whole grid
+in between), otherwise only at the end of the year. Every cell goes through exactly the same operations as in a serial
+run, so the results are identical. This is why config['event_driven_dry_spells'] is not supported here: whether a
+spell is stepped at once depends on all cells of the grid, so each worker would pick different spells on its tile.
+
+Use it by setting config['n_workers'] to more than 1 in the EcoHyd config.
+'''
+
+import multiprocessing
+import traceback
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+_PFT_FIELD = 'vegetation__plant_functional_type'
+
+
+class TileWorkers:
+    '''
+    Pool of worker processes running the daily loop of an EcoHyd model on tiles of its grid.
+    '''
+
+    def __init__(self, model, n_workers):
+        '''
+        Parameters
+        ----------
+        model: EcoHyd
+            The model to run in parallel. The cell fields of its grid are moved to shared memory.
+        n_workers: int
+            Number of worker processes (and tiles).
+        '''
+        self.model = model
+        grid = model.mg
+        n_cells = grid.number_of_cells
+        self._blocks = []
+
+        # move the cell fields to shared memory, keeping fields that are the same array (e.g. the 30-day mean of PET
+        # and PET itself) the same array
+        self._field_specs = {}
+        shared = {}
+        arrays = [grid.at_cell[name] for name in grid.at_cell.keys()]
+        for name, array in zip(list(grid.at_cell.keys()), arrays):
+            if id(array) not in shared:
+                shared[id(array)] = self._share(array.shape, array.dtype)
+                shared[id(array)][1][:] = array
+            self._field_specs[name], grid.at_cell[name] = shared[id(array)]
+
+        # buffers the workers write to or read from, besides the fields
+        self._buffer_specs = {}
+        self._buffers = {}
+        # (the water stress is summed over the year, so it stays in double precision whatever the model's dtype)
+        for name, shape, dtype in [('WS', (n_cells,), np.float64), ('SM_canic_end', (n_cells,), model.dtype),
+                                   ('pet', (model.n, n_cells), model.dtype),
+                                   ('pet30', (model.n, n_cells), model.dtype)]:
+            self._buffer_specs[name], self._buffers[name] = self._share(shape, dtype)
+
+        self.tiles = [(int(tile[0]), int(tile[-1]) + 1) for tile in np.array_split(np.arange(n_cells), n_workers)]
+
+        context = multiprocessing.get_context()
+        self._barrier = context.Barrier(n_workers + 1)
+        self._connections = []
+        self._processes = []
+        for start, stop in self.tiles:
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_worker_main, daemon=True,
+                                      args=(worker_connection, self._barrier, self._field_specs, self._buffer_specs,
+                                            (start, stop), model.config, model.methods, model.dtype))
+            process.start()
+            self._connections.append(connection)
+            self._processes.append(process)
+
+        self._finalizer = weakref.finalize(self, _shutdown, self._connections, self._processes, self._blocks)
+
+    def _share(self, shape, dtype):
+        # a new shared memory block and a numpy array on it
+        dtype = np.dtype(dtype)
+        block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        self._blocks.append(block)
+        return (block.name, tuple(shape), dtype.str), np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def run_days(self, current_time, P, pet, pet30, functype_growing, functype_nongrowing, WS, after_day=None):
+        '''
+        Run the daily loop of EcoHyd.stepper() on the workers, see ecohydr_mod.run_days() for the arguments.
+        after_day() is called after every day, while the workers wait.
+        '''
+        model = self.model
+        self._buffers['pet'][:len(P)] = pet[:len(P)]
+        if pet30 is not None:
+            self._buffers['pet30'][:len(P)] = pet30[:len(P)]
+        self._buffers['WS'][:] = WS
+
+        # the internal state of the components of the model that is not in the fields
+        Blive_ini = np.asarray(model.VEG._Blive_ini)
+        Bdead_ini = np.asarray(model.VEG._Bdead_ini)
+        for connection, (start, stop) in zip(self._connections, self.tiles):
+            connection.send(('year', {
+                'current_time': current_time,
+                'SM_current_time': model.SM._current_time,
+                'P': P,
+                'has_pet30': pet30 is not None,
+                'functype_growing': functype_growing[start:stop],
+                'functype_nongrowing': functype_nongrowing[start:stop],
+                'SM_vegtype_ini': model.SM._vegtype_ini[start:stop],
+                'VEG_vegtype_ini': model.VEG._vegtype_ini[start:stop],
+                'Blive_ini': Blive_ini[start:stop],
+                'Bdead_ini': Bdead_ini[start:stop],
+                'sync_daily': after_day is not None,
+            }))
+
+        if after_day is not None:
+            for i in range(len(P)):
+                try:
+                    # wait for the workers to finish the day, then let them go on once after_day() is done
+                    self._barrier.wait()
+                    after_day()
+                    self._barrier.wait()
+                except multiprocessing.BrokenBarrierError:
+                    break
+
+        results = [connection.recv() for connection in self._connections]
+        for result in results:
+            if result[0] == 'error':
+                self._barrier.reset()
+                raise RuntimeError('EcoHyd worker failed:\n' + result[1])
+        times = results[0][1]
+        WS[:] = self._buffers['WS']
+
+        # bring the components of the model up to date with what the workers did. As after VEG.update(), the biomass
+        # buffers of the vegetation are the biomass fields.
+        # (SoilMoisture.update() returns the time before the step, so the component's own time is a step ahead)
+        if len(times) > 0:
+            current_time = times[-1]
+        model.SM._current_time = results[0][3]
+        model.SM.update_plant_functional_type()
+        model.VEG.update_plant_functional_type()
+        if len(P) > 0:
+            model.VEG._Blive_ini = model.mg.at_cell['vegetation__live_biomass']
+            model.VEG._Bdead_ini = model.mg.at_cell['vegetation__dead_biomass']
+
+        SM_canic_end = self._buffers['SM_canic_end'].copy() if any(result[2] for result in results) else None
+        return current_time, times, SM_canic_end
+
+    def close(self):
+        '''
+        Stop the workers and move the fields of the model back out of shared memory.
+        '''
+        grid = self.model.mg
+        copies = {}
+        for name in list(grid.at_cell.keys()):
+            spec = self._field_specs.get(name, name)
+            if spec not in copies:
+                copies[spec] = np.array(grid.at_cell[name])
+            grid.at_cell[name] = copies[spec]
+        for name in ['_Blive_ini', '_Bdead_ini']:
+            setattr(self.model.VEG, name, np.array(getattr(self.model.VEG, name)))
+        self.model.SM._vegtype = grid.at_cell[_PFT_FIELD]
+        self.model.VEG._vegtype = grid.at_cell[_PFT_FIELD]
+        self._buffers = {}
+        self._finalizer()
+
+
+def _shutdown(connections, processes, blocks):
+    # stop the workers and free the shared memory
+    for connection in connections:
+        try:
+            connection.send(('close', None))
+        except (OSError, ValueError):
+            pass
+    for process in processes:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+    for block in blocks:
+        try:
+            block.close()
+        except BufferError:
+            # some arrays on the block are still around, the memory is freed once they are gone
+            pass
+        block.unlink()
+
+
+def _attach(spec, blocks):
+    # numpy array on the shared memory block described by spec
+    name, shape, dtype = spec
+    if name not in blocks:
+        blocks[name] = shared_memory.SharedMemory(name=name)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+
+
+def _worker_main(connection, barrier, field_specs, buffer_specs, tile, config, methods, dtype):
+    # imported here so the main process does not need landlab to unpickle anything
+    from landlab import RasterModelGrid
+    from ecohydr_mod import make_soil_moisture, make_vegetation, run_days
+
+    start, stop = tile
+    blocks = {}
+    # a grid with one row of cells, whose fields are this tile of the fields of the whole grid
+    grid = RasterModelGrid((3, stop - start + 2))
+    for name, spec in field_specs.items():
+        grid.at_cell[name] = _attach(spec, blocks)[start:stop]
+    buffers = {name: _attach(spec, blocks) for name, spec in buffer_specs.items()}
+    SM = make_soil_moisture(grid, methods['soil_moisture'], dtype)
+    VEG = make_vegetation(grid, methods['vegetation'], dtype)
+
+    def after_day(spell_interior=False):
+        barrier.wait()
+        barrier.wait()
+
+    while True:
+        command, year = connection.recv()
+        if command == 'close':
+            break
+        try:
+            # take over the internal state of the components of the model
+            for component, vegtype_ini in [(SM, year['SM_vegtype_ini']), (VEG, year['VEG_vegtype_ini'])]:
+                component._vegtype = grid.at_cell[_PFT_FIELD]
+                component._vegtype_ini = np.array(vegtype_ini)
+                for name, table in component._pft_params.items():
+                    getattr(component, name)[:] = table[component._vegtype_ini]
+            VEG._Blive_ini = np.array(year['Blive_ini'], dtype=dtype)
+            VEG._Bdead_ini = np.array(year['Bdead_ini'], dtype=dtype)
+            SM._current_time = year['SM_current_time']
+
+            n_days = len(year['P'])
+            _, times, SM_canic_end = run_days(
+                config, grid, SM, VEG, year['current_time'], year['P'], buffers['pet'][:n_days, start:stop],
+                buffers['pet30'][:n_days, start:stop] if year['has_pet30'] else None, year['functype_growing'],
+                year['functype_nongrowing'], buffers['WS'][start:stop],
+                after_day=after_day if year['sync_daily'] else None)
+            if SM_canic_end is not None:
+                buffers['SM_canic_end'][start:stop] = SM_canic_end
+            connection.send(('done', times, SM_canic_end is not None, SM._current_time))
+        except Exception:
+            barrier.abort()
+            connection.send(('error', traceback.format_exc(), False, None))
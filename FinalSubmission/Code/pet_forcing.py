@@ -0,0 +1,129 @@
+'''
+Whole-year potential evapotranspiration (PET) forcing for the Ecohydrology model.
+
+Everything the Priestley-Taylor PET depends on (day of year, daily temperatures and the radiation ratio to a flat 
+surface) is known before a model year starts. PETForcing computes the PET at every cell for all days of the year, and 
+its 30-day running mean, in one vectorized pass, so the daily loop only has to copy a row into the grid fields instead 
+of calling the landlab PotentialEvapotranspiration component every day.
+'''
+
+import numpy as np
+
+
+class PETForcing:
+    '''
+    Yearly (days x cells) matrices of Priestley-Taylor PET and its 30-day running mean.
+
+    The formulas are those of the 'PriestleyTaylor' method of the landlab PotentialEvapotranspiration component, 
+    evaluated for all days at once, with the parameters of the component passed in.
+    '''
+
+    def __init__(self, pet, rad_cache, window=30, running_mean=True, dtype=float):
+        '''
+        Parameters
+        ----------
+        pet: PotentialEvapotranspiration
+            The landlab PET component (method 'PriestleyTaylor') whose parameters to use.
+        rad_cache: RadiationCache
+            Day-of-year table of the radiation ratio to a flat surface.
+        window: int, optional
+            Length of the running mean in days.
+        running_mean: bool, optional
+            Whether to compute the running mean at all (it needs a few more (days x cells) arrays, which adds up on 
+            big grids).
+        dtype: data-type, optional
+            Floating point type to keep the matrices in. They are always computed in double precision (as is the 
+            running mean across years), and only converted at the end.
+        '''
+        self._pet = pet
+        self._ratio = rad_cache.table
+        self.window = window
+        self.running_mean = running_mean
+        self.dtype = np.dtype(dtype)
+
+        # PET of the last (window - 1) days of the previous year, to carry the running mean across years
+        self._tail = np.empty((0, self._ratio.shape[1]))
+
+        self.pet = None
+        self.pet30 = None
+
+    def priestley_taylor(self, J, Tmax, Tmin, Tavg):
+        '''
+        PET on a flat surface (mm/d) for arrays of days of the year J and daily temperatures (deg C).
+        '''
+        pet = self._pet
+        J = np.asarray(J, dtype=float)
+        Tmax = np.asarray(Tmax, dtype=float)
+        Tmin = np.asarray(Tmin, dtype=float)
+        Tavg = np.asarray(Tavg, dtype=float)
+
+        es = 0.6108 * np.exp((17.27 * Tavg) / (237.7 + Tavg))
+        ea = 0.6108 * np.exp((17.27 * Tmin) / (237.7 + Tmin))
+        delta = (4098.0 * es) / ((237.3 + Tavg) ** 2.0)
+        sdecl = 0.409 * np.sin(((np.pi / 180.0) * J) - 1.39)
+        dr = 1 + (0.033 * np.cos(np.pi / 180.0 * J))
+        x = 1.0 - (((np.tan(pet._phi)) ** 2.0) * (np.tan(sdecl) ** 2.0))
+        x = np.where(x <= 0, 0.00001, x)
+        ws = (np.pi / 2.0) - np.arctan((-1 * np.tan(pet._phi) * np.tan(sdecl)) / (x**2.0))
+        Ra = (
+            11.57
+            * (24.0 / np.pi)
+            * 4.92
+            * dr
+            * (
+                (ws * np.sin(pet._phi) * np.sin(sdecl))
+                + (np.cos(pet._phi) * np.cos(sdecl) * (np.sin(ws)))
+            )
+        )
+        Rso = (0.75 + ((2.0 * (10 ** (-5.0))) * pet._z)) * Ra
+        Rs = np.minimum(pet._Krs * Ra * np.sqrt(Tmax - Tmin), Rso)
+        Rns = Rs * (1 - pet._a)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            u = np.where(Rso > 0, Rs / Rso, 0)
+        u = np.clip(u, 0.3, 1.0)
+        fcd = (1.35 * u) - 0.35
+        Rnl = (
+            pet._sigma
+            * fcd
+            * (
+                0.34
+                - (0.14 * np.sqrt(ea))
+                * (((Tmax + 273.16) ** 4.0 + (Tmin + 273.16) ** 4.0) / 2.0)
+            )
+        )
+        Rn = Rns - Rnl
+        return np.maximum(pet._alpha * (delta / (delta + pet._y)) * (Rn / pet._pwhv), 0)
+
+    def compute_year(self, days, Tmin, Tmax, Tavg):
+        '''
+        Compute the PET and running mean matrices for one model year.
+
+        Parameters
+        ----------
+        days: array of int
+            Day of the year of each time step.
+        Tmin, Tmax, Tavg: arrays of float
+            Minimum, maximum and average temperature of each time step (deg C).
+
+        Returns
+        -------
+        pet, pet30: ndarray
+            (time steps x cells) arrays of PET and its running mean (mm/d). Also kept as attributes. pet30 is None 
+            if running_mean is False.
+        '''
+        days = np.asarray(days, dtype=int)
+        pet = self.priestley_taylor(days, Tmax, Tmin, Tavg)[:, np.newaxis] * self._ratio[days]
+        self.pet = pet.astype(self.dtype, copy=False)
+        if not self.running_mean:
+            return self.pet, self.pet30
+
+        # trailing mean over the last `window` days, including the end of the previous year where available
+        history = np.concatenate((self._tail, pet))
+        cumulative = np.concatenate((np.zeros((1, history.shape[1])), np.cumsum(history, axis=0)))
+        end = np.arange(len(self._tail), len(history)) + 1
+        start = np.maximum(end - self.window, 0)
+        self.pet30 = ((cumulative[end] - cumulative[start]) / (end - start)[:, np.newaxis]).astype(self.dtype, 
+                                                                                                 copy=False)
+
+        self._tail = history[-(self.window - 1):]
+        return self.pet, self.pet30
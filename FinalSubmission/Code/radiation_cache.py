@@ -0,0 +1,97 @@
+'''
+Cache of the daily radiation fields used by the Ecohydrology model.
+
+The landlab Radiation component only depends on the day of the year, the latitude and the (fixed) topography, so 
+recomputing it every simulated day repeats the same work every year, for every spin-up year and for every parameter 
+combination. RadiationCache computes a table with one row per day of the year once, shares it between all models on 
+the same grid in a process, and can optionally store it on disk so other runs and worker processes can skip the 
+computation entirely.
+'''
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+# fields the cache provides. The PET component computes its radiation fluxes from the ratio to a flat surface, so 
+# this is the only radiation output the rest of the model reads.
+_CACHED_FIELD = "radiation__ratio_to_flat_surface"
+
+# tables already computed in this process, by key
+_TABLES = {}
+
+
+class RadiationCache:
+    '''
+    Day-of-year table of the radiation fields of a landlab Radiation component.
+
+    Call update() instead of the component's update() to write the fields for the component's current_time.
+    '''
+
+    def __init__(self, rad, cache_dir=None):
+        '''
+        Parameters
+        ----------
+        rad: Radiation
+            The landlab Radiation component whose output to cache. Its grid must carry the topography it was 
+            instantiated with.
+        cache_dir: str, optional
+            Directory to store the table in as an .npy file named after the cache key, so later runs can 
+            memory-map it instead of recomputing it. Nothing is written to disk if this is None.
+        '''
+        self._rad = rad
+        self._grid = rad.grid
+        self.key = self._make_key()
+
+        if self.key in _TABLES:
+            self.table = _TABLES[self.key]
+        else:
+            path = None if cache_dir is None else os.path.join(cache_dir, "radiation_" + self.key + ".npy")
+            if path is not None and os.path.exists(path):
+                self.table = np.load(path, mmap_mode="r")
+            else:
+                self.table = self._compute_table()
+                if path is not None:
+                    _save_atomic(path, self.table)
+            _TABLES[self.key] = self.table
+
+        self.update()
+
+    def _make_key(self):
+        # everything the ratio to flat surface depends on besides the day of the year
+        key = hashlib.sha1()
+        key.update(np.ascontiguousarray(self._grid.at_node["topographic__elevation"], dtype=float).tobytes())
+        key.update(np.asarray(self._grid.shape).tobytes())
+        key.update(np.asarray([self._grid.dx, self._grid.dy, self._rad._latitude, self._rad._hour], 
+                              dtype=float).tobytes())
+        return key.hexdigest()[:16]
+
+    def _compute_table(self):
+        # the component takes the day of the year as a float, (current_time % 1) * 365, so also keep a row for 
+        # day 365, which is where times just short of a whole year land.
+        # (the current_time setter of landlab components only lets time move forward, so set it directly)
+        current_time = self._rad.current_time
+        table = np.empty((366, self._grid.number_of_cells))
+        for day in range(366):
+            self._rad._current_time = day / 365.
+            self._rad.update()
+            table[day] = self._grid.at_cell[_CACHED_FIELD]
+        self._rad._current_time = current_time
+        return table
+
+    def update(self):
+        '''
+        Write the cached radiation fields for the current_time of the radiation component to the grid.
+        '''
+        day = int(round((self._rad.current_time - np.floor(self._rad.current_time)) * 365))
+        self._grid.at_cell[_CACHED_FIELD][:] = self.table[day]
+
+
+def _save_atomic(path, table):
+    # write to a temporary file first so parallel workers never read a half-written table
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npy")
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, table)
+    os.replace(tmp_path, path)
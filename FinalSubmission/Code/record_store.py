@@ -0,0 +1,130 @@
+'''
+Columnar store of the yearly records of the coupled model.
+
+The coupled model records a row per field (or per farmer) and model year. Growing a data frame with pd.concat every
+year copies the whole history each time, so the cost of a run grows with the square of the number of years.
+YearRecords keeps one preallocated (years x fields) numpy array per recorded attribute instead, fills in a row per
+year in place, and only builds the data frame once at the end of the run. Attributes that do not change during a run
+(e.g. the coordinates and owner of a field) are kept once per field.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+class YearRecords:
+    '''
+    Preallocated (years x entities) records of per-entity attributes, one row per recorded year.
+
+    >>> records = YearRecords('who', [10, 11], ['yield'], n_years=1, static={'owner-id': [1, 2]})
+    >>> records.record(0, **{'yield': [50., 60.]})
+    >>> records.record(1, ids=[11, 10], **{'yield': [61., 51.]})
+    >>> records.to_frame().values.tolist()
+    [[10.0, 1.0, 0.0, 50.0], [11.0, 2.0, 0.0, 60.0], [10.0, 1.0, 1.0, 51.0], [11.0, 2.0, 1.0, 61.0]]
+    '''
+
+    def __init__(self, id_column, ids, columns, n_years=1, static=None, year_column='Year'):
+        '''
+        Parameters
+        ----------
+        id_column: str
+            Name of the column holding the id of each entity (e.g. 'who' for fields).
+        ids: array
+            Id of each entity, in the order the values are passed to record() unless given there.
+        columns: list of str
+            Attributes recorded every year.
+        n_years: int, optional
+            Number of years (rows) to preallocate the arrays for. They are grown if more are recorded.
+        static: dict, optional
+            Attributes that do not change between years, by name, with one value per entity.
+        year_column: str, optional
+            Name of the column holding the year of each row.
+        '''
+        self.id_column = id_column
+        self.year_column = year_column
+        self.ids = np.asarray(ids).ravel()
+        self.static = {name: np.asarray(values).ravel() for name, values in (static or {}).items()}
+        self.columns = list(columns)
+        self.years = np.empty(n_years, dtype=int)
+        self.values = {name: np.full((n_years, len(self.ids)), np.nan) for name in self.columns}
+        self.n_rows = 0
+
+        # to find entities by id (see record())
+        self._sorter = np.argsort(self.ids, kind='stable')
+
+    def record(self, year, ids=None, **values):
+        '''
+        Record the attributes of all entities for `year`, as arrays in the order of `ids` (the order the store was
+        created with by default) or as a single value for all entities (e.g. the rainfall of the year). Attributes
+        not given are left as nan.
+        '''
+        if self.n_rows == len(self.years):
+            self._grow(max(2 * self.n_rows, 1))
+        rows = slice(None) if ids is None else self._positions(ids)
+        self.years[self.n_rows] = year
+        for name, value in values.items():
+            self.values[name][self.n_rows, rows] = value
+        self.n_rows += 1
+
+    def _positions(self, ids):
+        # positions of `ids` in the order of the store
+        ids = np.asarray(ids).ravel()
+        if len(ids) == len(self.ids) and np.array_equal(ids, self.ids):
+            return slice(None)
+        positions = self._sorter[np.minimum(np.searchsorted(self.ids, ids, sorter=self._sorter), len(self.ids) - 1)]
+        if not np.array_equal(self.ids[positions], ids):
+            raise ValueError('some ids are not in the records')
+        return positions
+
+    def _grow(self, n_years):
+        # grow the arrays if more years are recorded than planned
+        years = np.empty(n_years, dtype=int)
+        years[:self.n_rows] = self.years[:self.n_rows]
+        self.years = years
+        for name, array in self.values.items():
+            self.values[name] = np.full((n_years, len(self.ids)), np.nan)
+            self.values[name][:self.n_rows] = array[:self.n_rows]
+
+    def column(self, name):
+        '''
+        (years x entities) values of attribute `name` recorded so far.
+        '''
+        return self.values[name][:self.n_rows]
+
+    def to_frame(self, columns=None):
+        '''
+        The records as a long data frame with one row per entity and year (year by year, entities in the order of the
+        store), with the id, static attributes, year and recorded attributes as columns (or `columns`, in that order).
+        '''
+        n_entities = len(self.ids)
+        data = {self.id_column: np.tile(self.ids, self.n_rows)}
+        for name, values in self.static.items():
+            data[name] = np.tile(values, self.n_rows)
+        data[self.year_column] = np.repeat(self.years[:self.n_rows], n_entities)
+        for name in self.columns:
+            data[name] = self.column(name).ravel()
+        frame = pd.DataFrame(data)
+        return frame if columns is None else frame[list(columns)]
+
+    def get_state(self):
+        '''
+        Return the records as a flat dict of numpy arrays (e.g. for checkpoint.py), see set_state().
+        '''
+        state = {'ids': self.ids.copy(), 'years': self.years[:self.n_rows].copy()}
+        for name in self.columns:
+            state['values:' + name] = self.column(name).copy()
+        return state
+
+    def set_state(self, state):
+        '''
+        Restore records saved with get_state() by a store with the same entities and attributes.
+        '''
+        if not np.array_equal(state['ids'], self.ids):
+            raise ValueError('the saved records are of different entities')
+        n_rows = len(state['years'])
+        if n_rows > len(self.years):
+            self._grow(n_rows)
+        self.years[:n_rows] = state['years']
+        for name in self.columns:
+            self.values[name][:n_rows] = state['values:' + name]
+        self.n_rows = n_rows
@@ -0,0 +1,296 @@
+'''
+Recorder for the output time series of the Ecohydrology model.
+
+The recorder keeps its output in numpy buffers preallocated for the planned number of model years (and grown if the
+model runs for longer), and builds the WSA masks once per year rather than every day. How much it records is set by
+its level:
+
+ - 'off': nothing.
+ - 'yearly': yearly means of the daily series below, one row per model year.
+ - 'daily': the daily means of soil moisture and live biomass on WSA and non-WSA fields, of the 30-day mean PET and of
+   rainfall (the former EcoHyd time series), plus the yearly means.
+ - 'full': as 'daily', plus the soil moisture and live biomass of every cell on every day.
+
+Means of cell fields over groups of cells (e.g. per farmer, see grouping.py) can be recorded too, see add_groups().
+
+With config['event_driven_dry_spells'], a rain-free spell is stepped in one soil moisture update, so on the days before
+its last one the fields in SPELL_FIELDS only hold the values of the end of the spell. The recorder marks these days by
+recording nan for those fields (in the daily series, the per-cell output and the grouped series), and leaves them out
+of the yearly means.
+'''
+
+import numpy as np
+
+LEVELS = ('off', 'yearly', 'daily', 'full')
+
+# daily series: the grid field each is the mean of, and whether over WSA fields (1), non-WSA fields (0) or all (None)
+SERIES = {
+    'WSA_SM_tseries': ('soil_moisture__saturation_fraction', 1),
+    'noWSA_SM_tseries': ('soil_moisture__saturation_fraction', 0),
+    'WSA_biomass_tseries': ('vegetation__live_biomass', 1),
+    'noWSA_biomass_tseries': ('vegetation__live_biomass', 0),
+    'ET30_tseries': ('surface__potential_evapotranspiration_30day_mean', None),
+    'rain_tseries': ('rainfall__daily_depth', None),
+}
+
+# fields recorded for every cell at level 'full'
+CELL_FIELDS = ('soil_moisture__saturation_fraction', 'vegetation__live_biomass')
+
+# fields that are only known at the end of a dry spell stepped in one go (see record() and ecohydr_mod.run_days())
+SPELL_FIELDS = ('soil_moisture__saturation_fraction', 'surface__evapotranspiration', 
+                'soil_moisture__root_zone_leakage', 'vegetation__water_stress')
+
+
+class TimeSeriesRecorder:
+    '''
+    Preallocated recorder of the daily output of EcoHyd.stepper(), see the module docstring for the levels.
+    '''
+
+    def __init__(self, n_cells, level='daily', n_years=1, days_per_year=365, dtype=float):
+        '''
+        Parameters
+        ----------
+        n_cells: int
+            Number of cells of the grid.
+        level: str, optional
+            One of 'off', 'yearly', 'daily' or 'full'.
+        n_years: int, optional
+            Number of model years to preallocate the buffers for.
+        days_per_year: int, optional
+            Number of time steps per model year.
+        dtype: data-type, optional
+            Floating point type of the recorded values (that of the grid fields). The yearly sums are always kept 
+            in double precision.
+        '''
+        if level not in LEVELS:
+            raise ValueError('recording level must be one of ' + str(LEVELS) + ', not ' + repr(level))
+        self.level = level
+        self._level = LEVELS.index(level)
+        self.n_cells = n_cells
+        self.days_per_year = days_per_year
+        self.dtype = np.dtype(dtype)
+
+        # daily buffers have an extra row for the values at initialisation
+        n_days = n_years * days_per_year + 1
+        self._daily = np.empty((n_days if self._level >= 2 else 0, len(SERIES)), dtype=self.dtype)
+        self._cells = {field: np.empty((n_days if self._level >= 3 else 0, n_cells), dtype=self.dtype)
+                       for field in CELL_FIELDS}
+        self._yearly = np.empty((n_years if self._level >= 1 else 0, len(SERIES)), dtype=self.dtype)
+        self.n_days = 0
+        self.n_years = 0
+
+        # running sums of the daily means over the current year and the number of days in them (per series, see 
+        # record()), for the yearly summary
+        self._year_sum = np.zeros(len(SERIES))
+        self._year_days = np.zeros(len(SERIES), dtype=int)
+        self._spell_rows = np.array([field in SPELL_FIELDS for field, _ in SERIES.values()])
+
+        # (series x cells) weights that turn the fields into the daily means, see start_year()
+        self._weights = np.full((len(SERIES), n_cells), 1. / n_cells, dtype=self.dtype)
+        # the fields of the series and their daily means, written in place every day
+        self._fields = np.empty((len(SERIES), n_cells), dtype=self.dtype)
+        self._means = np.empty(len(SERIES), dtype=self.dtype)
+
+        # grouped series by name, see add_groups()
+        self._grouped = {}
+        self._n_days_planned = n_days
+
+    def start_year(self, WSA_array):
+        '''
+        Build the WSA masks for a model year.
+        '''
+        WSA = np.asarray(WSA_array).ravel()
+        for row, (_, mask_value) in enumerate(SERIES.values()):
+            if mask_value is None:
+                self._weights[row] = 1. / self.n_cells
+            else:
+                mask = WSA == mask_value
+                # the mean over an empty mask is nan, as with np.mean
+                self._weights[row] = mask / mask.sum() if mask.any() else np.nan
+        self._year_sum[:] = 0.
+        self._year_days[:] = 0
+        for grouped in self._grouped.values():
+            grouped.start_year()
+
+    def add_groups(self, name, groups, fields):
+        '''
+        Also record the daily (at level 'daily' or 'full') and yearly means of `fields` over each group of `groups`
+        (a CellGroups), from the next recorded day on. Replaces any grouped series already recorded under `name`.
+        '''
+        self._grouped[name] = _GroupedSeries(groups, fields, self._n_days_planned if self._level >= 2 else 0,
+                                             self._yearly.shape[0], self.dtype)
+
+    def grouped(self, name):
+        '''
+        (days x fields x groups) daily means of the grouped series `name` recorded so far, as a copy.
+        '''
+        grouped = self._grouped[name]
+        return grouped.daily[:grouped.n_days].copy()
+
+    def grouped_yearly(self, name):
+        '''
+        (years x fields x groups) yearly means of the grouped series `name` recorded so far, as a copy.
+        '''
+        grouped = self._grouped[name]
+        return grouped.yearly[:grouped.n_years].copy()
+
+    def record(self, grid, spell_interior=False):
+        '''
+        Record the current values of the grid fields for one day. If `spell_interior`, the day is one of a dry spell 
+        stepped in one go other than its last, so the fields in SPELL_FIELDS are recorded as nan and left out of the 
+        yearly means.
+        '''
+        if self._level == 0:
+            return
+        for grouped in self._grouped.values():
+            grouped.record(grid, self._level >= 2, spell_interior)
+        for row, (field, _) in enumerate(SERIES.values()):
+            self._fields[row] = grid.at_cell[field]
+        means = np.einsum('ij,ij->i', self._weights, self._fields, out=self._means)
+        if spell_interior:
+            means[self._spell_rows] = np.nan
+            np.add(self._year_sum, means, out=self._year_sum, where=~self._spell_rows)
+            self._year_days += ~self._spell_rows
+        else:
+            self._year_sum += means
+            self._year_days += 1
+        if self._level >= 2:
+            self._daily = _ensure_rows(self._daily, self.n_days + 1)
+            self._daily[self.n_days] = means
+            if self._level >= 3:
+                for field in CELL_FIELDS:
+                    self._cells[field] = _ensure_rows(self._cells[field], self.n_days + 1)
+                    if spell_interior and field in SPELL_FIELDS:
+                        self._cells[field][self.n_days] = np.nan
+                    else:
+                        self._cells[field][self.n_days] = grid.at_cell[field]
+            self.n_days += 1
+
+    def record_initial(self, grid):
+        '''
+        Record the values of the grid fields at initialisation (as the first row of the daily series).
+        '''
+        if self._level >= 2:
+            self.record(grid)
+        self._year_sum[:] = 0.
+        self._year_days[:] = 0
+
+    def end_year(self):
+        '''
+        Record the yearly means of the daily series for the model year that just ended.
+        '''
+        if self._level == 0:
+            return
+        self._yearly = _ensure_rows(self._yearly, self.n_years + 1)
+        self._yearly[self.n_years] = self._year_sum / np.maximum(self._year_days, 1)
+        self.n_years += 1
+        for grouped in self._grouped.values():
+            grouped.end_year()
+
+    def series(self, name):
+        '''
+        Daily series `name` (one of SERIES) recorded so far. This (and the other getters) returns a copy, so changing
+        it doesn't change the recorded output, and it doesn't change as later days are recorded.
+        '''
+        return self._daily[:self.n_days, list(SERIES).index(name)].copy()
+
+    def yearly(self, name):
+        '''
+        Yearly means of the daily series `name` (one of SERIES) recorded so far, as a copy.
+        '''
+        return self._yearly[:self.n_years, list(SERIES).index(name)].copy()
+
+    def cells(self, field):
+        '''
+        (days x cells) values of `field` (one of CELL_FIELDS) recorded so far at level 'full', as a copy.
+        '''
+        return self._cells[field][:self.n_days].copy()
+
+    def get_state(self):
+        '''
+        Return the recorded output as a flat dict of numpy arrays, see EcoHyd.get_state().
+        '''
+        state = {'daily': self._daily[:self.n_days].copy(), 'yearly': self._yearly[:self.n_years].copy()}
+        for field in CELL_FIELDS:
+            state['cells:' + field] = self.cells(field)
+        for name in self._grouped:
+            state['grouped:' + name] = self.grouped(name)
+            state['grouped_yearly:' + name] = self.grouped_yearly(name)
+        return state
+
+    def set_state(self, state):
+        '''
+        Restore output saved with get_state() by a recorder with the same level. Grouped series are only restored
+        for groups already added under the same name.
+        '''
+        self.n_days = len(state['daily'])
+        self.n_years = len(state['yearly'])
+        self._daily = _ensure_rows(self._daily, self.n_days)
+        self._daily[:self.n_days] = state['daily']
+        self._yearly = _ensure_rows(self._yearly, self.n_years)
+        self._yearly[:self.n_years] = state['yearly']
+        for field in CELL_FIELDS:
+            self._cells[field] = _ensure_rows(self._cells[field], len(state['cells:' + field]))
+            self._cells[field][:len(state['cells:' + field])] = state['cells:' + field]
+        for name, grouped in self._grouped.items():
+            if 'grouped:' + name in state:
+                grouped.set_state(state['grouped:' + name], state['grouped_yearly:' + name])
+
+
+class _GroupedSeries:
+    # daily and yearly means of some cell fields over a CellGroups
+
+    def __init__(self, groups, fields, n_days, n_years, dtype=float):
+        self.groups = groups
+        self.fields = list(fields)
+        shape = (len(self.fields), groups.n_groups)
+        self.daily = np.empty((n_days,) + shape, dtype=dtype)
+        self.yearly = np.empty((n_years,) + shape, dtype=dtype)
+        self.n_days = 0
+        self.n_years = 0
+        self._year_sum = np.zeros(shape)
+        self._year_days = np.zeros((len(self.fields), 1), dtype=int)
+        self._values = np.empty((len(self.fields), len(groups.codes)), dtype=dtype)
+        self._spell_rows = np.array([[field in SPELL_FIELDS] for field in self.fields], dtype=bool).reshape(-1, 1)
+
+    def start_year(self):
+        self._year_sum[:] = 0.
+        self._year_days[:] = 0
+
+    def record(self, grid, daily, spell_interior=False):
+        for row, field in enumerate(self.fields):
+            self._values[row] = grid.at_cell[field]
+        means = self.groups.mean(self._values)
+        if spell_interior:
+            means[self._spell_rows[:, 0]] = np.nan
+            np.add(self._year_sum, means, out=self._year_sum, where=~self._spell_rows)
+            self._year_days += ~self._spell_rows
+        else:
+            self._year_sum += means
+            self._year_days += 1
+        if daily:
+            self.daily = _ensure_rows(self.daily, self.n_days + 1)
+            self.daily[self.n_days] = means
+            self.n_days += 1
+
+    def end_year(self):
+        self.yearly = _ensure_rows(self.yearly, self.n_years + 1)
+        self.yearly[self.n_years] = self._year_sum / np.maximum(self._year_days, 1)
+        self.n_years += 1
+
+    def set_state(self, daily, yearly):
+        self.n_days = len(daily)
+        self.daily = _ensure_rows(self.daily, self.n_days)
+        self.daily[:self.n_days] = daily
+        self.n_years = len(yearly)
+        self.yearly = _ensure_rows(self.yearly, self.n_years)
+        self.yearly[:self.n_years] = yearly
+
+
+def _ensure_rows(buffer, n_rows):
+    # grow a buffer (by at least doubling it) if the model runs for longer than planned
+    if len(buffer) >= n_rows:
+        return buffer
+    grown = np.empty((max(n_rows, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:len(buffer)] = buffer
+    return grown
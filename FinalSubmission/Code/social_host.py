@@ -0,0 +1,197 @@
+'''
+Many NetLogo workspaces of the social model in one JVM.
+
+Every process that starts a pynetlogo.NetLogoLink starts a JVM of its own, so running replicates of the coupled model
+in parallel processes (as the driver notebook does) costs a whole JVM per replicate, and memory rather than cores
+limits how many fit on a machine. Within one process though, every NetLogoLink after the first is just another
+headless workspace in the JVM that is already running.
+
+SocialModelHost starts one host process that loads modelv3.nlogo into n_workspaces workspaces and serves each of them
+from a thread of its own (JPype releases the GIL while NetLogo runs, so the workspaces run at the same time). The
+coupling workers get a RemoteWorkspace each (see SocialModelHost.workspace()), which can be passed to another process
+and has the NetLogoLink methods modelScript.py uses (command, report, write_NetLogo_attriblist), so e.g.
+
+    host = SocialModelHost(10)
+    Process(target=fullModelRun, args=(combination_arrays, "new_temp_data.csv", 30),
+            kwargs={'workspace': host.workspace(0)})
+
+runs the social model of that process in the first workspace of the host.
+'''
+
+import multiprocessing
+import threading
+import traceback
+import weakref
+
+from netlogo_pool import NETLOGO_HOME, MODEL_PATH, DEFAULT_MAX_RUNS
+
+# NetLogoLink methods a RemoteWorkspace can call
+_METHODS = {'command', 'report', 'write_NetLogo_attriblist', 'repeat_command', 'repeat_report', 'patch_report'}
+
+
+class SocialModelHost:
+    '''
+    Host process running n_workspaces NetLogo workspaces of the social model in one JVM.
+    '''
+
+    def __init__(self, n_workspaces, netlogo_home=NETLOGO_HOME, model_path=MODEL_PATH, max_runs=DEFAULT_MAX_RUNS,
+                 jvm_args=None):
+        '''
+        Parameters
+        ----------
+        n_workspaces: int
+            Number of workspaces, i.e. of social models that can run at the same time.
+        netlogo_home: str, optional
+            Where NetLogo is installed.
+        model_path: str, optional
+            The .nlogo model to load into every workspace.
+        max_runs: int or None, optional
+            Number of runs a workspace is used for before it is replaced by a new one, see RemoteWorkspace.link().
+        jvm_args: list of str, optional
+            Arguments of the JVM (e.g. ['-Xmx8g'] to give it enough heap for all workspaces).
+        '''
+        context = multiprocessing.get_context()
+        control, host_control = context.Pipe()
+        connections = [context.Pipe() for i in range(n_workspaces)]
+        self._workspaces = [RemoteWorkspace(connection) for connection, _ in connections]
+        self._control = control
+        self._process = context.Process(target=_host_main, daemon=True,
+                                        args=(host_control, [connection for _, connection in connections],
+                                              netlogo_home, model_path, max_runs, jvm_args))
+        self._process.start()
+        self._finalizer = weakref.finalize(self, _shutdown, self._control, self._process)
+
+        # wait until all workspaces have loaded the model
+        status, message = self._control.recv()
+        if status == 'error':
+            self._finalizer()
+            raise RuntimeError('the social model host failed to start:\n' + message)
+
+    @property
+    def n_workspaces(self):
+        return len(self._workspaces)
+
+    def workspace(self, i):
+        '''
+        RemoteWorkspace of the i-th workspace of the host. Each workspace must only be used by one process at a time.
+        '''
+        return self._workspaces[i]
+
+    def close(self):
+        '''
+        Kill all workspaces and stop the host process.
+        '''
+        self._finalizer()
+
+
+class RemoteWorkspace:
+    '''
+    A workspace of a SocialModelHost, with the NetLogoLink methods used by modelScript.py.
+    '''
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def link(self):
+        '''
+        The workspace for a new run (as NetLogoPool.link(), so setUpNetLogoModel() in modelScript.py can take either).
+        The host counts the runs of the workspace (whichever process they come from) and replaces it with a new one
+        with the model loaded after max_runs runs.
+        '''
+        self._call('link')
+        return self
+
+    def command(self, netlogo_command):
+        return self._call('command', netlogo_command)
+
+    def report(self, netlogo_reporter):
+        return self._call('report', netlogo_reporter)
+
+    def write_NetLogo_attriblist(self, agent_data, agent_name):
+        return self._call('write_NetLogo_attriblist', agent_data, agent_name)
+
+    def repeat_command(self, netlogo_command, reps):
+        return self._call('repeat_command', netlogo_command, reps)
+
+    def repeat_report(self, netlogo_reporter, reps, go='go', include_t0=True):
+        return self._call('repeat_report', netlogo_reporter, reps, go=go, include_t0=include_t0)
+
+    def patch_report(self, attribute):
+        return self._call('patch_report', attribute)
+
+    def _call(self, method, *args, **kwargs):
+        # run the method on the workspace in the host and wait for its result
+        self._connection.send((method, args, kwargs))
+        status, result = self._connection.recv()
+        if status == 'error':
+            raise RuntimeError('NetLogo workspace failed:\n' + result)
+        return result
+
+
+def _shutdown(control, process):
+    # kill the workspaces and stop the host
+    try:
+        control.send(('close', None))
+    except (OSError, ValueError):
+        pass
+    process.join(timeout=30)
+    if process.is_alive():
+        process.terminate()
+
+
+def _host_main(control, connections, netlogo_home, model_path, max_runs, jvm_args):
+    # imported here so only the host process needs pynetlogo (and starts a JVM)
+    try:
+        import pynetlogo
+
+        def new_link():
+            # the first link starts the JVM, every later one is another workspace in it
+            kwargs = {} if jvm_args is None else {'jvmargs': jvm_args}
+            link = pynetlogo.NetLogoLink(gui=False, netlogo_home=netlogo_home, **kwargs)
+            link.load_model(model_path)
+            return link
+
+        links = [new_link() for connection in connections]
+        runs = [0] * len(links)
+    except Exception:
+        control.send(('error', traceback.format_exc()))
+        return
+
+    def serve(i, connection):
+        # run the calls of the RemoteWorkspace of workspace i
+        while True:
+            try:
+                method, args, kwargs = connection.recv()
+            except EOFError:
+                break
+            try:
+                if method == 'link':
+                    # a new run: replace the workspace if it has done max_runs runs
+                    if max_runs is not None and runs[i] >= max_runs:
+                        links[i].kill_workspace()
+                        links[i] = new_link()
+                        runs[i] = 0
+                    runs[i] += 1
+                    result = None
+                elif method in _METHODS:
+                    result = getattr(links[i], method)(*args, **kwargs)
+                else:
+                    raise ValueError('unknown NetLogoLink method ' + str(method))
+                connection.send(('ok', result))
+            except Exception:
+                connection.send(('error', traceback.format_exc()))
+
+    for i, connection in enumerate(connections):
+        threading.Thread(target=serve, args=(i, connection), daemon=True).start()
+    control.send(('ready', None))
+
+    # wait until the host is closed (or the process that started it is gone)
+    try:
+        control.recv()
+    except EOFError:
+        pass
+    for link in links:
+        try:
+            link.kill_workspace()
+        except Exception:
+            pass
@@ -6,13 +6,21 @@ Guide to changes w.r.t. landlab default:
  water is lost to evapotranspiration in dry conditions. A slight tradeoff is made in the interception capacity in that
  also less rainwater reaches the soil, but since we expect little rain in the dry season anyway, the hope is that the effect of 
  inhibited evaporation dominates the effect of reduced infiltration.
+-added a 'Vectorized' method that solves the Laio et al. regimes for all cells at once with masks instead of
+ looping over cells in Python. It gives the same results as the default 'Grid' method.
+-added max_evapotranspiration(), which gives the maximum ET rate of each cell for a PET rate without updating 
+ anything (used to decide which dry spells can be stepped at once, see ecohydr_mod.py).
+-added a dtype argument, so the parameters and internal arrays can be kept in single precision along with the grid 
+ fields (see the 'dtype' option in ecohydr_mod.py).
 '''
 
 import numpy as np
 
 from landlab import Component
 
-_VALID_METHODS = {"Grid", "Multi"}
+from backends import jit
+
+_VALID_METHODS = {"Grid", "Multi", "Vectorized", "Numba"}
 
 
 def assert_method_is_valid(method):
@@ -20,6 +28,203 @@ def assert_method_is_valid(method):
         raise ValueError("%s: Invalid method name" % method)
 
 
+def _update_cells(
+    P_, SO, PET, vegcover, fr, vegtype, zr, soil_pc, soil_fc, soil_sc, soil_wp, soil_hgw, soil_beta, soil_Ib,
+    soil_Iv, interception_cap, evap_inhib, f_bare, runon, soil_Ew, Tb, water_stress, S, D, ETA, runoff, ETmax, Sini
+):
+    """Per-cell solution of the Laio et al. (2001) regimes, the kernel of the
+    "Grid" method. It only uses scalar arithmetic on arrays, so the same code
+    is compiled with Numba for the "Numba" method (see backends.py).
+    """
+    for cell in range(len(SO)):
+        P = P_[cell]
+        # print cell
+        s = SO[cell]
+        fbare = f_bare
+        ZR = zr[cell]
+        pc = soil_pc[cell]
+        fc = soil_fc[cell]
+        scc = soil_sc[cell]
+        wp = soil_wp[cell]
+        hgw = soil_hgw[cell]
+        beta = soil_beta[cell]
+        if vegtype[cell] == 0:  # 0 - GRASS
+            sc = scc * fr[cell] + (1 - fr[cell]) * fc
+        else:
+            sc = scc
+
+        Inf_cap = (
+            soil_Ib[cell] * (1 - vegcover[cell])
+            + soil_Iv[cell] * vegcover[cell]
+        )
+        # Infiltration capacity
+
+        Int_cap = min(vegcover[cell] * interception_cap[cell], P)
+        # Interception capacity
+
+        Evap_inh = evap_inhib[cell]
+        #evaporative inhibition
+
+        Peff = max(P - Int_cap, 0.0)  # Effective precipitation depth
+        mu = (Inf_cap / 1000.0) / (pc * ZR * (np.exp(beta * (1.0 - fc)) - 1.0)) #pc is soil porosity, ZR root depth, beta is percolation constant
+        
+        #if the evaporative inhibition is different from interception capacity, calculate max. evap from evaporative inhibition
+        if interception_cap[cell] == evap_inhib[cell]:
+            Ep = max(
+                (
+                    PET[cell] * fr[cell]
+                    + fbare * PET[cell] * (1.0 - fr[cell])
+                )
+                - Int_cap,
+                0.0001,
+            )  # mm/d
+        else:
+            Ep = max(
+                (
+                    PET[cell] * fr[cell]
+                    + fbare * PET[cell] * (1.0 - fr[cell])
+                )
+                - Evap_inh,
+                0.0001,
+            )  # mm/d
+        #print('Maximum Evapotranspiration:', Ep)
+        ETmax[cell] = Ep #set maximum ET from PET, bare soil fraction (fbare) and leaf area index fraction (fr)
+        nu = ((Ep / 24.0) / 1000.0) / (pc * ZR)  # Loss function parameter
+        nuw = ((soil_Ew / 24.0) / 1000.0) / (pc * ZR) # Loss function parameter
+        sini = SO[cell] + ((Peff + runon) / (pc * ZR * 1000.0)) #this is probably the initial soil moisture after accounting for rainfall from storm
+
+        if sini > 1.0:
+            runoff[cell] = (sini - 1.0) * pc * ZR * 1000.0
+            # print 'Runoff =', runoff
+            sini = 1.0
+        else:
+            runoff[cell] = 0.0
+
+        if sini >= fc: #if initial saturation smaller than soil saturation at field capacity, calculate soil leakage rate
+            #time left to spend beyond field capacity?
+            tfc = (1.0 / (beta * (mu - nu))) * (
+                beta * (fc - sini)
+                + np.log((nu - mu + mu * np.exp(beta * (sini - fc))) / nu)
+            )
+
+            #time left to spend  before stomatal closure?
+            tsc = ((fc - sc) / nu) + tfc
+
+            #time left to spend before wilting point?
+            twp = ((sc - wp) / (nu - nuw)) * np.log(nu / nuw) + tsc
+
+            if Tb < tfc:
+                s = abs(
+                    sini
+                    - (1.0 / beta)
+                    * np.log(
+                        (
+                            (nu - mu + mu * np.exp(beta * (sini - fc)))
+                            * np.exp(beta * (nu - mu) * Tb)
+                            - mu * np.exp(beta * (sini - fc))
+                        )
+                        / (nu - mu)
+                    )
+                )
+
+                D[cell] = ((pc * ZR * 1000.0) * (sini - s)) - (
+                    Tb * (Ep / 24.0)
+                )
+                ETA[cell] = Tb * (Ep / 24.0)
+
+            elif Tb >= tfc and Tb < tsc:
+                s = fc - (nu * (Tb - tfc))
+                D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
+                    (tfc) * (Ep / 24.0)
+                )
+                ETA[cell] = Tb * (Ep / 24.0)
+
+            elif Tb >= tsc and Tb < twp:
+                s = wp + (sc - wp) * (
+                    (nu / (nu - nuw))
+                    * np.exp((-1) * ((nu - nuw) / (sc - wp)) * (Tb - tsc))
+                    - (nuw / (nu - nuw))
+                )
+                D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
+                    tfc * Ep / 24.0
+                )
+                ETA[cell] = (1000.0 * ZR * pc * (sini - s)) - D[cell]
+
+            else:
+                s = hgw + (wp - hgw) * np.exp(
+                    (-1) * (nuw / (wp - hgw)) * max(Tb - twp, 0.0)
+                )
+                D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
+                    tfc * Ep / 24.0
+                )
+                ETA[cell] = (1000.0 * ZR * pc * (sini - s)) - D[cell]
+
+        elif sini < fc and sini >= sc:  #if initial soil saturation is smaller than field capacity but larger than stomatal closure saturation
+            tfc = 0.0
+            tsc = (sini - sc) / nu
+            twp = ((sc - wp) / (nu - nuw)) * np.log(nu / nuw) + tsc
+
+            if Tb < tsc:
+                s = sini - nu * Tb
+                D[cell] = 0.0
+                ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+            elif Tb >= tsc and Tb < twp:
+                s = wp + (sc - wp) * (
+                    (nu / (nu - nuw))
+                    * np.exp((-1) * ((nu - nuw) / (sc - wp)) * (Tb - tsc))
+                    - (nuw / (nu - nuw))
+                )
+                D[cell] = 0
+                ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+            else:
+                s = hgw + (wp - hgw) * np.exp(
+                    (-1) * (nuw / (wp - hgw)) * (Tb - twp)
+                )
+                D[cell] = 0.0
+                ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+        elif sini < sc and sini >= wp: # if initial soil saturation is smaller than stomatal closure thresh. but larger than wilting point
+            tfc = 0
+            tsc = 0
+            twp = ((sc - wp) / (nu - nuw)) * np.log(
+                1 + (nu - nuw) * (sini - wp) / (nuw * (sc - wp))
+            )
+
+            if Tb < twp:
+                s = wp + ((sc - wp) / (nu - nuw)) * (
+                    (np.exp((-1) * ((nu - nuw) / (sc - wp)) * Tb))
+                    * (nuw + ((nu - nuw) / (sc - wp)) * (sini - wp))
+                    - nuw
+                )
+                D[cell] = 0.0
+                ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+            else:
+                s = hgw + (wp - hgw) * np.exp(
+                    (-1) * (nuw / (wp - hgw)) * (Tb - twp)
+                )
+                D[cell] = 0.0
+                ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+        else: #if the soil is already at wilting point initially
+            tfc = 0.0
+            tsc = 0.0
+            twp = 0.0
+
+            s = hgw + (sini - hgw) * np.exp((-1) * (nuw / (wp - hgw)) * Tb)
+            D[cell] = 0.0
+            ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+
+        water_stress[cell] = min(
+            ((max(((sc - (s + sini) / 2.0) / (sc - wp)), 0.0)) ** 4.0), 1.0
+        )
+        S[cell] = s
+        SO[cell] = s
+        Sini[cell] = sini
+
+
 class SoilMoisture(Component):
     """Landlab component that simulates root-zone average soil moisture at each
     cell using inputs of potential evapotranspiration, live leaf area index,
@@ -284,6 +489,7 @@ class SoilMoisture(Component):
         LAI_max_cc=0.01, #Leaf Area index; set this to the same as bare soil to get almost no evapotranspiration
         LAIR_max_cc=0.01,
         method="Grid",
+        dtype=float,
         Tb=24.0,
         Tr=0.0,
         current_time=0,
@@ -326,7 +532,12 @@ class SoilMoisture(Component):
         LAIR_max: float, optional
             Reference leaf area index (m^2/m^2).
         method: str
-            Method used
+            Method used. "Grid" (default) loops over the cells, "Vectorized"
+            solves all cells at once with whole-array operations.
+        dtype: data-type, optional
+            Floating point type of the parameters and internal arrays, which
+            should match that of the grid fields (e.g. np.float32 to halve
+            the memory traffic of big grids).
         Tr: float, optional
             Storm duration (hours).
         Tb: float, optional
@@ -334,6 +545,14 @@ class SoilMoisture(Component):
         current_time: float
               Current time (years).
         """
+        self._dtype = np.dtype(dtype)
+        if self._dtype != np.float64:
+            # landlab checks the dtype of the input fields against _info, so
+            # this instance gets a copy of it that accepts the dtype given
+            self._info = {
+                name: dict(info, dtype=self._dtype) if info["dtype"] is float else info
+                for name, info in self._info.items()
+            }
         super().__init__(grid)
 
         self.current_time = 0
@@ -550,8 +769,10 @@ class SoilMoisture(Component):
         self._vegtype = self._grid["cell"]["vegetation__plant_functional_type"]
         self._runon = runon
         self._fbare = f_bare
-        self._interception_cap = np.choose(
-            self._vegtype,
+        # parameter tables indexed by PFT, kept for update_plant_functional_type
+        self._pft_params = {}
+        self._interception_cap = self._choose_pft(
+            "_interception_cap",
             [
                 intercept_cap_grass,
                 intercept_cap_shrub,
@@ -563,8 +784,8 @@ class SoilMoisture(Component):
             ],
         )
 
-        self._evap_inhib = np.choose(
-            self._vegtype,
+        self._evap_inhib = self._choose_pft(
+            "_evap_inhib",
             [
                 intercept_cap_grass,
                 intercept_cap_shrub,
@@ -576,49 +797,54 @@ class SoilMoisture(Component):
             ],
         )
 
-        self._zr = np.choose(
-            self._vegtype, [zr_grass, zr_shrub, zr_tree, zr_bare, zr_shrub, zr_tree, zr_cc]
+        self._zr = self._choose_pft(
+            "_zr",
+            [zr_grass, zr_shrub, zr_tree, zr_bare, zr_shrub, zr_tree, zr_cc]
         )
 
-        self._soil_Ib = np.choose(
-            self._vegtype,
+        self._soil_Ib = self._choose_pft(
+            "_soil_Ib",
             [I_B_grass, I_B_shrub, I_B_tree, I_B_bare, I_B_shrub, I_B_tree, I_B_cc],
         )
 
-        self._soil_Iv = np.choose(
-            self._vegtype,
+        self._soil_Iv = self._choose_pft(
+            "_soil_Iv",
             [I_V_grass, I_V_shrub, I_V_tree, I_V_bare, I_V_shrub, I_V_tree, I_V_cc],
         )
 
         self._soil_Ew = soil_ew
-        self._soil_pc = np.choose(
-            self._vegtype, [pc_grass, pc_shrub, pc_tree, pc_bare, pc_shrub, pc_tree, pc_cc]
+        self._soil_pc = self._choose_pft(
+            "_soil_pc",
+            [pc_grass, pc_shrub, pc_tree, pc_bare, pc_shrub, pc_tree, pc_cc]
         )
 
-        self._soil_fc = np.choose( #soil saturation at field capacity
-            self._vegtype, [fc_grass, fc_shrub, fc_tree, fc_bare, fc_shrub, fc_tree, fc_cc]
+        self._soil_fc = self._choose_pft( #soil saturation at field capacity
+            "_soil_fc",
+            [fc_grass, fc_shrub, fc_tree, fc_bare, fc_shrub, fc_tree, fc_cc]
         )
 
-        self._soil_sc = np.choose( #soil saturation at stomatal closure
-            self._vegtype, [sc_grass, sc_shrub, sc_tree, sc_bare, sc_shrub, sc_tree, sc_cc]
+        self._soil_sc = self._choose_pft( #soil saturation at stomatal closure
+            "_soil_sc",
+            [sc_grass, sc_shrub, sc_tree, sc_bare, sc_shrub, sc_tree, sc_cc]
         )
 
-        self._soil_wp = np.choose(
-            self._vegtype, [wp_grass, wp_shrub, wp_tree, wp_bare, wp_shrub, wp_tree, wp_cc]
+        self._soil_wp = self._choose_pft(
+            "_soil_wp",
+            [wp_grass, wp_shrub, wp_tree, wp_bare, wp_shrub, wp_tree, wp_cc]
         )
 
-        self._soil_hgw = np.choose(
-            self._vegtype,
+        self._soil_hgw = self._choose_pft(
+            "_soil_hgw",
             [hgw_grass, hgw_shrub, hgw_tree, hgw_bare, hgw_shrub, hgw_tree, hgw_cc],
         )
 
-        self._soil_beta = np.choose(
-            self._vegtype,
+        self._soil_beta = self._choose_pft(
+            "_soil_beta",
             [beta_grass, beta_shrub, beta_tree, beta_bare, beta_shrub, beta_tree, beta_cc],
         )
 
-        self._LAI_max = np.choose(
-            self._vegtype,
+        self._LAI_max = self._choose_pft(
+            "_LAI_max",
             [
                 LAI_max_grass,
                 LAI_max_shrub,
@@ -630,8 +856,8 @@ class SoilMoisture(Component):
             ],
         )
 
-        self._LAIR_max = np.choose(
-            self._vegtype,
+        self._LAIR_max = self._choose_pft(
+            "_LAIR_max",
             [
                 LAIR_max_grass,
                 LAIR_max_shrub,
@@ -643,6 +869,68 @@ class SoilMoisture(Component):
             ],
         )
 
+        self._vegtype_ini = self._vegtype.copy()
+
+    def _choose_pft(self, name, values):
+        """Store the per-PFT parameter table ``values`` under ``name`` and
+        return its value at each cell.
+        """
+        self._pft_params[name] = np.asarray(values, dtype=self._dtype)
+        return self._pft_params[name][self._vegtype]
+
+    def update_plant_functional_type(self):
+        """Re-initialize the cells whose plant functional type changed.
+
+        Picks up the current ``vegetation__plant_functional_type`` field and
+        refreshes the per-PFT parameters only on cells whose PFT differs from
+        the last (re-)initialization, using the parameter tables from the
+        last call to ``initialize``. This is equivalent to calling
+        ``initialize`` again with the same parameters, but the cost scales
+        with the number of changed cells rather than the size of the grid.
+
+        Returns
+        -------
+        ndarray of int
+            IDs of the cells whose PFT changed.
+        """
+        self._vegtype = self._grid["cell"]["vegetation__plant_functional_type"]
+        changed = np.flatnonzero(self._vegtype != self._vegtype_ini)
+        if len(changed) > 0:
+            new_vegtype = self._vegtype[changed]
+            for name, table in self._pft_params.items():
+                getattr(self, name)[changed] = table[new_vegtype]
+            self._vegtype_ini[changed] = new_vegtype
+        return changed
+
+    def max_evapotranspiration(self, PET, P=0.0):
+        """Maximum evapotranspiration rate at each cell for the current
+        vegetation, as computed by ``update``.
+
+        Parameters
+        ----------
+        PET: ndarray
+            Potential evapotranspiration rate at each cell (mm/d).
+        P: ndarray or float, optional
+            Rainfall depth at each cell (mm).
+
+        Returns
+        -------
+        ndarray
+            Maximum evapotranspiration rate (mm/d) at each cell.
+        """
+        fr = np.minimum(
+            self._grid["cell"]["vegetation__live_leaf_area_index"] / self._LAIR_max, 1.0
+        )
+        vegcover = self._grid["cell"]["vegetation__cover_fraction"]
+        Int_cap = np.minimum(vegcover * self._interception_cap, P)
+        return np.maximum(
+            (PET * fr + self._fbare * PET * (1.0 - fr))
+            - np.where(
+                self._interception_cap == self._evap_inhib, Int_cap, self._evap_inhib
+            ),
+            0.0001,
+        )
+
     def update(self):
         """Update fields with current loading conditions.
 
@@ -661,8 +949,11 @@ class SoilMoisture(Component):
         self._S = self._cell_values["soil_moisture__saturation_fraction"]
         self._D = self._cell_values["soil_moisture__root_zone_leakage"]
         self._ETA = self._cell_values["surface__evapotranspiration"]
-        self._fr = (
-            self._cell_values["vegetation__live_leaf_area_index"] / self._LAIR_max
+        # the scratch arrays are written in place, see _scratch()
+        self._fr = np.divide(
+            self._cell_values["vegetation__live_leaf_area_index"],
+            self._LAIR_max,
+            out=self._scratch("_fr"),
         )
         self._runoff = self._cell_values["surface__runoff"]
         # LAIl = self._cell_values['vegetation__live_leaf_area_index']
@@ -671,197 +962,212 @@ class SoilMoisture(Component):
         #     self._fr = np.zeros(self._grid.number_of_cells)
         # else:
         #     self._fr = (self._vegcover[0]*LAIl/LAIt)
-        self._fr[self._fr > 1.0] = 1.0
-        self._Sini = np.zeros(self._SO.shape)
-        self._ETmax = np.zeros(self._SO.shape)
-
-        for cell in range(0, self._grid.number_of_cells):
-            P = P_[cell]
-            # print cell
-            s = self._SO[cell]
-            fbare = self._fbare
-            ZR = self._zr[cell]
-            pc = self._soil_pc[cell]
-            fc = self._soil_fc[cell]
-            scc = self._soil_sc[cell]
-            wp = self._soil_wp[cell]
-            hgw = self._soil_hgw[cell]
-            beta = self._soil_beta[cell]
-            if self._vegtype[cell] == 0:  # 0 - GRASS
-                sc = scc * self._fr[cell] + (1 - self._fr[cell]) * fc
-            else:
-                sc = scc
+        np.minimum(self._fr, 1.0, out=self._fr)
+        self._scratch("_Sini").fill(0.0)
+        self._scratch("_ETmax").fill(0.0)
+
+        if self._method == "Vectorized":
+            self._update_vectorized(P_, Tb)
+            self.current_time += (Tb + Tr) / (24.0 * 365.)
+            return current_time
+
+        kernel = jit(_update_cells) if self._method == "Numba" else _update_cells
+        kernel(
+            np.asarray(P_, dtype=self._dtype),
+            self._SO,
+            self._PET,
+            self._vegcover,
+            self._fr,
+            self._vegtype,
+            self._zr,
+            self._soil_pc,
+            self._soil_fc,
+            self._soil_sc,
+            self._soil_wp,
+            self._soil_hgw,
+            self._soil_beta,
+            self._soil_Ib,
+            self._soil_Iv,
+            self._interception_cap,
+            self._evap_inhib,
+            float(self._fbare),
+            float(self._runon),
+            float(self._soil_Ew),
+            float(Tb),
+            self._water_stress,
+            self._S,
+            self._D,
+            self._ETA,
+            self._runoff,
+            self._ETmax,
+            self._Sini,
+        )
 
-            Inf_cap = (
-                self._soil_Ib[cell] * (1 - self._vegcover[cell])
-                + self._soil_Iv[cell] * self._vegcover[cell]
-            )
-            # Infiltration capacity
-
-            Int_cap = min(self._vegcover[cell] * self._interception_cap[cell], P)
-            # Interception capacity
-
-            Evap_inh = self._evap_inhib[cell]
-            #evaporative inhibition
-
-            Peff = max(P - Int_cap, 0.0)  # Effective precipitation depth
-            mu = (Inf_cap / 1000.0) / (pc * ZR * (np.exp(beta * (1.0 - fc)) - 1.0)) #pc is soil porosity, ZR root depth, beta is percolation constant
-            
-            #if the evaporative inhibition is different from interception capacity, calculate max. evap from evaporative inhibition
-            if self._interception_cap[cell] == self._evap_inhib[cell]:
-                Ep = max(
-                    (
-                        self._PET[cell] * self._fr[cell]
-                        + fbare * self._PET[cell] * (1.0 - self._fr[cell])
-                    )
-                    - Int_cap,
-                    0.0001,
-                )  # mm/d
-            else:
-                Ep = max(
-                    (
-                        self._PET[cell] * self._fr[cell]
-                        + fbare * self._PET[cell] * (1.0 - self._fr[cell])
-                    )
-                    - Evap_inh,
-                    0.0001,
-                )  # mm/d
-            #print('Maximum Evapotranspiration:', Ep)
-            self._ETmax[cell] = Ep #set maximum ET from PET, bare soil fraction (fbare) and leaf area index fraction (fr)
-            nu = ((Ep / 24.0) / 1000.0) / (pc * ZR)  # Loss function parameter
-            nuw = ((self._soil_Ew / 24.0) / 1000.0) / (pc * ZR) # Loss function parameter
-            sini = self._SO[cell] + ((Peff + self._runon) / (pc * ZR * 1000.0)) #this is probably the initial soil moisture after accounting for rainfall from storm
-
-            if sini > 1.0:
-                self._runoff[cell] = (sini - 1.0) * pc * ZR * 1000.0
-                # print 'Runoff =', self._runoff
-                sini = 1.0
-            else:
-                self._runoff[cell] = 0.0
+        self.current_time += (Tb + Tr) / (24.0 * 365.)
+        return current_time
 
-            if sini >= fc: #if initial saturation smaller than soil saturation at field capacity, calculate soil leakage rate
-                #time left to spend beyond field capacity?
-                tfc = (1.0 / (beta * (mu - nu))) * (
-                    beta * (fc - sini)
-                    + np.log((nu - mu + mu * np.exp(beta * (sini - fc))) / nu)
-                )
+    def _scratch(self, name):
+        """Scratch array ``name`` with one value per cell.
+
+        It is kept between updates (and only allocated again if the number
+        of cells changes), so the daily loop does not allocate it every day.
+        """
+        array = getattr(self, name, None)
+        if not isinstance(array, np.ndarray) or array.shape != self._SO.shape:
+            array = np.empty(self._SO.shape, dtype=self._dtype)
+            setattr(self, name, array)
+        return array
 
-                #time left to spend  before stomatal closure?
-                tsc = ((fc - sc) / nu) + tfc
+    def _update_vectorized(self, P, Tb):
+        """Whole-array version of the cell loop in ``update``.
 
-                #time left to spend before wilting point?
-                twp = ((sc - wp) / (nu - nuw)) * np.log(nu / nuw) + tsc
+        Each of the four Laio et al. (2001) regimes (sini >= fc,
+        fc > sini >= sc, sc > sini >= wp and below wp) and their sub-cases
+        is evaluated for every cell and then selected with masks that follow
+        the same if/elif order as the loop, so the results match the "Grid"
+        method cell by cell.
 
-                if Tb < tfc:
-                    s = abs(
+        Parameters
+        ----------
+        P: ndarray
+            Daily rainfall depth at each cell (mm).
+        Tb: float
+            Inter-storm duration (hours).
+        """
+        ZR = self._zr
+        pc = self._soil_pc
+        fc = self._soil_fc
+        scc = self._soil_sc
+        wp = self._soil_wp
+        hgw = self._soil_hgw
+        beta = self._soil_beta
+        fr = self._fr
+        vegcover = self._vegcover
+        PET = self._PET
+        pcZR = pc * ZR
+
+        # stomatal closure point shifts towards field capacity for sparse grass
+        sc = np.where(self._vegtype == 0, scc * fr + (1 - fr) * fc, scc)
+
+        Inf_cap = self._soil_Ib * (1 - vegcover) + self._soil_Iv * vegcover
+        Int_cap = np.minimum(vegcover * self._interception_cap, P)
+        Peff = np.maximum(P - Int_cap, 0.0)
+        mu = (Inf_cap / 1000.0) / (pcZR * (np.exp(beta * (1.0 - fc)) - 1.0))
+
+        # cells whose evaporative inhibition differs from the interception
+        # capacity (i.e. cover crop) lose the former instead of the latter
+        Ep = np.maximum(
+            (PET * fr + self._fbare * PET * (1.0 - fr))
+            - np.where(
+                self._interception_cap == self._evap_inhib, Int_cap, self._evap_inhib
+            ),
+            0.0001,
+        )  # mm/d
+        self._ETmax[:] = Ep
+        nu = ((Ep / 24.0) / 1000.0) / pcZR
+        nuw = ((self._soil_Ew / 24.0) / 1000.0) / pcZR
+        sini = self._SO + ((Peff + self._runon) / (pcZR * 1000.0))
+
+        self._runoff[:] = np.where(sini > 1.0, (sini - 1.0) * pcZR * 1000.0, 0.0)
+        sini = np.minimum(sini, 1.0)
+
+        # regimes, in the order the cell loop tests them
+        above_fc = sini >= fc
+        above_sc = ~above_fc & (sini < fc) & (sini >= sc)
+        above_wp = ~above_fc & ~above_sc & (sini < sc) & (sini >= wp)
+
+        s = np.empty_like(sini)
+        D = np.zeros_like(sini)
+        ETA = np.empty_like(sini)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            # drydown from sc to wp and from wp towards hgw, shared by regimes
+            k_sc = (nu - nuw) / (sc - wp)
+            k_wp = nuw / (wp - hgw)
+            t_sc_wp = ((sc - wp) / (nu - nuw)) * np.log(nu / nuw)
+
+            # sini >= fc
+            exp_fc = np.exp(beta * (sini - fc))
+            tfc = (1.0 / (beta * (mu - nu))) * (
+                beta * (fc - sini) + np.log((nu - mu + mu * exp_fc) / nu)
+            )
+            tsc = ((fc - sc) / nu) + tfc
+            twp = t_sc_wp + tsc
+            leak = Tb < tfc
+            to_sc = ~leak & (Tb >= tfc) & (Tb < tsc)
+            to_wp = ~leak & ~to_sc & (Tb >= tsc) & (Tb < twp)
+            to_hgw = ~leak & ~to_sc & ~to_wp
+            s1 = np.select(
+                [leak, to_sc, to_wp],
+                [
+                    np.abs(
                         sini
                         - (1.0 / beta)
                         * np.log(
                             (
-                                (nu - mu + mu * np.exp(beta * (sini - fc)))
-                                * np.exp(beta * (nu - mu) * Tb)
-                                - mu * np.exp(beta * (sini - fc))
+                                (nu - mu + mu * exp_fc) * np.exp(beta * (nu - mu) * Tb)
+                                - mu * exp_fc
                             )
                             / (nu - mu)
                         )
-                    )
-
-                    self._D[cell] = ((pc * ZR * 1000.0) * (sini - s)) - (
-                        Tb * (Ep / 24.0)
-                    )
-                    self._ETA[cell] = Tb * (Ep / 24.0)
-
-                elif Tb >= tfc and Tb < tsc:
-                    s = fc - (nu * (Tb - tfc))
-                    self._D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
-                        (tfc) * (Ep / 24.0)
-                    )
-                    self._ETA[cell] = Tb * (Ep / 24.0)
-
-                elif Tb >= tsc and Tb < twp:
-                    s = wp + (sc - wp) * (
-                        (nu / (nu - nuw))
-                        * np.exp((-1) * ((nu - nuw) / (sc - wp)) * (Tb - tsc))
-                        - (nuw / (nu - nuw))
-                    )
-                    self._D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
-                        tfc * Ep / 24.0
-                    )
-                    self._ETA[cell] = (1000.0 * ZR * pc * (sini - s)) - self._D[cell]
-
-                else:
-                    s = hgw + (wp - hgw) * np.exp(
-                        (-1) * (nuw / (wp - hgw)) * max(Tb - twp, 0.0)
-                    )
-                    self._D[cell] = ((pc * ZR * 1000.0) * (sini - fc)) - (
-                        tfc * Ep / 24.0
-                    )
-                    self._ETA[cell] = (1000.0 * ZR * pc * (sini - s)) - self._D[cell]
-
-            elif sini < fc and sini >= sc:  #if initial soil saturation is smaller than field capacity but larger than stomatal closure saturation
-                tfc = 0.0
-                tsc = (sini - sc) / nu
-                twp = ((sc - wp) / (nu - nuw)) * np.log(nu / nuw) + tsc
-
-                if Tb < tsc:
-                    s = sini - nu * Tb
-                    self._D[cell] = 0.0
-                    self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
-
-                elif Tb >= tsc and Tb < twp:
-                    s = wp + (sc - wp) * (
-                        (nu / (nu - nuw))
-                        * np.exp((-1) * ((nu - nuw) / (sc - wp)) * (Tb - tsc))
-                        - (nuw / (nu - nuw))
-                    )
-                    self._D[cell] = 0
-                    self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
-
-                else:
-                    s = hgw + (wp - hgw) * np.exp(
-                        (-1) * (nuw / (wp - hgw)) * (Tb - twp)
-                    )
-                    self._D[cell] = 0.0
-                    self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
-
-            elif sini < sc and sini >= wp: # if initial soil saturation is smaller than stomatal closure thresh. but larger than wilting point
-                tfc = 0
-                tsc = 0
-                twp = ((sc - wp) / (nu - nuw)) * np.log(
-                    1 + (nu - nuw) * (sini - wp) / (nuw * (sc - wp))
-                )
+                    ),
+                    fc - (nu * (Tb - tfc)),
+                    wp
+                    + (sc - wp)
+                    * ((nu / (nu - nuw)) * np.exp(-k_sc * (Tb - tsc)) - (nuw / (nu - nuw))),
+                ],
+                hgw + (wp - hgw) * np.exp(-k_wp * np.maximum(Tb - twp, 0.0)),
+            )
+            D1 = np.where(
+                leak,
+                (pcZR * 1000.0) * (sini - s1) - Tb * (Ep / 24.0),
+                (pcZR * 1000.0) * (sini - fc) - tfc * (Ep / 24.0),
+            )
+            ETA1 = np.where(
+                leak | to_sc, Tb * (Ep / 24.0), (1000.0 * pcZR * (sini - s1)) - D1
+            )
 
-                if Tb < twp:
-                    s = wp + ((sc - wp) / (nu - nuw)) * (
-                        (np.exp((-1) * ((nu - nuw) / (sc - wp)) * Tb))
-                        * (nuw + ((nu - nuw) / (sc - wp)) * (sini - wp))
-                        - nuw
-                    )
-                    self._D[cell] = 0.0
-                    self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+            # fc > sini >= sc
+            tsc = (sini - sc) / nu
+            twp = t_sc_wp + tsc
+            s2 = np.where(
+                Tb < tsc,
+                sini - nu * Tb,
+                np.where(
+                    (Tb >= tsc) & (Tb < twp),
+                    wp
+                    + (sc - wp)
+                    * ((nu / (nu - nuw)) * np.exp(-k_sc * (Tb - tsc)) - (nuw / (nu - nuw))),
+                    hgw + (wp - hgw) * np.exp(-k_wp * (Tb - twp)),
+                ),
+            )
 
-                else:
-                    s = hgw + (wp - hgw) * np.exp(
-                        (-1) * (nuw / (wp - hgw)) * (Tb - twp)
-                    )
-                    self._D[cell] = 0.0
-                    self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+            # sc > sini >= wp
+            twp = ((sc - wp) / (nu - nuw)) * np.log(
+                1 + (nu - nuw) * (sini - wp) / (nuw * (sc - wp))
+            )
+            s3 = np.where(
+                Tb < twp,
+                wp
+                + ((sc - wp) / (nu - nuw))
+                * (np.exp(-k_sc * Tb) * (nuw + k_sc * (sini - wp)) - nuw),
+                hgw + (wp - hgw) * np.exp(-k_wp * (Tb - twp)),
+            )
 
-            else: #if the soil is already at wilting point initially
-                tfc = 0.0
-                tsc = 0.0
-                twp = 0.0
+            # below wp
+            s4 = hgw + (sini - hgw) * np.exp(-k_wp * Tb)
 
-                s = hgw + (sini - hgw) * np.exp((-1) * (nuw / (wp - hgw)) * Tb)
-                self._D[cell] = 0.0
-                self._ETA[cell] = 1000.0 * ZR * pc * (sini - s)
+            s[:] = np.select([above_fc, above_sc, above_wp], [s1, s2, s3], s4)
+            D[above_fc] = D1[above_fc]
+            ETA[:] = 1000.0 * pcZR * (sini - s)
+            ETA[above_fc] = ETA1[above_fc]
 
-            self._water_stress[cell] = min(
-                ((max(((sc - (s + sini) / 2.0) / (sc - wp)), 0.0)) ** 4.0), 1.0
+            self._water_stress[:] = np.minimum(
+                np.maximum((sc - (s + sini) / 2.0) / (sc - wp), 0.0) ** 4.0, 1.0
             )
-            self._S[cell] = s
-            self._SO[cell] = s
-            self._Sini[cell] = sini
 
-        self.current_time += (Tb + Tr) / (24.0 * 365.)
-        return current_time
+        self._D[:] = D
+        self._ETA[:] = ETA
+        self._S[:] = s
+        self._SO[:] = s
+        self._Sini[:] = sini
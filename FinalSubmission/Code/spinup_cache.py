@@ -0,0 +1,101 @@
+'''
+Cache of the spun-up state of the Ecohydrology model.
+
+Before the coupled loop starts, the Ecohydrology model is spun up for a few years with the initial WSA mask of the
+social model. The result only depends on the climate config (which includes the random seed), the temperatures, the
+initial WSA mask and the number of spin-up years. spin_up() runs the spin-up once, saves the model state (see
+EcoHyd.get_state()) under a hash of these inputs, and restores it from there in every later run with the same inputs.
+
+The initial WSA mask comes from the setup of the social model, which places the farmers and picks who uses WSA at
+random, so two scenarios (or replicates) that share a climate almost never have the same mask. The cache therefore
+only helps exact re-runs, e.g. running a scenario again with the same NetLogo random seed, or a sweep repeated after a
+crash. The mask is kept in the key because the spun-up soil moisture and biomass of a field depend on whether it used
+WSA during the spin-up.
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+# bump this if the model state or the spin-up itself changes, so old cache files are not picked up
+_CACHE_VERSION = 2
+
+# states already computed in this process, by key
+_STATES = {}
+
+
+def spinup_key(config, WSA_array, avg_temp, maximum_temp, minimum_temp, n_years):
+    '''
+    Hash of everything the spun-up model state depends on, including the initial WSA mask (see the module docstring).
+    '''
+    # where the caches are kept, the number of worker processes and the NetLogo settings do not change the results
+    config = {name: value for name, value in config.items()
+              if not name.endswith('_cache_dir') and name != 'n_workers' and not name.startswith('netlogo_')}
+    key = hashlib.sha1()
+    key.update(json.dumps([_CACHE_VERSION, n_years, config], sort_keys=True, default=_to_json).encode())
+    for array in (WSA_array, avg_temp, maximum_temp, minimum_temp):
+        array = np.ascontiguousarray(array, dtype=float)
+        key.update(np.asarray(array.shape).tobytes())
+        key.update(array.tobytes())
+    return key.hexdigest()[:16]
+
+
+def spin_up(model, WSA_array, avg_temp, maximum_temp, minimum_temp, n_years=5, cache_dir=None):
+    '''
+    Spin up a freshly created EcoHyd model, or restore its spun-up state from the cache.
+
+    Parameters
+    ----------
+    model: EcoHyd
+        The model to spin up. It must not have been stepped yet.
+    WSA_array: array
+        WSA mask used in every spin-up year.
+    avg_temp, maximum_temp, minimum_temp: arrays
+        Daily temperatures (deg C) used in every spin-up year.
+    n_years: int, optional
+        Number of spin-up years.
+    cache_dir: str, optional
+        Directory to store the state in as an .npz file named after the cache key, so other runs and worker
+        processes can load it. States are only kept in memory if this is None.
+
+    Returns
+    -------
+    bool
+        True if the state was restored from the cache, False if the spin-up was run.
+    '''
+    key = spinup_key(model.config, WSA_array, avg_temp, maximum_temp, minimum_temp, n_years)
+    path = None if cache_dir is None else os.path.join(cache_dir, "spinup_" + key + ".npz")
+
+    state = _STATES.get(key)
+    if state is None and path is not None and os.path.exists(path):
+        with np.load(path) as f:
+            state = {name: f[name] for name in f.files}
+        _STATES[key] = state
+    if state is not None:
+        model.set_state(state)
+        return True
+
+    for i in range(n_years):
+        model.stepper(WSA_array, avg_temp, maximum_temp, minimum_temp)
+    state = model.get_state()
+    _STATES[key] = state
+    if path is not None:
+        _save_atomic(path, state)
+    return False
+
+
+def _to_json(value):
+    # numpy arrays and scalars in the config (e.g. the temperature shift) by value, anything else by its string
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+def _save_atomic(path, state):
+    # write to a temporary file first so parallel workers never read a half-written state
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".npz")
+    with os.fdopen(fd, "wb") as f:
+        np.savez(f, **state)
+    os.replace(tmp_path, path)
@@ -0,0 +1,142 @@
+'''
+Binary output of the results of a parameter sweep.
+
+fullModelRun used to append the summarised data of every run to a csv file, header included, which stores every number
+as text and repeats the scenario labels and the run's timestamp on every row. write_run() writes the data of one run as
+a chunk of its own in an output directory instead: a compressed .npz file with one typed array per column (text
+columns as integer codes into their categories), and a small json manifest with the columns, their types and
+categories, and the metadata of the run (e.g. the scenario labels), which is only stored once. Every chunk gets a
+unique name and is written to a temporary file first, and the manifest is written last, so any number of worker
+processes can add runs to the same directory at the same time and readers only ever see complete chunks.
+
+read_results() reads all chunks (or those whose metadata match) back into one data frame, with the metadata as
+categorical columns, i.e. the same columns as the csv output.
+'''
+
+import glob
+import json
+import os
+import tempfile
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# bump this if the layout of the chunks changes
+_FORMAT_VERSION = 1
+
+
+def write_run(output_dir, data, metadata=None):
+    '''
+    Write the data of one run as a new chunk in `output_dir`.
+
+    Parameters
+    ----------
+    output_dir: str
+        Directory of the chunks of the sweep. It is created if needed.
+    data: DataFrame
+        The data of the run. Numeric and bool columns are kept with their type, other columns are stored as
+        categories.
+    metadata: dict, optional
+        Values that are the same for the whole run (e.g. {'LeadFarmers': 5, 'ClimateScenario': 'Warm Climate'}).
+
+    Returns
+    -------
+    str
+        Path of the manifest of the chunk.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    # unique across processes and machines writing to the same directory
+    name = "run_" + str(os.getpid()) + "_" + uuid.uuid4().hex[:12]
+
+    arrays = {}
+    columns = []
+    for i, column in enumerate(data.columns):
+        values = data[column]
+        key = "c" + str(i)
+        if values.dtype.kind in "biuf":
+            arrays[key] = values.to_numpy()
+            columns.append({"name": str(column), "key": key, "dtype": arrays[key].dtype.str})
+        else:
+            categorical = pd.Categorical(values.astype(str))
+            arrays[key] = _smallest_codes(categorical.codes)
+            columns.append({"name": str(column), "key": key, "dtype": "category",
+                            "categories": [str(category) for category in categorical.categories]})
+
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=".npz.tmp")
+    with os.fdopen(fd, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, os.path.join(output_dir, name + ".npz"))
+
+    # the manifest is written last, so a chunk is only picked up once its data is complete
+    manifest = {"version": _FORMAT_VERSION, "data": name + ".npz", "n_rows": len(data), "columns": columns,
+                "metadata": dict(metadata or {})}
+    path = os.path.join(output_dir, name + ".json")
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=".json.tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f, default=_to_json)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_manifests(output_dir):
+    '''
+    Manifests of all complete chunks in `output_dir`, see write_run().
+    '''
+    manifests = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "run_*.json"))):
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") != _FORMAT_VERSION:
+            raise ValueError(path + " was written by another version of sweep_output.py")
+        manifest["path"] = path
+        manifests.append(manifest)
+    return manifests
+
+
+def read_results(output_dir, **metadata):
+    '''
+    Read the chunks in `output_dir` whose metadata match the given values (e.g. read_results(path, LeadFarmers=5)),
+    all of them by default, into one data frame. The metadata of each run are added as categorical columns.
+    '''
+    manifests = [manifest for manifest in read_manifests(output_dir)
+                 if all(manifest["metadata"].get(key) == value for key, value in metadata.items())]
+    frames = [_read_chunk(output_dir, manifest) for manifest in manifests]
+    if len(frames) == 0:
+        return pd.DataFrame()
+    results = pd.concat(frames, ignore_index=True)
+
+    # the labels of the runs as categories, so they are only stored once in memory too
+    for column in results.columns:
+        if not pd.api.types.is_numeric_dtype(results[column]) and not pd.api.types.is_bool_dtype(results[column]):
+            results[column] = results[column].astype("category")
+    return results
+
+
+def _read_chunk(output_dir, manifest):
+    # data of one chunk with its metadata as columns
+    data = {}
+    with np.load(os.path.join(output_dir, manifest["data"])) as f:
+        for column in manifest["columns"]:
+            values = f[column["key"]]
+            if column["dtype"] == "category":
+                values = pd.Categorical.from_codes(values, column["categories"])
+            data[column["name"]] = values
+    frame = pd.DataFrame(data)
+    for key, value in manifest["metadata"].items():
+        if key not in frame.columns:
+            frame[key] = value
+    return frame
+
+
+def _smallest_codes(codes):
+    # category codes in the smallest integer type that holds them (-1 is a missing value)
+    for dtype in (np.int8, np.int16, np.int32):
+        if len(codes) == 0 or codes.max() <= np.iinfo(dtype).max:
+            return codes.astype(dtype)
+    return codes.astype(np.int64)
+
+
+def _to_json(value):
+    # numpy scalars and arrays in the metadata by value, anything else by its string
+    return value.tolist() if hasattr(value, "tolist") else str(value)
@@ -0,0 +1,246 @@
+'''
+Checks that the faster code paths give the same results as the ones they replace, on an 11x11 grid:
+ - the loop ("Grid"), vectorized and Numba kernels of the soil moisture, vegetation and rainfall components
+ - re-initialising the cells whose plant functional type changed against initialising the whole component again
+ - a model run on tiles in worker processes ('n_workers') against a serial run
+ - each member of an ensemble against a model run on its own with the same seed
+ - the results written by sweep_output.py against what is read back
+
+Run with `python -m pytest test_equivalence.py` from this folder (the Numba cases are skipped without numba).
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+from landlab import RasterModelGrid
+
+from ecohydr_mod import EcoHyd
+from ensemble import EnsembleEcoHyd
+from generate_uniform_precip import _STORM_EVENT_DTYPE, storms_to_daily_depth
+from soil_moisture_dynamics import SoilMoisture
+from sweep_output import read_results, write_run
+from vegetation_dynamics import Vegetation
+
+GRID_SHAPE = (11, 11)
+
+# a short climate with a canicula, so both seasons and the dry spells are stepped
+CLIMATE = {'canicula_start': 0, 'canicula_end': 140, 'canicula_start_expected': 0, 'canicula_end_expected': 140,
+           'mean_interstorm_wet': 4 * 24, 'mean_storm_wet': 2 * 24, 'mean_raindpth_wet': 10,
+           'mean_interstorm_dry': 10 * 24, 'mean_storm_dry': 0.5 * 24, 'mean_raindpth_dry': 1,
+           'tempshift': np.zeros(365), 'grid_shape': GRID_SHAPE, 'record_years': 2}
+
+AVG_T = 23 + 3 * np.sin(np.linspace(0, 2 * np.pi, 365))
+
+SM_FIELDS = ['soil_moisture__saturation_fraction', 'soil_moisture__root_zone_leakage', 'surface__evapotranspiration',
+             'surface__runoff', 'vegetation__water_stress', 'soil_moisture__initial_saturation_fraction']
+VEG_FIELDS = ['vegetation__live_biomass', 'vegetation__dead_biomass', 'vegetation__live_leaf_area_index',
+              'vegetation__dead_leaf_area_index', 'vegetation__cover_fraction']
+
+try:
+    import numba
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# kernels compared against the loop ("Grid")
+METHODS = ["Vectorized",
+           pytest.param("Numba", marks=pytest.mark.skipif(not HAS_NUMBA, reason="numba is not installed"))]
+
+
+def wsa_mask(year=0):
+    # every third field implements WSA, a different third each year
+    return ((np.arange(GRID_SHAPE[0] * GRID_SHAPE[1]) + year) % 3 == 0).astype(float).reshape(GRID_SHAPE)
+
+
+def step_years(model, n_years):
+    return [model.stepper(wsa_mask(year), AVG_T, AVG_T + 3, AVG_T - 3) for year in range(n_years)]
+
+
+def assert_fields_equal(a, b):
+    for name in a.mg.at_cell.keys():
+        np.testing.assert_array_equal(a.mg.at_cell[name], b.mg.at_cell[name], err_msg=name)
+
+
+#---------#
+# kernels #
+#---------#
+
+def soil_moisture_grid(seed=3):
+    rng = np.random.default_rng(seed)
+    grid = RasterModelGrid((GRID_SHAPE[0] + 2, GRID_SHAPE[1] + 2), 70.)
+    n = grid.number_of_cells
+    grid.at_cell['vegetation__plant_functional_type'] = rng.choice([0, 3, 6, 1, 2], n)
+    grid.at_cell['vegetation__cover_fraction'] = rng.uniform(0, 1, n)
+    grid.at_cell['vegetation__live_leaf_area_index'] = rng.uniform(0, 3, n)
+    grid.at_cell['surface__potential_evapotranspiration_rate'] = rng.uniform(0, 8, n)
+    grid.at_cell['soil_moisture__initial_saturation_fraction'] = rng.uniform(0.05, 1, n)
+    grid.at_cell['rainfall__daily_depth'] = rng.choice([0, 0, 1, 5, 30, 200], n) * 1.0
+    return grid
+
+
+def vegetation_grid(seed=5):
+    rng = np.random.default_rng(seed)
+    grid = RasterModelGrid((GRID_SHAPE[0] + 2, GRID_SHAPE[1] + 2), 70.)
+    n = grid.number_of_cells
+    grid.at_cell['vegetation__plant_functional_type'] = rng.choice([0, 0, 3, 6, 1, 2, 4, 5], n)
+    grid.at_cell['surface__evapotranspiration'] = rng.uniform(0, 6, n)
+    grid.at_cell['surface__potential_evapotranspiration_rate'] = rng.uniform(0, 12, n)
+    grid.at_cell['surface__potential_evapotranspiration_30day_mean'] = rng.uniform(0, 8, n)
+    grid.at_cell['vegetation__water_stress'] = rng.uniform(0, 1, n)
+    grid.at_cell['surface__WSA_soilhealth'] = rng.uniform(1, 1.3, n)
+    return grid
+
+
+@pytest.mark.parametrize("method", METHODS)
+@pytest.mark.parametrize("Tb", [6., 24., 24. * 10])
+def test_soil_moisture_kernels(method, Tb):
+    grid_a, grid_b = soil_moisture_grid(), soil_moisture_grid()
+    a, b = SoilMoisture(grid_a, method="Grid"), SoilMoisture(grid_b, method=method)
+    a.Tb = b.Tb = Tb
+    for day in range(5):
+        assert a.update() == b.update()
+        for name in SM_FIELDS:
+            np.testing.assert_allclose(grid_a.at_cell[name], grid_b.at_cell[name], rtol=1e-10, atol=1e-12,
+                                       err_msg=name)
+        rain = np.random.default_rng(day).choice([0, 0, 3, 40], grid_a.number_of_cells) * 1.0
+        grid_a.at_cell['rainfall__daily_depth'][:] = rain
+        grid_b.at_cell['rainfall__daily_depth'][:] = rain
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_vegetation_kernels(method):
+    grid_a, grid_b = vegetation_grid(), vegetation_grid()
+    a = Vegetation(grid_a, method="Grid", PETthreshold_switch=1, ETthreshold_up=3.)
+    b = Vegetation(grid_b, method=method, PETthreshold_switch=1, ETthreshold_up=3.)
+    for day in range(30):
+        a.update()
+        b.update()
+        for name in VEG_FIELDS:
+            np.testing.assert_allclose(grid_a.at_cell[name], grid_b.at_cell[name], rtol=1e-12, atol=1e-12,
+                                       err_msg=name)
+        rng = np.random.default_rng(day)
+        for name in ['surface__evapotranspiration', 'vegetation__water_stress',
+                     'surface__potential_evapotranspiration_30day_mean']:
+            values = rng.uniform(0, 6, grid_a.number_of_cells)
+            grid_a.at_cell[name][:] = values
+            grid_b.at_cell[name][:] = values
+
+
+@pytest.mark.parametrize("method", METHODS)
+def test_rainfall_kernels(method):
+    rng = np.random.default_rng(7)
+    tables = []
+    for i in range(GRID_SHAPE[0] * GRID_SHAPE[1]):
+        starts = np.sort(rng.uniform(0, 200 * 24, 40))
+        storms = np.zeros(len(starts), dtype=_STORM_EVENT_DTYPE)
+        storms["start"] = starts
+        storms["end"] = starts + rng.exponential(12, len(starts))
+        storms["intensity"] = rng.exponential(0.5, len(starts))
+        tables.append(storms)
+    expected = storms_to_daily_depth(tables, 365, offset=100, season_days=200, method="Grid")
+    np.testing.assert_allclose(storms_to_daily_depth(tables, 365, offset=100, season_days=200, method=method),
+                               expected, rtol=1e-12, atol=1e-12)
+
+
+#---------------------------------#
+# incremental PFT re-initialising #
+#---------------------------------#
+
+def changed_pft(grid):
+    # a new plant functional type on every other cell
+    pft = grid.at_cell['vegetation__plant_functional_type'].copy()
+    pft[::2] = np.random.default_rng(9).choice([0, 3, 6], len(pft[::2]))
+    grid.at_cell['vegetation__plant_functional_type'] = pft
+
+
+def assert_pft_params_equal(a, b):
+    assert a._pft_params.keys() == b._pft_params.keys()
+    for name in a._pft_params:
+        np.testing.assert_array_equal(getattr(a, name), getattr(b, name), err_msg=name)
+
+
+def test_soil_moisture_pft_update():
+    grid_a, grid_b = soil_moisture_grid(), soil_moisture_grid()
+    a, b = SoilMoisture(grid_a), SoilMoisture(grid_b)
+    changed_pft(grid_a)
+    changed_pft(grid_b)
+    a.update_plant_functional_type()
+    b.initialize()
+    assert_pft_params_equal(a, b)
+    a.update()
+    b.update()
+    for name in SM_FIELDS:
+        np.testing.assert_array_equal(grid_a.at_cell[name], grid_b.at_cell[name], err_msg=name)
+
+
+def test_vegetation_pft_update():
+    grid_a, grid_b = vegetation_grid(), vegetation_grid()
+    a, b = Vegetation(grid_a, Blive_init=10.0), Vegetation(grid_b, Blive_init=10.0)
+    changed_pft(grid_a)
+    changed_pft(grid_b)
+    a.update_plant_functional_type(Blive_init=10.0, Bdead_init=450.0)
+    b.initialize(Blive_init=10.0, Bdead_init=450.0)
+    assert_pft_params_equal(a, b)
+    a.update()
+    b.update()
+    for name in VEG_FIELDS:
+        np.testing.assert_array_equal(grid_a.at_cell[name], grid_b.at_cell[name], err_msg=name)
+
+
+#-------------------------------#
+# parallel, ensemble and output #
+#-------------------------------#
+
+def test_parallel_matches_serial():
+    serial = EcoHyd(dict(CLIMATE), 20, 26, 23)
+    parallel = EcoHyd(dict(CLIMATE, n_workers=2), 20, 26, 23)
+    try:
+        for (yields_a, sm_a), (yields_b, sm_b) in zip(step_years(serial, 2), step_years(parallel, 2)):
+            np.testing.assert_array_equal(yields_a, yields_b)
+            np.testing.assert_array_equal(sm_a, sm_b)
+        assert_fields_equal(serial, parallel)
+        np.testing.assert_array_equal(serial.WSA_SM_tseries, parallel.WSA_SM_tseries)
+        np.testing.assert_array_equal(serial.rain_tseries, parallel.rain_tseries)
+    finally:
+        parallel.close()
+
+
+def test_ensemble_members_match_single_runs():
+    seeds = [10, 11, 12]
+    ensemble = EnsembleEcoHyd(dict(CLIMATE), 20, 26, 23, seeds)
+    ensemble_out = [ensemble.stepper(np.stack([wsa_mask(year + k) for k in range(len(seeds))]),
+                                     AVG_T, AVG_T + 3, AVG_T - 3) for year in range(2)]
+    for k, seed in enumerate(seeds):
+        single = EcoHyd(dict(CLIMATE, random_seed=seed), 20, 26, 23)
+        for year in range(2):
+            yields, sm = single.stepper(wsa_mask(year + k), AVG_T, AVG_T + 3, AVG_T - 3)
+            np.testing.assert_array_equal(yields, ensemble_out[year][0][k])
+            np.testing.assert_array_equal(sm, ensemble_out[year][1][k])
+        for name in single.mg.at_cell.keys():
+            np.testing.assert_array_equal(single.mg.at_cell[name], ensemble.member_view(ensemble.mg.at_cell[name])[k],
+                                          err_msg=name)
+
+
+def test_sweep_output_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    n = 40
+    runs = []
+    for combo in range(3):
+        data = pd.DataFrame({"FarmerID": np.tile(np.arange(10.), 4), "Year": np.repeat(np.arange(4), 10),
+                             "TotalYield": rng.random(n) * 1e3, "NumberofFields": rng.integers(1, 9, n),
+                             "ImplementingWSA": rng.random(n) < 0.5, "Status": rng.choice(["a", "b", "c"], n)})
+        metadata = {"LeadFarmers": [5, 10, 20][combo], "ClimateScenario": "Warm Climate", "ParamCombo": combo}
+        write_run(str(tmp_path), data, metadata)
+        runs.append((data, metadata))
+
+    assert len(read_results(str(tmp_path))) == 3 * n
+    for data, metadata in runs:
+        results = read_results(str(tmp_path), ParamCombo=metadata["ParamCombo"])
+        for column in data.columns:
+            if column == "Status":
+                assert (results[column].astype(str).to_numpy() == data[column].to_numpy()).all()
+            else:
+                np.testing.assert_array_equal(results[column].to_numpy(), data[column].to_numpy())
+                assert results[column].dtype == data[column].dtype
+        assert (results["ClimateScenario"].astype(str) == "Warm Climate").all()
+        assert (results["LeadFarmers"] == metadata["LeadFarmers"]).all()
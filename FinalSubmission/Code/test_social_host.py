@@ -0,0 +1,108 @@
+'''
+Checks of social_host.py with pynetlogo.NetLogoLink replaced by a stub, so no NetLogo (or JVM) is needed: the host
+starts, every RemoteWorkspace talks to its own workspace, and a workspace is replaced after max_runs runs.
+
+Run with `python -m pytest test_social_host.py` from this folder.
+'''
+
+import pandas as pd
+import pytest
+
+from social_host import SocialModelHost
+
+# a pynetlogo module whose NetLogoLink has the signature of pynetlogo 0.5.2 and keeps the calls it gets, so the tests
+# can report them back through the host
+FAKE_PYNETLOGO = '''
+import itertools
+
+_ids = itertools.count()
+
+
+class NetLogoLink:
+    def __init__(self, gui=False, thd=False, netlogo_home=None, jvm_path=None, jvmargs=[]):
+        self.id = next(_ids)
+        self.jvmargs = list(jvmargs)
+        self.model = None
+        self.commands = []
+
+    def load_model(self, path):
+        self.model = path
+
+    def command(self, netlogo_command):
+        if netlogo_command == "error":
+            raise ValueError("Nothing named ERROR has been defined.")
+        self.commands.append(netlogo_command)
+
+    def report(self, netlogo_reporter):
+        values = {"id": self.id, "jvmargs": self.jvmargs, "model": self.model, "commands": self.commands}
+        return values[netlogo_reporter]
+
+    def write_NetLogo_attriblist(self, agent_data, agent_name):
+        self.commands.append((agent_name, list(agent_data["who"])))
+
+    def kill_workspace(self):
+        self.commands = None
+'''
+
+
+@pytest.fixture
+def fake_pynetlogo(tmp_path, monkeypatch):
+    # on the path of the host process, whichever way multiprocessing starts it
+    (tmp_path / "pynetlogo.py").write_text(FAKE_PYNETLOGO)
+    monkeypatch.syspath_prepend(str(tmp_path))
+
+
+@pytest.fixture
+def host(fake_pynetlogo):
+    host = SocialModelHost(2, model_path="model.nlogo", max_runs=2, jvm_args=["-Xmx1g"])
+    yield host
+    host.close()
+
+
+def test_host_starts_with_jvm_args(host):
+    assert host.n_workspaces == 2
+    for i in range(2):
+        workspace = host.workspace(i)
+        assert workspace.report("jvmargs") == ["-Xmx1g"]
+        assert workspace.report("model") == "model.nlogo"
+
+
+def test_calls_go_to_their_workspace(host):
+    first, second = host.workspace(0).link(), host.workspace(1).link()
+    assert first.report("id") != second.report("id")
+    first.command("setup-landscape 51 51 800")
+    second.command("farming-decisions")
+    first.write_NetLogo_attriblist(pd.DataFrame({"who": [1, 2], "yield": [3.0, 4.0]}), "field")
+    assert first.report("commands") == ["setup-landscape 51 51 800", ("field", [1, 2])]
+    assert second.report("commands") == ["farming-decisions"]
+
+
+def test_errors_are_raised_in_the_caller(host):
+    workspace = host.workspace(0)
+    with pytest.raises(RuntimeError, match="Nothing named ERROR"):
+        workspace.command("error")
+    # the workspace is still served after an error
+    workspace.command("go")
+    assert workspace.report("commands") == ["go"]
+
+
+def test_workspace_replaced_after_max_runs(host):
+    workspace, other = host.workspace(0), host.workspace(1)
+    other_id = other.link().report("id")
+    first_id = workspace.link().report("id")
+    workspace.command("go")
+    assert workspace.link().report("id") == first_id
+    # the third run of the workspace gets a new one, with the model loaded and nothing run in it yet
+    replaced = workspace.link()
+    assert replaced.report("id") != first_id
+    assert replaced.report("model") == "model.nlogo"
+    assert replaced.report("commands") == []
+    assert other.report("id") == other_id
+
+
+def test_host_without_jvm_args(fake_pynetlogo):
+    host = SocialModelHost(1, model_path="model.nlogo")
+    try:
+        assert host.workspace(0).report("jvmargs") == []
+    finally:
+        host.close()
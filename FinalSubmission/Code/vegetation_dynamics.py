@@ -6,13 +6,19 @@ Guide to changes w.r.t. landlab default:
  Vegetation calls this way.
 -added a WSA_soilhealth 'fudge factor' that takes on a default value of 1 but can be passed in from the outside to 
  indicate how much WSA practices have increased soil health on a field, increasing net primary productivity. 
+-added a 'Vectorized' method that updates all cells at once using PFT and season masks instead of looping over
+ cells in Python. It gives the same results as the default 'Grid' method.
+-added a dtype argument, so the parameters and biomass buffers can be kept in single precision along with the grid 
+ fields (see the 'dtype' option in ecohydr_mod.py).
 '''
 
 import numpy as np
 
 from landlab import Component
 
-_VALID_METHODS = {"Grid"}
+from backends import jit
+
+_VALID_METHODS = {"Grid", "Vectorized", "Numba"}
 
 
 def assert_method_is_valid(method):
@@ -20,6 +26,108 @@ def assert_method_is_valid(method):
         raise ValueError("%s: Invalid method name" % method)
 
 
+def _update_cells(
+    PET, PET30_, ActualET, Water_stress, WSA_soilhealth, PETthreshold, Tb, Tr, vegtype, WUE_, LAI_max, cb_, cd_, ksg_,
+    kdd_, kws_, w, Tdmax, Blive_ini, Bdead_ini, LAIlive_, LAIdead_, VegCov, Blive_, Bdead_
+):
+    """Per-cell update of the biomass, the kernel of the "Grid" method. It
+    only uses scalar arithmetic on arrays, so the same code is compiled with
+    Numba for the "Numba" method (see backends.py).
+    """
+    for cell in range(len(Blive_)):
+        WUE = WUE_[cell]
+        LAImax = LAI_max[cell]
+        cb = cb_[cell]
+        cd = cd_[cell]
+        ksg = ksg_[cell]
+        kdd = kdd_[cell]
+        kws = kws_[cell]
+        # ETdmax = ETdmax_[cell]
+        LAIlive = min(cb * Blive_ini[cell], LAImax)
+        LAIdead = min(cd * Bdead_ini[cell], (LAImax - LAIlive))
+
+        # scale primary productivity by fudge factor (WSA_soilhealth > 1 if using WSA, 1 otherwise)
+        NPP = max((ActualET[cell] / (Tb + Tr)) * WUE * 24.0 * w * 1000, 0.001) * WSA_soilhealth[cell]
+        #print(NPP)
+
+        if vegtype[cell] == 0:
+            #print('PET30: ', PET30_[cell])
+            #print('threshold: ', PETthreshold)
+            if PET30_[cell] > PETthreshold:
+                # Growing Season
+                Bmax = (LAImax - LAIdead) / cb
+                Yconst = 1 / (
+                    (1 / Bmax) + (((kws * Water_stress[cell]) + ksg) / NPP)
+                )
+                Blive = (Blive_ini[cell] - Yconst) * np.exp(
+                    -(NPP / Yconst) * ((Tb + Tr) / 24.0)
+                ) + Yconst
+                Bdead = (
+                    Bdead_ini[cell]
+                    + (Blive - max(Blive * np.exp(-1 * ksg * Tb / 24.0), 0.00001))
+                ) * np.exp(-1 * kdd * min(PET[cell] / Tdmax, 1.0) * Tb / 24.0)
+            else:  # Senescense
+                Blive = max(
+                    Blive_ini[cell] * np.exp((-2) * ksg * Tb / 24.0), 1
+                )
+                Bdead = max(
+                    (
+                        Bdead_ini[cell]
+                        + (
+                            Blive_ini[cell]
+                            - (
+                                max(
+                                    Blive_ini[cell]
+                                    * np.exp((-2) * ksg * Tb / 24.0),
+                                    0.000001,
+                                )
+                            )
+                        )
+                        * np.exp(
+                            (-1)
+                            * kdd
+                            * min(PET[cell] / Tdmax, 1.0)
+                            * Tb
+                            / 24.0
+                        ),
+                        0.0,
+                    )
+                )
+
+        elif vegtype[cell] == 3 or vegtype[cell] == 6:
+            Blive = 0.0
+            Bdead = 0.0
+
+        else:
+            Bmax = LAImax / cb
+            Yconst = 1.0 / (
+                (1.0 / Bmax) + (((kws * Water_stress[cell]) + ksg) / NPP)
+            )
+            Blive = (Blive_ini[cell] - Yconst) * np.exp(
+                -(NPP / Yconst) * ((Tb + Tr) / 24.0)
+            ) + Yconst
+            Bdead = (
+                Bdead_ini[cell]
+                + (Blive - max(Blive * np.exp(-ksg * Tb / 24.0), 0.00001))
+            ) * np.exp(-kdd * min(PET[cell] / Tdmax, 1.0) * Tb / 24.0)
+
+        LAIlive = min(cb * (Blive + Blive_ini[cell]) / 2.0, LAImax)
+        LAIdead = min(
+            cd * (Bdead + Bdead_ini[cell]) / 2.0, (LAImax - LAIlive)
+        )
+        if vegtype[cell] == 0:
+            Vt = 1.0 - np.exp(-0.75 * (LAIlive + LAIdead))
+        else:
+            # Vt = 1 - np.exp(-0.75 * LAIlive)
+            Vt = 1.0
+
+        LAIlive_[cell] = LAIlive
+        LAIdead_[cell] = LAIdead
+        VegCov[cell] = Vt
+        Blive_[cell] = Blive
+        Bdead_[cell] = Bdead
+
+
 class Vegetation(Component):
     """Landlab component that simulates net primary productivity, biomass and
     leaf area index at each cell based on inputs of root-zone average soil
@@ -269,6 +377,7 @@ class Vegetation(Component):
         kdd_cc=0.013,
         kws_cc=0.02,
         method="Grid",
+        dtype=float,
         PETthreshold_switch=0,
         Tb=24.0,
         Tr=0.01
@@ -307,7 +416,11 @@ class Vegetation(Component):
         kws: float, optional
             Maximum drought induced foliage loss rate (d-1).
         method: str
-            Method name.
+            Method name. "Grid" (default) loops over the cells, "Vectorized"
+            updates all cells at once with whole-array operations.
+        dtype: data-type, optional
+            Floating point type of the parameters and biomass buffers, which
+            should match that of the grid fields.
         Tr: float, optional
             Storm duration (hours).
         Tb: float, optional
@@ -316,6 +429,14 @@ class Vegetation(Component):
             Flag to indiate the PET threshold. This controls whether the
             threshold is for growth (1) or dormancy (any other value).
         """
+        self._dtype = np.dtype(dtype)
+        if self._dtype != np.float64:
+            # landlab checks the dtype of the input fields against _info, so
+            # this instance gets a copy of it that accepts the dtype given
+            self._info = {
+                name: dict(info, dtype=self._dtype) if info["dtype"] is float else info
+                for name, info in self._info.items()
+            }
         super().__init__(grid)
 
         self.Tb = Tb
@@ -374,8 +495,8 @@ class Vegetation(Component):
 
         self._cell_values = self._grid["cell"]
 
-        self._Blive_ini = self._Blive_init * np.ones(self._grid.number_of_cells)
-        self._Bdead_ini = self._Bdead_init * np.ones(self._grid.number_of_cells)
+        self._Blive_ini = self._Blive_init * np.ones(self._grid.number_of_cells, dtype=self._dtype)
+        self._Bdead_ini = self._Bdead_init * np.ones(self._grid.number_of_cells, dtype=self._dtype)
 
     @property
     def Tb(self):
@@ -493,13 +614,15 @@ class Vegetation(Component):
             Maximum drought induced foliage loss rate (d-1).
         """
         self._vegtype = self._grid["cell"]["vegetation__plant_functional_type"]
-        self._WUE = np.choose(
-            self._vegtype,
+        # parameter tables indexed by PFT, kept for update_plant_functional_type
+        self._pft_params = {}
+        self._WUE = self._choose_pft(
+            "_WUE",
             [WUE_grass, WUE_shrub, WUE_tree, WUE_bare, WUE_shrub, WUE_tree, WUE_cc],
         )
         # Water Use Efficiency  KgCO2kg-1H2O
-        self._LAI_max = np.choose(
-            self._vegtype,
+        self._LAI_max = self._choose_pft(
+            "_LAI_max",
             [
                 LAI_max_grass,
                 LAI_max_shrub,
@@ -511,26 +634,28 @@ class Vegetation(Component):
             ],
         )
         # Maximum leaf area index (m2/m2)
-        self._cb = np.choose(
-            self._vegtype, [cb_grass, cb_shrub, cb_tree, cb_bare, cb_shrub, cb_tree, cb_cc]
+        self._cb = self._choose_pft(
+            "_cb",
+            [cb_grass, cb_shrub, cb_tree, cb_bare, cb_shrub, cb_tree, cb_cc]
         )
         # Specific leaf area for green/live biomass (m2 leaf g-1 DM)
-        self._cd = np.choose(
-            self._vegtype, [cd_grass, cd_shrub, cd_tree, cd_bare, cd_shrub, cd_tree, cd_cc]
+        self._cd = self._choose_pft(
+            "_cd",
+            [cd_grass, cd_shrub, cd_tree, cd_bare, cd_shrub, cd_tree, cd_cc]
         )
         # Specific leaf area for dead biomass (m2 leaf g-1 DM)
-        self._ksg = np.choose(
-            self._vegtype,
+        self._ksg = self._choose_pft(
+            "_ksg",
             [ksg_grass, ksg_shrub, ksg_tree, ksg_bare, ksg_shrub, ksg_tree, ksg_cc],
         )
         # Senescence coefficient of green/live biomass (d-1)
-        self._kdd = np.choose(
-            self._vegtype,
+        self._kdd = self._choose_pft(
+            "_kdd",
             [kdd_grass, kdd_shrub, kdd_tree, kdd_bare, kdd_shrub, kdd_tree, kdd_cc],
         )
         # Decay coefficient of aboveground dead biomass (d-1)
-        self._kws = np.choose(
-            self._vegtype,
+        self._kws = self._choose_pft(
+            "_kws",
             [kws_grass, kws_shrub, kws_tree, kws_bare, kws_shrub, kws_tree, kws_cc],
         )
         # Maximum drought induced foliage loss rates (d-1)
@@ -541,8 +666,56 @@ class Vegetation(Component):
         self._Tdmax = Tdmax  # Constant for dead biomass loss adjustment
         self._w = w  # Conversion factor of CO2 to dry biomass
 
-        self._Blive_ini = self._Blive_init * np.ones(self._grid.number_of_cells)
-        self._Bdead_ini = self._Bdead_init * np.ones(self._grid.number_of_cells)
+        self._Blive_ini = self._Blive_init * np.ones(self._grid.number_of_cells, dtype=self._dtype)
+        self._Bdead_ini = self._Bdead_init * np.ones(self._grid.number_of_cells, dtype=self._dtype)
+
+        self._vegtype_ini = self._vegtype.copy()
+
+    def _choose_pft(self, name, values):
+        """Store the per-PFT parameter table ``values`` under ``name`` and
+        return its value at each cell.
+        """
+        self._pft_params[name] = np.asarray(values, dtype=self._dtype)
+        return self._pft_params[name][self._vegtype]
+
+    def update_plant_functional_type(self, Blive_init=None, Bdead_init=None):
+        """Re-initialize the cells whose plant functional type changed.
+
+        Picks up the current ``vegetation__plant_functional_type`` field and
+        refreshes the per-PFT parameters only on cells whose PFT differs from
+        the last (re-)initialization. Biomass is reset on those cells only,
+        and only if initial values are given, so cells that keep their crop
+        keep growing. Thresholds and other scalar parameters are left as they
+        are.
+
+        Parameters
+        ----------
+        Blive_init: float, optional
+            Live biomass to reset the changed cells to.
+        Bdead_init: float, optional
+            Dead biomass to reset the changed cells to.
+
+        Returns
+        -------
+        ndarray of int
+            IDs of the cells whose PFT changed.
+        """
+        self._vegtype = self._grid["cell"]["vegetation__plant_functional_type"]
+        changed = np.flatnonzero(self._vegtype != self._vegtype_ini)
+        if len(changed) > 0:
+            new_vegtype = self._vegtype[changed]
+            for name, table in self._pft_params.items():
+                getattr(self, name)[changed] = table[new_vegtype]
+            self._vegtype_ini[changed] = new_vegtype
+            # after an update the biomass buffers are the grid fields, so copy
+            # before resetting to leave the fields untouched
+            if Blive_init is not None:
+                self._Blive_ini = self._Blive_ini.copy()
+                self._Blive_ini[changed] = Blive_init
+            if Bdead_init is not None:
+                self._Bdead_ini = self._Bdead_ini.copy()
+                self._Bdead_ini[changed] = Bdead_init
+        return changed
 
     def update(self):
         """Update fields with current loading conditions.
@@ -572,98 +745,107 @@ class Vegetation(Component):
         else:
             PETthreshold = self._ETthresholddown
 
-        for cell in range(0, self._grid.number_of_cells):
-            WUE = self._WUE[cell]
-            LAImax = self._LAI_max[cell]
-            cb = self._cb[cell]
-            cd = self._cd[cell]
-            ksg = self._ksg[cell]
-            kdd = self._kdd[cell]
-            kws = self._kws[cell]
-            # ETdmax = self._ETdmax[cell]
-            LAIlive = min(cb * self._Blive_ini[cell], LAImax)
-            LAIdead = min(cd * self._Bdead_ini[cell], (LAImax - LAIlive))
-
-            # scale primary productivity by fudge factor (WSA_soilhealth > 1 if using WSA, 1 otherwise)
-            NPP = max((ActualET[cell] / (Tb + Tr)) * WUE * 24.0 * self._w * 1000, 0.001) * WSA_soilhealth[cell]
-            #print(NPP)
-
-            if self._vegtype[cell] == 0:
-                #print('PET30: ', PET30_[cell])
-                #print('threshold: ', PETthreshold)
-                if PET30_[cell] > PETthreshold:
-                    # Growing Season
-                    Bmax = (LAImax - LAIdead) / cb
-                    Yconst = 1 / (
-                        (1 / Bmax) + (((kws * Water_stress[cell]) + ksg) / NPP)
-                    )
-                    Blive = (self._Blive_ini[cell] - Yconst) * np.exp(
-                        -(NPP / Yconst) * ((Tb + Tr) / 24.0)
-                    ) + Yconst
-                    Bdead = (
-                        self._Bdead_ini[cell]
-                        + (Blive - max(Blive * np.exp(-1 * ksg * Tb / 24.0), 0.00001))
-                    ) * np.exp(-1 * kdd * min(PET[cell] / self._Tdmax, 1.0) * Tb / 24.0)
-                else:  # Senescense
-                    Blive = max(
-                        self._Blive_ini[cell] * np.exp((-2) * ksg * Tb / 24.0), 1
-                    )
-                    Bdead = max(
-                        (
-                            self._Bdead_ini[cell]
-                            + (
-                                self._Blive_ini[cell]
-                                - (
-                                    max(
-                                        self._Blive_ini[cell]
-                                        * np.exp((-2) * ksg * Tb / 24.0),
-                                        0.000001,
-                                    )
-                                )
-                            )
-                            * np.exp(
-                                (-1)
-                                * kdd
-                                * min(PET[cell] / self._Tdmax, 1.0)
-                                * Tb
-                                / 24.0
-                            ),
-                            0.0,
-                        )
-                    )
-
-            elif self._vegtype[cell] == 3 or self._vegtype[cell] == 6:
-                Blive = 0.0
-                Bdead = 0.0
-
-            else:
-                Bmax = LAImax / cb
-                Yconst = 1.0 / (
-                    (1.0 / Bmax) + (((kws * Water_stress[cell]) + ksg) / NPP)
-                )
-                Blive = (self._Blive_ini[cell] - Yconst) * np.exp(
-                    -(NPP / Yconst) * ((Tb + Tr) / 24.0)
-                ) + Yconst
-                Bdead = (
-                    self._Bdead_ini[cell]
-                    + (Blive - max(Blive * np.exp(-ksg * Tb / 24.0), 0.00001))
-                ) * np.exp(-kdd * min(PET[cell] / self._Tdmax, 1.0) * Tb / 24.0)
-
-            LAIlive = min(cb * (Blive + self._Blive_ini[cell]) / 2.0, LAImax)
-            LAIdead = min(
-                cd * (Bdead + self._Bdead_ini[cell]) / 2.0, (LAImax - LAIlive)
+        if self._method == "Vectorized":
+            self._update_vectorized(
+                PET, PET30_, ActualET, Water_stress, WSA_soilhealth, PETthreshold
             )
-            if self._vegtype[cell] == 0:
-                Vt = 1.0 - np.exp(-0.75 * (LAIlive + LAIdead))
-            else:
-                # Vt = 1 - np.exp(-0.75 * LAIlive)
-                Vt = 1.0
-
-            self._LAIlive[cell] = LAIlive
-            self._LAIdead[cell] = LAIdead
-            self._VegCov[cell] = Vt
-            self._Blive[cell] = Blive
-            self._Bdead[cell] = Bdead
+            self._Blive_ini = self._Blive
+            self._Bdead_ini = self._Bdead
+            return
+
+        kernel = jit(_update_cells) if self._method == "Numba" else _update_cells
+        kernel(
+            PET,
+            PET30_,
+            ActualET,
+            Water_stress,
+            WSA_soilhealth,
+            float(PETthreshold),
+            float(Tb),
+            float(Tr),
+            self._vegtype,
+            self._WUE,
+            self._LAI_max,
+            self._cb,
+            self._cd,
+            self._ksg,
+            self._kdd,
+            self._kws,
+            float(self._w),
+            float(self._Tdmax),
+            np.asarray(self._Blive_ini, dtype=self._dtype),
+            np.asarray(self._Bdead_ini, dtype=self._dtype),
+            self._LAIlive,
+            self._LAIdead,
+            self._VegCov,
+            self._Blive,
+            self._Bdead,
+        )
 
         self._Blive_ini = self._Blive
         self._Bdead_ini = self._Bdead
+
+    def _update_vectorized(
+        self, PET, PET30_, ActualET, Water_stress, WSA_soilhealth, PETthreshold
+    ):
+        """Whole-array version of the cell loop in ``update``.
+
+        Growth, senescence and the zeroed bare/cover crop biomass are
+        evaluated for every cell and selected with PFT and season masks, so
+        the results match the "Grid" method cell by cell.
+        """
+        Tb = self._Tb
+        Tr = self._Tr
+        LAImax = self._LAI_max
+        cb = self._cb
+        cd = self._cd
+        ksg = self._ksg
+        kdd = self._kdd
+        Blive_ini = self._Blive_ini
+        Bdead_ini = self._Bdead_ini
+
+        grass = self._vegtype == 0
+        growing = grass & (PET30_ > PETthreshold)
+        senescent = grass & ~growing
+        bare = (self._vegtype == 3) | (self._vegtype == 6)
+
+        LAIlive = np.minimum(cb * Blive_ini, LAImax)
+        LAIdead = np.minimum(cd * Bdead_ini, (LAImax - LAIlive))
+
+        # scale primary productivity by fudge factor (WSA_soilhealth > 1 if using WSA, 1 otherwise)
+        NPP = (
+            np.maximum((ActualET / (Tb + Tr)) * self._WUE * 24.0 * self._w * 1000, 0.001)
+            * WSA_soilhealth
+        )
+        dead_loss = np.exp(-kdd * np.minimum(PET / self._Tdmax, 1.0) * Tb / 24.0)
+
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            # growing grass is limited by the dead leaf area, woody PFTs are not
+            Bmax = np.where(grass, (LAImax - LAIdead) / cb, LAImax / cb)
+            Yconst = 1.0 / ((1.0 / Bmax) + (((self._kws * Water_stress) + ksg) / NPP))
+            Blive_grow = (Blive_ini - Yconst) * np.exp(
+                -(NPP / Yconst) * ((Tb + Tr) / 24.0)
+            ) + Yconst
+            Bdead_grow = (
+                Bdead_ini
+                + (Blive_grow - np.maximum(Blive_grow * np.exp(-ksg * Tb / 24.0), 0.00001))
+            ) * dead_loss
+
+        senescence = Blive_ini * np.exp((-2) * ksg * Tb / 24.0)
+        Blive_sen = np.maximum(senescence, 1)
+        Bdead_sen = np.maximum(
+            Bdead_ini + (Blive_ini - np.maximum(senescence, 0.000001)) * dead_loss, 0.0
+        )
+
+        Blive = np.select([senescent, bare], [Blive_sen, 0.0], Blive_grow)
+        Bdead = np.select([senescent, bare], [Bdead_sen, 0.0], Bdead_grow)
+
+        LAIlive = np.minimum(cb * (Blive + Blive_ini) / 2.0, LAImax)
+        LAIdead = np.minimum(cd * (Bdead + Bdead_ini) / 2.0, (LAImax - LAIlive))
+        Vt = np.where(grass, 1.0 - np.exp(-0.75 * (LAIlive + LAIdead)), 1.0)
+
+        self._LAIlive[:] = LAIlive
+        self._LAIdead[:] = LAIdead
+        self._VegCov[:] = Vt
+        self._Blive[:] = Blive
+        self._Bdead[:] = Bdead